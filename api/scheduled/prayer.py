@@ -1,32 +1,19 @@
 import os
-import asyncio
-import aiohttp
-from azkar_service import load_active_groups, send_message
+from azkar_service import run_scheduled_fanout, is_continuation, run_handler
 
+JOB = 'scheduled_prayer'
+PATH = '/api/scheduled/prayer'
 
-async def send_prayer_to_all(message_text: str):
-    bot_token = os.getenv('BOT_TOKEN')
-    if not bot_token:
-        return {'ok': False, 'error': 'BOT_TOKEN not set'}
 
-    groups = load_active_groups()
-    if not groups:
-        return {'ok': True, 'sent': 0}
-
-    async with aiohttp.ClientSession() as session:
-        sent = 0
-        for gid in groups:
-            try:
-                await send_message(session, bot_token, gid, message_text)
-                sent += 1
-            except Exception:
-                pass
-        return {'ok': True, 'sent': sent}
+async def send_prayer_to_all(message_text: str, start_new: bool = True):
+    # an alert that missed the adhan expires instead of being resent
+    deadline = int(os.getenv('PRAYER_DEADLINE_SECONDS', '300'))
+    return await run_scheduled_fanout(JOB, PATH, lambda: {'text': message_text},
+                                      deadline_seconds=deadline, start_new=start_new)
 
 
 def handler(request):
     # Example text can be passed via env or defaults
     text = os.getenv('PRAYER_MESSAGE', 'وقت الصلاة، تذكروا الصلاة')
-    loop = asyncio.new_event_loop()
-    res = loop.run_until_complete(send_prayer_to_all(text))
-    return res
+    # the loop and its HTTP session outlive the call, so warm invocations reuse them
+    return run_handler(send_prayer_to_all(text, start_new=not is_continuation(request)))
@@ -1,33 +1,20 @@
-import os
-import asyncio
-import aiohttp
-from azkar_service import load_active_groups, load_azkar_texts, send_message
+from azkar_service import random_azkar_message, run_scheduled_fanout, is_continuation, run_handler
 
+JOB = 'scheduled_random'
+PATH = '/api/scheduled/random'
 
-async def send_random_to_all():
-    bot_token = os.getenv('BOT_TOKEN')
-    if not bot_token:
-        return {'ok': False, 'error': 'BOT_TOKEN not set'}
 
-    groups = load_active_groups()
-    if not groups:
-        return {'ok': True, 'sent': 0}
+def new_payload():
+    # a fresh random entry per broadcast, read straight from the compiled snapshot when there is one
+    return {'text': random_azkar_message()}
 
-    async with aiohttp.ClientSession() as session:
-        texts = load_azkar_texts()
-        text = f"**{texts[0]}**" if texts else "**سبحان الله**"
-        sent = 0
-        for gid in groups:
-            try:
-                await send_message(session, bot_token, gid, text)
-                sent += 1
-            except Exception:
-                pass
-        return {'ok': True, 'sent': sent}
+
+async def send_random_to_all(start_new: bool = True):
+    # an unfinished broadcast is continued first; a new one starts only after it is done
+    return await run_scheduled_fanout(JOB, PATH, new_payload, deadline_seconds=300, start_new=start_new)
 
 
 def handler(request):
     # Vercel python runtime calls the module; return minimal response
-    loop = asyncio.new_event_loop()
-    res = loop.run_until_complete(send_random_to_all())
-    return res
+    # the loop and its HTTP session outlive the call, so warm invocations reuse them
+    return run_handler(send_random_to_all(start_new=not is_continuation(request)))
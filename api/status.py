@@ -1,2 +1,34 @@
+import time
+from datetime import datetime
+
+from metrics import REGISTRY
+
+# scheduled broadcasts run by api/scheduled/*
+JOBS = ('scheduled_random', 'scheduled_prayer')
+
+
+def stored_state() -> dict:
+    # only on request (?state=1): loads the storage client (boto3 with S3) and reads the object store
+    try:
+        from azkar_service import stored_status
+        return stored_status(JOBS)
+    except Exception as e:
+        return {"error": str(e)}
+
+
 def handler(request):
-    return {"ok": True, "service": "azkar-bot", "time": __import__('datetime').datetime.utcnow().isoformat()}
+    # metrics of this warm instance only; the long-running bot serves its own on /metrics
+    url = str(getattr(request, 'url', None) or getattr(request, 'path', None) or '')
+    if 'format=prometheus' in url:
+        return REGISTRY.render()
+    status = {
+        "ok": True,
+        "service": "azkar-bot",
+        "time": datetime.utcnow().isoformat(),
+        "uptime": round(time.time() - REGISTRY.started, 3),
+        "metrics": REGISTRY.as_dict(),
+    }
+    if 'state=1' in url:
+        # stored group count and scheduled fanout progress, shared by every invocation
+        status["state"] = stored_state()
+    return status
@@ -1,6 +1,9 @@
 from fastapi import FastAPI, Request, BackgroundTasks, Response
+import logging
 import os
-from azkar_service import load_active_groups, save_active_groups, load_azkar_texts, send_message
+from azkar_service import ensure_group
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -15,14 +18,13 @@ async def telegram_webhook(req: Request, background_tasks: BackgroundTasks):
             chat = msg.get('chat', {})
             chat_id = chat.get('id')
             chat_type = chat.get('type')
-            # only persist groups
+            # only persist groups; chats this warm instance already knows cost no I/O
             if chat_type in ('group', 'supergroup') and chat_id:
-                groups = set(load_active_groups())
-                if int(chat_id) not in groups:
-                    groups.add(int(chat_id))
-                    save_active_groups(list(groups))
-    except Exception:
-        pass
+                await ensure_group(int(chat_id))
+    except Exception as e:
+        # not acknowledged, so Telegram delivers the update again later
+        logger.error("could not record group from update %s: %s", payload.get('update_id'), e)
+        return Response(status_code=503)
     return {'ok': True}
 
 
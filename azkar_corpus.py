@@ -0,0 +1,144 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from corpus_snapshot import MappedCorpus, default_snapshot_path, open_fresh
+from metrics import cache_counters
+
+logger = logging.getLogger(__name__)
+
+_HITS, _MISSES = cache_counters('corpus')
+
+DEFAULT_AZKAR = ("سبحان الله وبحمده",)
+MISSING_FILE_AZKAR = ("سبحان الله وبحمده", "لا إله إلا الله", "الله أكبر")
+
+
+def parse_azkar(content: str) -> Tuple[str, ...]:
+    return tuple(azkar.strip() for azkar in content.split('---') if azkar.strip())
+
+
+class CorpusSnapshot:
+    """Immutable view of Azkar.txt; replaced as a whole on reload.
+
+    `texts` is the parsed tuple, or a MappedCorpus when an up-to-date
+    compiled snapshot (corpus_snapshot.py) exists next to the file.
+    """
+
+    __slots__ = ('texts', 'version', 'signature')
+
+    def __init__(self, texts: Sequence[str], version: int, signature: Optional[tuple]):
+        self.texts = texts
+        self.version = version
+        self.signature = signature
+
+    def bold(self, index: int) -> str:
+        texts = self.texts
+        if isinstance(texts, MappedCorpus):
+            return texts.bold(index)
+        return f"**{texts[index]}**"
+
+    def random_index(self) -> int:
+        texts = self.texts
+        if isinstance(texts, MappedCorpus):
+            return texts.random_index()
+        return random.randrange(len(texts))
+
+
+class AzkarCorpus:
+    """Azkar.txt parsed once and kept in memory.
+
+    The file is re-stat'ed at most every `check_interval` seconds and only
+    re-parsed when its inode, size or mtime changed. Readers always get a
+    complete snapshot: the new one is built aside and swapped in with a
+    single assignment.
+    """
+
+    def __init__(self, path: str, check_interval: float = 2.0, snapshot_path: str = None):
+        self.path = path
+        self.snapshot_path = snapshot_path or default_snapshot_path(path)
+        self.check_interval = check_interval
+        self._snapshot = CorpusSnapshot(DEFAULT_AZKAR, 0, None)
+        self._checked_at = float('-inf')
+        self._reload_lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def refresh(self, force: bool = False) -> bool:
+        """Reload the file if it changed on disk. Returns True when a new version was loaded."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        signature = self._signature()
+        current = self._snapshot
+        if signature == current.signature and current.version:
+            _HITS.inc()
+            return False
+        _MISSES.inc()
+
+        with self._reload_lock:
+            if self._snapshot is not current:
+                return False
+            mapped = open_fresh(self.path, self.snapshot_path) if signature is not None else None
+            if signature is None:
+                texts = MISSING_FILE_AZKAR
+            elif mapped is not None and len(mapped):
+                # compiled at build time: entries are read from the mapping on access
+                texts = mapped
+            else:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        texts = parse_azkar(f.read()) or DEFAULT_AZKAR
+                except Exception as e:
+                    logger.error("could not load azkar from %s: %s", self.path, e)
+                    return False
+            self._snapshot = CorpusSnapshot(texts, current.version + 1, signature)
+            if isinstance(current.texts, MappedCorpus) and current.texts is not texts:
+                # readers take a snapshot and use it right away, so the old mapping can go
+                current.texts.close()
+
+        logger.info("loaded %d azkar from %s (version %d%s)", len(texts), self.path, current.version + 1,
+                    ', compiled snapshot' if isinstance(texts, MappedCorpus) else '')
+        return True
+
+    def snapshot(self) -> CorpusSnapshot:
+        self.refresh()
+        return self._snapshot
+
+    @property
+    def texts(self) -> Sequence[str]:
+        return self.snapshot().texts
+
+    @property
+    def count(self) -> int:
+        return len(self.snapshot().texts)
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def random_text(self) -> str:
+        snapshot = self.snapshot()
+        return snapshot.texts[snapshot.random_index()]
+
+
+_corpora: Dict[str, AzkarCorpus] = {}
+
+
+def get_corpus(path: str = 'Azkar.txt') -> AzkarCorpus:
+    """Shared corpus per file, so every caller in the process reuses one parse."""
+    key = os.path.abspath(path)
+    corpus = _corpora.get(key)
+    if corpus is None:
+        corpus = _corpora.setdefault(key, AzkarCorpus(key))
+    return corpus
@@ -1,136 +1,403 @@
 import os
 import json
-import random
-import aiohttp
 import asyncio
+import time
 from datetime import datetime
-from typing import List, Tuple, Optional
+from typing import TYPE_CHECKING, List, Tuple, Optional
 
-try:
-    import boto3
-    from botocore.exceptions import ClientError
-    _HAS_BOTO = True
-except Exception:
-    _HAS_BOTO = False
+# aiohttp is imported on the paths that talk to Telegram, not at module load:
+# status pings and webhook updates never need it
+if TYPE_CHECKING:
+    import aiohttp
+
+from file_id_cache import FileIdCache, extract_file_id
+from azkar_corpus import get_corpus
+from media_catalog import MediaCatalog
+from object_store import ObjectStore, S3ObjectStore, FileObjectStore, PreconditionFailed, HAS_BOTO
+import fanout
+from fanout import ChunkedFanout
+from rate_governor import RateGovernor
+from metrics import TELEGRAM_LATENCY, TELEGRAM_ERRORS
 
 PROJECT_ROOT = os.path.dirname(__file__)
 GROUPS_FILE = os.path.join(PROJECT_ROOT, 'active_groups.json')
+FILE_ID_CACHE_FILE = os.getenv('FILE_ID_CACHE_PATH', os.path.join(PROJECT_ROOT, 'file_ids.json'))
+
+_file_id_cache: Optional[FileIdCache] = None
+_media_catalog: Optional[MediaCatalog] = None
+_governor: Optional[RateGovernor] = None
+_store: Optional[ObjectStore] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_session: Optional['aiohttp.ClientSession'] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
 
 
 def _use_s3():
-    return _HAS_BOTO and os.getenv('S3_BUCKET') and os.getenv('AWS_ACCESS_KEY_ID')
+    return HAS_BOTO and os.getenv('S3_BUCKET') and os.getenv('AWS_ACCESS_KEY_ID')
+
+
+def get_store() -> ObjectStore:
+    """Process-wide storage client: S3 when configured, otherwise files under OBJECT_STORE_DIR (or the project root)."""
+    global _store
+    if _store is None:
+        if _use_s3():
+            _store = S3ObjectStore(
+                os.getenv('S3_BUCKET'),
+                endpoint_url=os.getenv('S3_ENDPOINT_URL'),
+                max_workers=int(os.getenv('S3_MAX_WORKERS', '8')),
+            )
+        else:
+            _store = FileObjectStore(os.getenv('OBJECT_STORE_DIR', PROJECT_ROOT))
+    return _store
+
+
+def set_store(store: Optional[ObjectStore]):
+    """Swap the storage backend, e.g. for a FileObjectStore stand-in when measuring."""
+    global _store
+    _store = store
+    _known_groups.groups = None
+
+
+def _groups_key() -> str:
+    return os.getenv('S3_KEY', 'active_groups.json') if _use_s3() else os.path.basename(GROUPS_FILE)
+
+
+def _decode_groups(raw: bytes) -> List[int]:
+    decoded = json.loads(raw.decode('utf-8'))
+    return [int(x) for x in decoded.get('groups', [])]
+
+
+def _encode_groups(groups: List[int]) -> bytes:
+    data = {'groups': groups, 'last_updated': datetime.utcnow().isoformat()}
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def _decode_versioned(found) -> Tuple[List[int], Optional[str]]:
+    if found is None:
+        return [], None
+    body, etag = found
+    return _decode_groups(body), etag
+
+
+def load_groups_versioned() -> Tuple[List[int], Optional[str]]:
+    """Group list plus its etag; (…, None) if nothing is stored yet.
+
+    Unlike load_active_groups, read errors are raised so callers never mistake them for an empty list.
+    """
+    return _decode_versioned(get_store().get(_groups_key()))
+
+
+async def aload_groups_versioned() -> Tuple[List[int], Optional[str]]:
+    return _decode_versioned(await get_store().aget(_groups_key()))
+
+
+class KnownGroups:
+    """Warm, process-wide view of the stored group list for the webhook path.
+
+    Chats already seen cost a set lookup. New chats are merged into the
+    stored list with a conditional write; when another invocation wrote in
+    between, the fresh copy is re-read, merged and retried, so concurrent
+    webhook calls never drop each other's groups. Within one instance the
+    writes are serialized: chats that arrive while a write is in flight
+    are queued and stored together by the next one.
+    """
+
+    def __init__(self, max_attempts: int = 5):
+        self.max_attempts = max_attempts
+        self.groups: Optional[set] = None
+        self.version: Optional[str] = None
+        self._queued: set = set()
+        self._lock = asyncio.Lock()
+
+    async def _reload(self):
+        groups, self.version = await aload_groups_versioned()
+        self.groups = set(groups)
+
+    async def ensure(self, chat_id: int) -> bool:
+        """Record chat_id. Returns True if this call wrote it (possibly along with queued chats)."""
+        if self.groups is not None and chat_id in self.groups:
+            return False
+        self._queued.add(chat_id)
+        async with self._lock:
+            if self.groups is None:
+                await self._reload()
+            # an earlier holder of the lock may already have stored it
+            if chat_id in self.groups:
+                self._queued.discard(chat_id)
+                return False
+            batch, self._queued = self._queued, set()
+            try:
+                await self._write(batch)
+            except BaseException:
+                # left for the next write; this call's caller sees the error
+                self._queued |= batch - {chat_id}
+                raise
+            return True
+
+    async def _write(self, batch: set):
+        store = get_store()
+        for _ in range(self.max_attempts):
+            batch = batch - self.groups
+            if not batch:
+                return
+            merged = self.groups | batch
+            try:
+                self.version = await store.aput(
+                    _groups_key(), _encode_groups(sorted(merged)),
+                    if_match=self.version, if_none_match=self.version is None
+                )
+            except PreconditionFailed:
+                await self._reload()
+                continue
+            self.groups = merged
+            return
+        raise PreconditionFailed(f"could not record groups {sorted(batch)} after {self.max_attempts} attempts")
+
+
+_known_groups = KnownGroups()
+
+
+async def ensure_group(chat_id: int) -> bool:
+    return await _known_groups.ensure(chat_id)
 
 
 def load_active_groups() -> List[int]:
     """Load active groups from S3 if configured, otherwise local file. Returns list of ints."""
-    if _use_s3():
-        s3 = boto3.client('s3')
-        bucket = os.getenv('S3_BUCKET')
-        key = os.getenv('S3_KEY', 'active_groups.json')
-        try:
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            data = obj['Body'].read()
-            decoded = json.loads(data.decode('utf-8'))
-            return [int(x) for x in decoded.get('groups', [])]
-        except ClientError:
-            return []
-        except Exception:
-            return []
+    try:
+        return load_groups_versioned()[0]
+    except Exception:
+        return []
+
 
-    # local fallback
+async def aload_active_groups() -> List[int]:
+    """load_active_groups without blocking the event loop."""
     try:
-        if os.path.exists(GROUPS_FILE):
-            with open(GROUPS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return [int(x) for x in data.get('groups', [])]
+        return (await aload_groups_versioned())[0]
     except Exception:
         return []
-    return []
 
 
 def save_active_groups(groups: List[int]):
-    data = {'groups': groups, 'last_updated': datetime.utcnow().isoformat()}
-    if _use_s3():
-        s3 = boto3.client('s3')
-        bucket = os.getenv('S3_BUCKET')
-        key = os.getenv('S3_KEY', 'active_groups.json')
-        s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(data, ensure_ascii=False).encode('utf-8'))
-        return
-
     try:
-        with open(GROUPS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        get_store().put(_groups_key(), _encode_groups(groups))
     except Exception:
-        pass
+        if _use_s3():
+            raise
+
+
+def stored_status(jobs: Tuple[str, ...]) -> dict:
+    """State every invocation shares: the stored group count and the progress of each scheduled fanout."""
+    store = get_store()
+    groups, _ = load_groups_versioned()
+    return {
+        'groups': len(groups),
+        'fanout': {job: fanout.progress(store, job) for job in jobs},
+    }
 
 
 def load_azkar_texts() -> List[str]:
-    path = os.path.join(PROJECT_ROOT, 'Azkar.txt')
-    try:
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                azkar_list = [azkar.strip() for azkar in content.split('---') if azkar.strip()]
-                return azkar_list or ["سبحان الله وبحمده"]
-    except Exception:
-        return ["سبحان الله وبحمده"]
-    return ["سبحان الله وبحمده"]
+    """Azkar texts from the shared in-memory corpus; re-parsed only when Azkar.txt changes."""
+    return list(get_corpus(os.path.join(PROJECT_ROOT, 'Azkar.txt')).texts)
+
+
+def random_azkar_message() -> str:
+    """One random entry in bold Markdown; with a compiled Azkar.snap nothing but that entry is read."""
+    snapshot = get_corpus(os.path.join(PROJECT_ROOT, 'Azkar.txt')).snapshot()
+    return snapshot.bold(snapshot.random_index())
+
+
+def get_media_catalog() -> MediaCatalog:
+    global _media_catalog
+    if _media_catalog is None:
+        _media_catalog = MediaCatalog(PROJECT_ROOT)
+    return _media_catalog
 
 
 def get_random_file(folder: str, extensions: Tuple[str, ...]) -> Tuple[Optional[str], Optional[str]]:
     try:
-        full = os.path.join(PROJECT_ROOT, folder)
-        if os.path.exists(full):
-            files = [f for f in os.listdir(full) if f.lower().endswith(extensions) and not f.endswith('.info')]
-            if files:
-                selected = random.choice(files)
-                path = os.path.join(full, selected)
-                info_path = f"{path}.info"
-                caption = None
-                if os.path.exists(info_path):
-                    try:
-                        with open(info_path, 'r', encoding='utf-8') as f:
-                            info = json.load(f)
-                            user_caption = info.get('caption', '').strip()
-                            if user_caption:
-                                caption = f"**{user_caption}**"
-                    except Exception:
-                        pass
-                return path, caption
+        catalog = get_media_catalog()
+        catalog.refresh(folder)
+        return catalog.pick(folder, extensions)
     except Exception:
         pass
     return None, None
 
 
-async def send_message(session: aiohttp.ClientSession, bot_token: str, chat_id: int, text: str, reply_markup: dict = None):
+def get_governor() -> RateGovernor:
+    global _governor
+    if _governor is None:
+        _governor = RateGovernor(max_rate=float(os.getenv('BROADCAST_RATE', '25')))
+    return _governor
+
+
+async def send_text_payload(session: 'aiohttp.ClientSession', bot_token: str, chat_id: int, payload: dict,
+                            max_wait: float = 3.0) -> bool:
+    """Send payload['text'] under the shared rate governor; a short 429 is waited out once."""
+    governor = get_governor()
+    for _ in range(2):
+        await governor.acquire(chat_id)
+        result = await send_message(session, bot_token, chat_id, payload['text'])
+        if result.get('ok'):
+            governor.on_success()
+            return True
+        retry_after = result.get('parameters', {}).get('retry_after')
+        if result.get('error_code') != 429 or not retry_after:
+            return False
+        governor.on_rate_limited(retry_after, chat_id)
+        if retry_after > max_wait:
+            return False
+    return False
+
+
+def is_continuation(request) -> bool:
+    """True for the follow-up requests a chunked broadcast sends to itself (?continue=1)."""
+    url = getattr(request, 'url', None) or getattr(request, 'path', None) or ''
+    return 'continue=1' in str(url)
+
+
+async def trigger_next_chunk(session: 'aiohttp.ClientSession', path: str) -> bool:
+    """Fire the next invocation of a scheduled endpoint. Needs FANOUT_SELF_URL or VERCEL_URL."""
+    base = os.getenv('FANOUT_SELF_URL') or (f"https://{os.getenv('VERCEL_URL')}" if os.getenv('VERCEL_URL') else '')
+    if not base:
+        return False
+    import aiohttp
+
+    headers = {}
+    if os.getenv('CRON_SECRET'):
+        headers['Authorization'] = f"Bearer {os.getenv('CRON_SECRET')}"
+    try:
+        # only the request has to leave; the follow-up runs in its own invocation
+        async with session.get(f"{base.rstrip('/')}{path}?continue=1", headers=headers,
+                               timeout=aiohttp.ClientTimeout(total=1.5)):
+            pass
+    except asyncio.TimeoutError:
+        pass
+    except Exception:
+        return False
+    return True
+
+
+async def run_scheduled_fanout(job: str, path: str, new_payload, deadline_seconds: float = 300,
+                               start_new: bool = True) -> dict:
+    """One time-boxed chunk of a scheduled text broadcast; chains itself until every group is reached."""
+    bot_token = os.getenv('BOT_TOKEN')
+    if not bot_token:
+        return {'ok': False, 'error': 'BOT_TOKEN not set'}
+
+    try:
+        # a failed read must not look like an empty list, which would end the broadcast
+        groups, _ = await aload_groups_versioned()
+    except Exception as e:
+        return {'ok': False, 'error': f'could not load groups: {e}'}
+    fanout = ChunkedFanout(
+        get_store(), job,
+        time_budget=float(os.getenv('FANOUT_TIME_BUDGET', '8')),
+        concurrency=int(os.getenv('FANOUT_CONCURRENCY', '20')),
+    )
+    session = await get_session()
+    result = await fanout.run(
+        groups, new_payload,
+        lambda chat_id, payload: send_text_payload(session, bot_token, chat_id, payload),
+        deadline_seconds=deadline_seconds, start_new=start_new,
+    )
+    if result.get('remaining'):
+        result['retriggered'] = await trigger_next_chunk(session, path)
+    return result
+
+
+def run_handler(coro):
+    """Run a handler coroutine on this process's event loop.
+
+    The loop is created on the first invocation and kept, so warm
+    invocations reuse it together with the session, governor and store
+    executor bound to it instead of building them again.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
+
+
+async def get_session() -> 'aiohttp.ClientSession':
+    """Process-wide ClientSession with keep-alive connections, reused across warm invocations."""
+    import aiohttp
+
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session_loop = loop
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=30, connect=10),
+        )
+    return _session
+
+
+async def send_message(session: 'aiohttp.ClientSession', bot_token: str, chat_id: int, text: str, reply_markup: dict = None):
     url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     data = {'chat_id': chat_id, 'text': text, 'parse_mode': 'Markdown', 'disable_web_page_preview': True}
     if reply_markup:
         data['reply_markup'] = json.dumps(reply_markup, ensure_ascii=False)
+    started = time.perf_counter()
     async with session.post(url, data=data, timeout=30) as resp:
+        TELEGRAM_LATENCY.labels('sendMessage', str(resp.status)).observe(time.perf_counter() - started)
+        if resp.status != 200:
+            TELEGRAM_ERRORS.labels(str(resp.status)).inc()
         try:
             return await resp.json()
         except Exception:
             return {'ok': False}
 
 
-async def send_file(session: aiohttp.ClientSession, bot_token: str, method: str, chat_id: int, file_path: str, caption: str = None, field_name: str = 'photo', reply_markup: dict = None):
+def get_file_id_cache(bot_token: str) -> FileIdCache:
+    """Process-wide file_id cache, reused across warm invocations."""
+    global _file_id_cache
+    namespace = bot_token.split(':', 1)[0]
+    if _file_id_cache is None or _file_id_cache.namespace != namespace:
+        _file_id_cache = FileIdCache(FILE_ID_CACHE_FILE, namespace=namespace)
+    return _file_id_cache
+
+
+async def send_file(session: 'aiohttp.ClientSession', bot_token: str, method: str, chat_id: int, file_path: str, caption: str = None, field_name: str = 'photo', reply_markup: dict = None):
     url = f"https://api.telegram.org/bot{bot_token}/{method}"
-    data = aiohttp.FormData()
-    data.add_field('chat_id', str(chat_id))
+    fields = {'chat_id': str(chat_id)}
     if caption:
-        data.add_field('caption', caption)
-        data.add_field('parse_mode', 'Markdown')
+        fields['caption'] = caption
+        fields['parse_mode'] = 'Markdown'
     if reply_markup:
-        data.add_field('reply_markup', json.dumps(reply_markup, ensure_ascii=False))
+        fields['reply_markup'] = json.dumps(reply_markup, ensure_ascii=False)
 
+    cache = get_file_id_cache(bot_token)
     try:
+        file_id = cache.lookup(file_path)
+        if file_id:
+            # already uploaded once: send by reference instead of re-uploading the bytes
+            async with session.post(url, data={**fields, field_name: file_id}, timeout=30) as resp:
+                try:
+                    result = await resp.json()
+                except Exception:
+                    return {'ok': False}
+            if result.get('ok') or 'file' not in result.get('description', '').lower():
+                return result
+            cache.invalidate(file_path)
+
+        import aiohttp
+
+        data = aiohttp.FormData()
+        for name, value in fields.items():
+            data.add_field(name, value)
         with open(file_path, 'rb') as f:
             data.add_field(field_name, f, filename=os.path.basename(file_path))
             async with session.post(url, data=data, timeout=60) as resp:
                 try:
-                    return await resp.json()
+                    result = await resp.json()
                 except Exception:
                     return {'ok': False}
+        if result.get('ok'):
+            new_file_id = extract_file_id(result['result'], field_name)
+            if new_file_id:
+                cache.store(file_path, new_file_id)
+        return result
     except Exception:
         return {'ok': False}
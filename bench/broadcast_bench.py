@@ -0,0 +1,239 @@
+"""End-to-end broadcast benchmark: AzkarBot against bench/fake_bot_api.py.
+
+Run from the project root:
+
+    python -m bench.broadcast_bench --groups 1000 10000 100000 --latency-ms 40 --save baseline
+    python -m bench.broadcast_bench --groups 1000 10000 --latency-ms 40 --compare baseline
+
+For every group count and scenario it reports the number of sends,
+throughput, p50/p95/p99 per-send latency (measured around call_api, so
+rate-governor waits and 429 retries are included), the total broadcast
+duration and the peak RSS of this process. The fake API runs in a
+subprocess so it does not count towards RSS or CPU. Results go to
+bench/baselines/<name>.json; --compare prints the change against one.
+Use --rate 25 to see the production pacing instead of raw engine speed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime
+
+import aiohttp
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+SCENARIOS = ('random', 'random-media', 'prayer')
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+async def wait_for_server(url: str, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{url}/botbench/getMe") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"fake Bot API did not start at {url}")
+            await asyncio.sleep(0.1)
+
+
+async def server_stats(session: aiohttp.ClientSession, url: str) -> dict:
+    async with session.get(f"{url}/stats") as response:
+        return await response.json()
+
+
+def make_bot(workdir: str, groups: int):
+    import main
+    from group_registry import GroupRegistry
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bot = main.AzkarBot()
+    registry = GroupRegistry(os.path.join(workdir, 'groups.json'))
+    registry.persist = False
+    registry.update(-1000000000000 - i for i in range(groups))
+    bot.active_groups = registry
+    return bot, main
+
+
+async def run_scenario(bot, main_module, scenario: str, session: aiohttp.ClientSession, url: str) -> dict:
+    latencies = array('d')
+    call_api = bot.call_api
+
+    async def timed_call_api(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await call_api(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    bot.call_api = timed_call_api
+    groups = len(bot.active_groups)
+    limited_before = bot.governor.rate_limited
+    before = await server_stats(session, url)
+    started = time.perf_counter()
+    try:
+        if scenario == 'random':
+            bot.content_turn = 0
+            await bot.send_random_content()
+        elif scenario == 'random-media':
+            bot.content_turn = 1
+            await bot.send_random_content()
+        elif scenario == 'prayer':
+            await bot.send_prayer_notification(main_module.prayer_message('Fajr'), time.time() + 3600)
+    finally:
+        duration = time.perf_counter() - started
+        bot.call_api = call_api
+    after = await server_stats(session, url)
+
+    ordered = sorted(latencies)
+    return {
+        'scenario': scenario,
+        'groups': groups,
+        'sends': len(ordered),
+        'duration_s': round(duration, 3),
+        'throughput_per_s': round(len(ordered) / duration, 1) if duration else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        'rate_limited': bot.governor.rate_limited - limited_before,
+        'forbidden': after.get('403', 0) - before.get('403', 0),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+async def run(args) -> list:
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([
+        sys.executable, '-m', 'bench.fake_bot_api', '--port', str(args.port),
+        '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+        '--rate-limit', str(args.rate_limit), '--max-rate', str(args.max_rate),
+        '--retry-after', str(args.retry_after), '--forbidden', str(args.forbidden),
+    ])
+    results = []
+    try:
+        await wait_for_server(url)
+        with tempfile.TemporaryDirectory(prefix='azkar-bench-') as workdir:
+            os.environ.update({
+                'TELEGRAM_API_URL': url,
+                'BOT_TOKEN': '1:bench',
+                'BROADCAST_RATE': str(args.rate),
+                'BROADCAST_CONCURRENCY': str(args.concurrency),
+                'OUTBOX_PATH': os.path.join(workdir, 'outbox.sqlite3'),
+                'FILE_ID_CACHE_PATH': os.path.join(workdir, 'file_ids.json'),
+                'GROUP_SETTINGS_PATH': os.path.join(workdir, 'group_settings.json'),
+                'ROTATION_PATH': os.path.join(workdir, 'rotation.bin'),
+                'CHAT_HEALTH_PATH': os.path.join(workdir, 'chat_health.json'),
+                # main configures logging on import: keep the bench's log out of the tracked bot.log
+                'LOG_FILE': os.path.join(workdir, 'bot.log'),
+            })
+            async with aiohttp.ClientSession() as stats_session:
+                for groups in args.groups:
+                    for scenario in args.scenarios:
+                        bot, main_module = make_bot(workdir, groups)
+                        bot.session = aiohttp.ClientSession(
+                            connector=aiohttp.TCPConnector(limit=100, limit_per_host=max(10, args.concurrency)),
+                            timeout=aiohttp.ClientTimeout(total=30, connect=10),
+                        )
+                        try:
+                            result = await run_scenario(bot, main_module, scenario, stats_session, url)
+                        finally:
+                            await bot.session.close()
+                            bot.outbox.close()
+                        results.append(result)
+                        print(format_row(result), flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+COLUMNS = ('scenario', 'groups', 'sends', 'duration_s', 'throughput_per_s',
+           'p50_ms', 'p95_ms', 'p99_ms', 'rate_limited', 'peak_rss_mb')
+
+
+def format_row(result: dict) -> str:
+    return '  '.join(f"{key}={result[key]}" for key in COLUMNS)
+
+
+def save_baseline(name: str, results: list, args):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    data = {
+        'created': datetime.now().astimezone().isoformat(),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()} ({os.cpu_count()} cpus)",
+        'settings': {k: v for k, v in vars(args).items() if k not in ('save', 'compare')},
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    print(f"saved {path}")
+
+
+def compare_baseline(name: str, results: list):
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = {(r['scenario'], r['groups']): r for r in json.load(f)['results']}
+    for result in results:
+        old = baseline.get((result['scenario'], result['groups']))
+        if old is None:
+            print(f"{result['scenario']}/{result['groups']}: not in baseline {name}")
+            continue
+        changes = []
+        for key in ('duration_s', 'throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb'):
+            if old[key]:
+                changes.append(f"{key} {old[key]} -> {result[key]} ({(result[key] - old[key]) / old[key]:+.1%})")
+        print(f"{result['scenario']}/{result['groups']}: " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--groups', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=['random', 'prayer'])
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    parser.add_argument('--max-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--forbidden', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=0.0, help='BROADCAST_RATE for the bot (0 = unlimited)')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--save', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save:
+        save_baseline(args.save, results, args)
+    if args.compare:
+        compare_baseline(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Local stand-in for the Telegram Bot API, for load tests that must not reach real chats.
+
+    python -m bench.fake_bot_api --port 8081 --latency-ms 40 --jitter-ms 20 \
+        --max-rate 30 --retry-after 1 --forbidden 0.01
+
+Implements getMe, getUpdates, setWebhook, deleteWebhook, sendMessage, sendPhoto, sendVoice
+and sendAudio with the same response shapes as the real API. It can
+inject 429s (randomly, or when the global request rate passes
+--max-rate) and 403s for a deterministic subset of chats. GET /stats
+returns the counters.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import web
+
+MEDIA_FIELDS = {'sendPhoto': 'photo', 'sendVoice': 'voice', 'sendAudio': 'audio'}
+
+
+class FakeBotApi:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_limit: float = 0.0,
+                 max_rate: float = 0.0, retry_after: int = 1, forbidden: float = 0.0, seed: int = 1):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_limit = rate_limit
+        self.max_rate = max_rate
+        self.retry_after = retry_after
+        self.forbidden = forbidden
+        self.random = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.counts = Counter()
+        self._window = deque()
+
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self.app.router.add_get('/stats', self.stats)
+
+    def _is_forbidden(self, chat_id: int) -> bool:
+        # the same chats are "blocked" on every run with the same settings
+        return (chat_id * 2654435761) % 10000 < self.forbidden * 10000
+
+    def _over_rate(self, now: float) -> bool:
+        if not self.max_rate:
+            return False
+        window = self._window
+        while window and window[0] <= now - 1.0:
+            window.popleft()
+        if len(window) >= self.max_rate:
+            return True
+        window.append(now)
+        return False
+
+    @staticmethod
+    def _error(status: int, description: str, **parameters) -> web.Response:
+        body = {'ok': False, 'error_code': status, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=status)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(request.query)
+        if request.method == 'POST':
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        self.counts[method] += 1
+
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {'id': 1, 'is_bot': True, 'username': 'fake_bot'}})
+        if method == 'getUpdates':
+            # behave like an idle long poll without holding the client for the full timeout
+            await asyncio.sleep(min(float(params.get('timeout', 0) or 0), 0.5))
+            return web.json_response({'ok': True, 'result': []})
+        if method in ('setWebhook', 'deleteWebhook'):
+            return web.json_response({'ok': True, 'result': True})
+        if method != 'sendMessage' and method not in MEDIA_FIELDS:
+            return self._error(404, 'Not Found: method not found')
+
+        delay = self.latency + self.random.uniform(0, self.jitter) if self.latency or self.jitter else 0
+        if delay:
+            await asyncio.sleep(delay)
+
+        chat_id = int(params.get('chat_id', 0))
+        if self._over_rate(time.monotonic()) or (self.rate_limit and self.random.random() < self.rate_limit):
+            self.counts['429'] += 1
+            return self._error(429, f'Too Many Requests: retry after {self.retry_after}', retry_after=self.retry_after)
+        if self._is_forbidden(chat_id):
+            self.counts['403'] += 1
+            return self._error(403, 'Forbidden: bot was kicked from the group chat')
+
+        message = {'message_id': next(self.message_ids), 'chat': {'id': chat_id, 'type': 'supergroup'},
+                   'date': int(time.time())}
+        field = MEDIA_FIELDS.get(method)
+        if field:
+            value = params.get(field)
+            file_id = value if isinstance(value, str) else f"fake-{field}-{next(self.file_ids)}"
+            media = {'file_id': file_id, 'file_unique_id': file_id}
+            message[field] = [media] if field == 'photo' else media
+        else:
+            message['text'] = params.get('text', '')
+        self.counts['ok'] += 1
+        return web.json_response({'ok': True, 'result': message})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='probability of a random 429')
+    parser.add_argument('--max-rate', type=float, default=0.0, help='requests/s before every send gets 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--forbidden', type=float, default=0.0, help='share of chats answering 403')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.latency_ms, args.jitter_ms, args.rate_limit, args.max_rate,
+                     args.retry_after, args.forbidden, args.seed)
+    web.run_app(api.app, host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == '__main__':
+    main()
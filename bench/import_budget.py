@@ -0,0 +1,112 @@
+"""Cold-start check for the serverless entry points in api/.
+
+Run from the project root (exits 1 when an entry point is over budget):
+
+    python -m bench.import_budget
+    python -m bench.import_budget --top 15 --scale 2   # slower CI machine
+
+Each entry point is loaded in a fresh interpreter under `python -X
+importtime`, the way the platform loads it on a cold start. The check
+fails when loading takes longer than the budget, or when it pulls in a
+module that only some requests need (boto3, aiohttp, ...). The slowest
+imports are listed so a regression is easy to trace to its source.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point -> (budget in ms, modules it must not import at load time)
+BUDGETS = {
+    'api/status.py': (60, ('asyncio', 'aiohttp', 'boto3', 'botocore', 'fastapi')),
+    'api/scheduled/random.py': (150, ('aiohttp', 'boto3', 'botocore')),
+    'api/scheduled/prayer.py': (150, ('aiohttp', 'boto3', 'botocore')),
+    # FastAPI itself dominates; the budget is for what the bot adds on top
+    'api/webhook.py': (600, ('aiohttp', 'boto3', 'botocore')),
+}
+
+MARKER = '--- entry point ---'
+
+CHILD = '''
+import importlib.util, json, sys, time
+sys.path.insert(0, {root!r})
+print({marker!r}, file=sys.stderr, flush=True)
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('entry', {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def parse_importtime(stderr: str):
+    """(cumulative µs, module) of each import made after the marker, from -X importtime output."""
+    entries = []
+    seen_marker = False
+    for line in stderr.splitlines():
+        if line.strip() == MARKER:
+            seen_marker = True
+            continue
+        if not seen_marker or not line.startswith('import time:'):
+            continue
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # the header line
+        # the name is indented by two spaces per nesting level after a single leading space
+        entries.append((int(parts[1]), parts[2][1:].rstrip()))
+    return entries
+
+
+def measure(path: str) -> dict:
+    code = CHILD.format(root=ROOT, marker=MARKER, path=os.path.join(ROOT, path))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'failed'}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['imports'] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('entries', nargs='*', help='entry points to check (default: all)')
+    parser.add_argument('--top', type=int, default=8, help='slowest imports to list per entry point')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every budget (slow machines)')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.entries or BUDGETS:
+        budget, forbidden = BUDGETS.get(path, (float('inf'), ()))
+        budget *= args.scale
+        result = measure(path)
+        if 'error' in result:
+            if result['error'].startswith('ModuleNotFoundError'):
+                # a dependency of the platform (e.g. fastapi) is not installed here
+                print(f"{path}: skipped ({result['error']})")
+            else:
+                failed = True
+                print(f"{path}: FAIL ({result['error']})")
+            continue
+
+        loaded = sorted(set(result['modules']) & set(forbidden))
+        over = result['ms'] > budget
+        status = 'FAIL' if over or loaded else 'ok'
+        failed |= status == 'FAIL'
+        print(f"{path}: {result['ms']:.1f} ms (budget {budget:.0f} ms) {status}")
+        if loaded:
+            print(f"  imports at load time: {', '.join(loaded)}")
+        # top-level imports only: nested ones are already in their parent's cumulative time
+        top = sorted((e for e in result['imports'] if not e[1].startswith(' ')), reverse=True)[:args.top]
+        for cumulative_us, name in top:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from log_pipeline import ErrorSampler, log_sampled
+from metrics import REGISTRY, DURATION_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_DURATION = REGISTRY.histogram(
+    'azkar_broadcast_duration_seconds', 'Wall time of a whole broadcast', ('job',), buckets=DURATION_BUCKETS
+)
+BROADCAST_PENDING = REGISTRY.gauge('azkar_broadcast_pending_chats', 'Chats not yet attempted in running broadcasts', ('job',))
+BROADCAST_SENDS = REGISTRY.counter('azkar_broadcast_sends_total', 'Broadcast sends by job and result', ('job', 'result'))
+
+
+@dataclass
+class BroadcastReport:
+    job_id: str
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    duration: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'total': self.total,
+            'sent': self.succeeded,
+            'failed': self.failed,
+            'duration': round(self.duration, 3),
+        }
+
+
+class BroadcastEngine:
+    """Fans a per-chat send coroutine out over a fixed pool of workers.
+
+    `send(chat_id)` should return a truthy value (usually the message id) on
+    success; falsy results and exceptions are counted as failures.
+    `on_delivered(chat_id)`, if given, is called once each chat has been attempted.
+    Pacing is left to `send` (the bot paces every call through its RateGovernor).
+    """
+
+    def __init__(self, concurrency: int = 20):
+        self.concurrency = max(1, int(concurrency))
+        self.stopping = False
+
+    def stop(self):
+        """Stop handing out chats; broadcasts in progress end after their current sends."""
+        self.stopping = True
+
+    async def run(self, job_id, chat_ids, send, on_delivered=None) -> BroadcastReport:
+        chat_ids = list(chat_ids)
+        report = BroadcastReport(job_id=job_id, total=len(chat_ids))
+        if not chat_ids:
+            return report
+
+        started = time.monotonic()
+        pending = iter(chat_ids)
+        queue_depth = BROADCAST_PENDING.labels(job_id)
+        queue_depth.inc(len(chat_ids))
+
+        async def worker():
+            # the iterator is shared, so each chat is taken by exactly one worker
+            for chat_id in pending:
+                if self.stopping:
+                    break
+                try:
+                    result = await send(chat_id)
+                except Exception as e:
+                    log_sampled(logger, logging.ERROR, type(e).__name__, "send to %s failed: %s", chat_id, e)
+                    result = None
+                if result:
+                    report.succeeded += 1
+                else:
+                    report.failed += 1
+                # a send cut short by shutdown stays pending so it is retried on resume
+                if on_delivered is not None and (result or not self.stopping):
+                    on_delivered(chat_id)
+                queue_depth.dec()
+
+        workers = min(self.concurrency, len(chat_ids))
+        # per-chat errors of this broadcast are sampled and summarised instead of logged one by one
+        with ErrorSampler(f"broadcast {job_id}", logger=logger):
+            await asyncio.gather(*(worker() for _ in range(workers)))
+
+        report.duration = time.monotonic() - started
+        # chats left behind by stop() are no longer queued here
+        queue_depth.dec(report.total - report.succeeded - report.failed)
+        BROADCAST_DURATION.labels(job_id).observe(report.duration)
+        BROADCAST_SENDS.labels(job_id, 'sent').inc(report.succeeded)
+        BROADCAST_SENDS.labels(job_id, 'failed').inc(report.failed)
+        logger.info(
+            "broadcast %s: %d/%d sent, %d failed in %.2fs",
+            job_id, report.succeeded, report.total, report.failed, report.duration
+        )
+        return report
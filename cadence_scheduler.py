@@ -0,0 +1,271 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, fields, replace
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_LAG = REGISTRY.histogram(
+    'azkar_scheduler_lag_seconds', 'Actual fire time minus the planned second', ('kind',)
+)
+
+
+@dataclass(frozen=True)
+class Cadence:
+    """When a group receives scheduled content. Groups with equal cadences share one cohort."""
+    interval: int = 300                      # seconds between random azkar, 0 disables
+    timezone: str = 'Africa/Cairo'           # for morning/evening wall-clock times
+    morning: Tuple[Tuple[int, int], ...] = ((5, 30), (7, 0), (8, 0))
+    evening: Tuple[Tuple[int, int], ...] = ((18, 0), (19, 0), (20, 0))
+    prayer_offset: int = 5                   # minutes before the adhan
+    after_prayer: int = 20                   # minutes after the adhan
+
+    @classmethod
+    def from_dict(cls, data: dict, base: 'Cadence' = None) -> 'Cadence':
+        known = {f.name for f in fields(cls)}
+        values = {k: v for k, v in data.items() if k in known}
+        for key in ('morning', 'evening'):
+            if key in values:
+                values[key] = tuple(tuple(t) for t in values[key])
+        return replace(base or cls(), **values)
+
+
+class TimingWheel:
+    """Entries bucketed by whole second, with a heap of the occupied seconds.
+
+    schedule() is O(1) into an existing bucket (O(log buckets) for a new
+    one) and pop_due() costs O(expired entries), however many are pending.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[int, list] = {}
+        self._seconds: List[int] = []
+
+    def __len__(self):
+        return sum(len(b) for b in self._buckets.values())
+
+    def schedule(self, when: float, entry):
+        second = int(when)
+        bucket = self._buckets.get(second)
+        if bucket is None:
+            bucket = self._buckets[second] = []
+            heapq.heappush(self._seconds, second)
+        bucket.append(entry)
+
+    def next_due(self) -> Optional[int]:
+        return self._seconds[0] if self._seconds else None
+
+    def pop_due(self, now: float) -> List[tuple]:
+        """[(second, entry), ...] for every entry due at or before `now`."""
+        due = []
+        while self._seconds and self._seconds[0] <= now:
+            second = heapq.heappop(self._seconds)
+            due.extend((second, entry) for entry in self._buckets.pop(second))
+        return due
+
+
+class CadenceScheduler:
+    """Per-group cadences on a single timing wheel.
+
+    Wheel entries belong to cohorts (all groups sharing a Cadence), not to
+    individual groups, so 100k groups on the default cadence cost a handful
+    of entries. Everything due in the same second for the same kind is
+    merged into one `dispatch(kind, chat_ids, extra)` call.
+    """
+
+    def __init__(self, members: Callable[[], Iterable[int]], dispatch, default: Cadence = None,
+                 settings_path: str = 'group_settings.json'):
+        self._all_members = members
+        self.dispatch = dispatch
+        self.default = default or Cadence()
+        self.settings_path = settings_path
+        self.wheel = TimingWheel()
+        self._overrides: Dict[int, Cadence] = {}
+        self._cohorts: Dict[Cadence, Set[int]] = {}
+        self._generations: Dict[Cadence, int] = {}
+        self._running: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._prayer_events: List[Tuple[str, datetime]] = []
+        self._queued_prayers: Set[tuple] = set()
+        self._started = False
+
+    # -- group settings ----------------------------------------------------
+
+    def load_settings(self):
+        if not os.path.exists(self.settings_path):
+            return
+        try:
+            with open(self.settings_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            for chat_id, settings in data.get('groups', {}).items():
+                self.set_cadence(int(chat_id), Cadence.from_dict(settings, self.default), persist=False)
+        except Exception as e:
+            logger.error("could not load group settings: %s", e)
+
+    def save_settings(self):
+        base = self.default.__dict__
+        data = {'groups': {
+            str(chat_id): {k: v for k, v in cadence.__dict__.items() if v != base[k]}
+            for chat_id, cadence in self._overrides.items()
+        }}
+        tmp_path = f"{self.settings_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.settings_path)
+
+    def cadence_of(self, chat_id: int) -> Cadence:
+        return self._overrides.get(chat_id, self.default)
+
+    def set_cadence(self, chat_id: int, cadence: Optional[Cadence], persist: bool = True):
+        """Move a group to another cadence (None or the default resets it)."""
+        old = self._overrides.pop(chat_id, None)
+        if old is not None:
+            members = self._cohorts[old]
+            members.discard(chat_id)
+            if not members:
+                # entries already on the wheel for this cohort become stale
+                del self._cohorts[old]
+                self._generations[old] = self._generations.get(old, 0) + 1
+
+        if cadence is not None and cadence != self.default:
+            self._overrides[chat_id] = cadence
+            if cadence not in self._cohorts:
+                self._cohorts[cadence] = set()
+                # before start() the cohort is picked up there with every other one
+                if self._started:
+                    self._schedule_cohort(cadence, time.time())
+            self._cohorts[cadence].add(chat_id)
+
+        if persist:
+            self.save_settings()
+
+    def members(self, cadence: Cadence) -> List[int]:
+        if cadence == self.default:
+            return [g for g in self._all_members() if g not in self._overrides]
+        return list(self._cohorts.get(cadence, ()))
+
+    # -- wheel entries -----------------------------------------------------
+
+    def _entry(self, kind: str, cadence: Cadence, extra=None):
+        return kind, cadence, self._generations.get(cadence, 0), extra
+
+    def _push(self, when: float, kind: str, cadence: Cadence, extra=None):
+        next_due = self.wheel.next_due()
+        self.wheel.schedule(when, self._entry(kind, cadence, extra))
+        if next_due is None or when < next_due:
+            self._wakeup.set()
+
+    @staticmethod
+    def _next_wall_time(cadence: Cadence, hour: int, minute: int, now: float) -> float:
+        tz = ZoneInfo(cadence.timezone)
+        local_now = datetime.fromtimestamp(now, tz)
+        target = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if target.timestamp() <= now:
+            target = (target + timedelta(days=1)).replace(hour=hour, minute=minute)
+        return target.timestamp()
+
+    def _schedule_random(self, cadence: Cadence, now: float):
+        if cadence.interval > 0:
+            # aligned to the interval so cohorts with equal intervals fire in the same second
+            self._push((now // cadence.interval + 1) * cadence.interval, 'random', cadence)
+
+    def _schedule_cohort(self, cadence: Cadence, now: float):
+        self._schedule_random(cadence, now)
+        for kind in ('morning', 'evening'):
+            for hour, minute in getattr(cadence, kind):
+                self._push(self._next_wall_time(cadence, hour, minute, now), kind, cadence, (hour, minute))
+        for prayer, adhan in self._prayer_events:
+            self._schedule_prayer(cadence, prayer, adhan, now)
+
+    def _schedule_prayer(self, cadence: Cadence, prayer: str, adhan: datetime, now: float):
+        alert = adhan.timestamp() - cadence.prayer_offset * 60
+        if alert > now:
+            self._push(alert, 'prayer', cadence, (prayer, adhan.timestamp(), cadence.prayer_offset))
+        after = adhan.timestamp() + cadence.after_prayer * 60
+        if after > now:
+            self._push(after, 'after_prayer', cadence, (prayer, after))
+
+    def schedule_prayers(self, adhans: Dict[str, datetime]):
+        """Queue prayer alerts for every cohort; `adhans` maps prayer -> aware adhan datetime.
+
+        A prayer already queued for the same local date is not queued twice.
+        """
+        now = time.time()
+        events = [(prayer, adhan) for prayer, adhan in adhans.items()
+                  if (prayer, adhan.date()) not in self._queued_prayers]
+        self._queued_prayers.update((prayer, adhan.date()) for prayer, adhan in events)
+        self._prayer_events = [(p, a) for p, a in self._prayer_events if a.timestamp() > now] + events
+        for cadence in [self.default, *self._cohorts]:
+            for prayer, adhan in events:
+                self._schedule_prayer(cadence, prayer, adhan, now)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        now = time.time()
+        for cadence in [self.default, *self._cohorts]:
+            self._schedule_cohort(cadence, now)
+
+    # -- firing ------------------------------------------------------------
+
+    def _reschedule(self, kind: str, cadence: Cadence, extra, now: float):
+        if kind == 'random':
+            self._schedule_random(cadence, now)
+        elif kind in ('morning', 'evening'):
+            hour, minute = extra
+            self._push(self._next_wall_time(cadence, hour, minute, now + 1), kind, cadence, extra)
+
+    def fire_due(self, now: float) -> List[tuple]:
+        """Pop everything due and return merged batches [(kind, extra, planned_second, chat_ids)]."""
+        batches: Dict[tuple, list] = {}
+        for second, (kind, cadence, generation, extra) in self.wheel.pop_due(now):
+            if generation != self._generations.get(cadence, 0):
+                continue
+            if cadence != self.default and cadence not in self._cohorts:
+                continue
+            self._reschedule(kind, cadence, extra, now)
+            # random/morning/evening batches merge across cohorts; prayers stay per prayer
+            key = (kind, extra if kind in ('prayer', 'after_prayer') else None)
+            batch = batches.setdefault(key, [second, []])
+            batch[1].extend(self.members(cadence))
+        return [(kind, extra, second, chat_ids) for (kind, extra), (second, chat_ids) in batches.items()]
+
+    async def _run_batch(self, kind: str, extra, chat_ids: List[int]):
+        exclusive = kind == 'random'
+        if exclusive:
+            if kind in self._running:
+                logger.warning("skipping %s batch: previous one still running", kind)
+                return
+            self._running.add(kind)
+        try:
+            await self.dispatch(kind, chat_ids, extra)
+        except Exception as e:
+            logger.error("cadence dispatch %s failed: %s", kind, e)
+        finally:
+            if exclusive:
+                self._running.discard(kind)
+
+    async def run(self, is_running: Callable[[], bool] = lambda: True):
+        while is_running():
+            now = time.time()
+            for kind, extra, planned, chat_ids in self.fire_due(now):
+                SCHEDULER_LAG.labels(kind).observe(max(0.0, now - planned))
+                if chat_ids:
+                    asyncio.create_task(self._run_batch(kind, extra, chat_ids))
+
+            next_due = self.wheel.next_due()
+            delay = 1.0 if next_due is None else max(0.0, next_due - time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, 60.0))
+            except asyncio.TimeoutError:
+                pass
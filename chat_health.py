@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+CHAT_FAILURES = REGISTRY.counter('azkar_chat_failures_total', 'Failed sends by chat health verdict', ('verdict',))
+
+OK = 'ok'
+GONE = 'gone'          # the bot can never post there again: drop the chat
+MIGRATED = 'migrated'  # group became a supergroup with a new id
+FAILING = 'failing'    # the chat refuses for now (rights, slow mode, ...): back off
+IGNORED = 'ignored'    # not the chat's fault (network, 429, 5xx, a bad file)
+
+# 400 descriptions meaning the chat is gone for good
+GONE_ERRORS = (
+    'chat not found',
+    'group chat was deactivated',
+    'peer_id_invalid',
+    'bot was kicked',
+    'user is deactivated',
+    'channel_private',
+)
+# 400 descriptions that are about the request, not the chat
+REQUEST_ERRORS = (
+    'file',
+    'parse entities',
+    'message is too long',
+    'wrong type of the web page content',
+)
+
+
+def classify(status: Optional[int], result: Optional[dict]) -> Tuple[str, Optional[int]]:
+    """(verdict, new chat id for MIGRATED) of one Bot API response."""
+    if status == 200 and result and result.get('ok'):
+        return OK, None
+    if status is None or result is None or status == 429 or status >= 500:
+        return IGNORED, None
+    if status == 403:
+        # kicked, blocked or deactivated
+        return GONE, None
+    new_chat_id = result.get('parameters', {}).get('migrate_to_chat_id')
+    if new_chat_id:
+        return MIGRATED, int(new_chat_id)
+    description = result.get('description', '').lower()
+    if any(error in description for error in GONE_ERRORS):
+        return GONE, None
+    if status == 400 and any(error in description for error in REQUEST_ERRORS):
+        return IGNORED, None
+    return FAILING, None
+
+
+class ChatHealth:
+    """Consecutive-failure counts and retry times for chats that keep refusing sends.
+
+    Only failing chats have an entry, so the common case (a healthy chat)
+    is one dict miss. A chat that fails is skipped by broadcasts for
+    `base_delay * 2**(failures - 1)` seconds (capped at `max_delay`);
+    after `give_up_after` consecutive failures it is reported as gone.
+    Entries are kept as [failures, retry_at] and saved as JSON.
+    """
+
+    def __init__(self, path: Optional[str] = 'chat_health.json', base_delay: float = 300.0,
+                 max_delay: float = 86400.0, give_up_after: int = 12):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.give_up_after = give_up_after
+        self._failing: Dict[int, List[float]] = {}
+        self.dirty = False
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._failing)
+
+    def record_success(self, chat_id: int):
+        if self._failing.pop(chat_id, None) is not None:
+            self.dirty = True
+
+    def record_failure(self, chat_id: int, now: float = None) -> bool:
+        """Back the chat off. Returns True once it has failed too often to keep."""
+        now = time.time() if now is None else now
+        entry = self._failing.get(chat_id)
+        failures = entry[0] + 1 if entry else 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        self._failing[chat_id] = [failures, now + delay]
+        self.dirty = True
+        return failures >= self.give_up_after
+
+    def forget(self, chat_id: int):
+        self.record_success(chat_id)
+
+    def is_due(self, chat_id: int, now: float = None) -> bool:
+        entry = self._failing.get(chat_id)
+        return entry is None or entry[1] <= (time.time() if now is None else now)
+
+    def filter(self, chat_ids: Iterable[int], now: float = None) -> List[int]:
+        """The chats a broadcast should try now; backed-off chats are left out up front."""
+        failing = self._failing
+        if not failing:
+            return list(chat_ids)
+        now = time.time() if now is None else now
+        return [c for c in chat_ids if c not in failing or failing[c][1] <= now]
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            'failing': len(self._failing),
+            'backed_off': sum(1 for _, retry_at in self._failing.values() if retry_at > now),
+        }
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        self.dirty = False
+        data = {str(chat_id): entry for chat_id, entry in self._failing.items()}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.dirty = True
+            logger.error("could not save chat health to %s: %s", self.path, e)
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._failing = {int(chat_id): [int(entry[0]), float(entry[1])] for chat_id, entry in data.items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("could not load chat health from %s: %s", self.path, e)
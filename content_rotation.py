@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+from array import array
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MASK32 = 0xFFFFFFFF
+FEISTEL_ROUNDS = 4
+MAGIC = b'AZROT1\n'
+
+
+def _mix(value: int, key: int) -> int:
+    """32-bit integer hash (murmur3 finaliser) of `value` keyed by `key`."""
+    x = (value ^ key) & MASK32
+    x ^= x >> 16
+    x = (x * 0x85EBCA6B) & MASK32
+    x ^= x >> 13
+    x = (x * 0xC2B2AE35) & MASK32
+    x ^= x >> 16
+    return x
+
+
+def hash_domain(domain: str) -> int:
+    """Stable 32-bit key for a domain name (str hash() is salted per process)."""
+    key = 0x811C9DC5
+    for byte in domain.encode('utf-8'):
+        key = ((key ^ byte) * 0x01000193) & MASK32
+    return key
+
+
+def _half_bits(n: int) -> int:
+    """Half-width of the smallest even-bit power-of-two domain holding `n` items."""
+    bits = max(2, (n - 1).bit_length())
+    return (bits + 1) // 2
+
+
+def permute(index: int, n: int, seed: int) -> int:
+    """Position `index` of a seeded permutation of range(n), in O(1) expected time and no memory.
+
+    A balanced Feistel network shuffles the surrounding 4**h domain; values
+    that land outside range(n) are fed back in (cycle walking), which keeps
+    it a bijection on range(n). The domain is less than 4n, so that takes
+    under four rounds on average.
+    """
+    half = _half_bits(n)
+    mask = (1 << half) - 1
+    value = index
+    while True:
+        left, right = value >> half, value & mask
+        for round_key in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ (_mix(right, seed + round_key * 0x9E3779B9) & mask)
+        value = (left << half) | right
+        if value < n:
+            return value
+
+
+class _Bag:
+    """Per-group permutation state for one content domain: 12 bytes per group."""
+
+    __slots__ = ('seeds', 'cursors', 'sizes')
+
+    def __init__(self):
+        self.seeds = array('I')
+        self.cursors = array('I')
+        self.sizes = array('I')
+
+    def grow(self, slots: int):
+        missing = slots - len(self.seeds)
+        if missing > 0:
+            zeros = array('I', bytes(4 * missing))
+            self.seeds.extend(zeros)
+            self.cursors.extend(zeros)
+            self.sizes.extend(zeros)
+
+
+class ContentRotation:
+    """No-repeat selection: every group walks its own shuffled order of each content list.
+
+    A group's state per domain (Azkar texts, each media folder) is a seed, a
+    cursor and the list size when its current round began, kept in typed
+    arrays indexed by a chat -> slot map. A pick maps the cursor through the
+    seeded permutation, so nothing repeats until the group has seen the whole
+    list. Items added mid-round join the next round, which is reshuffled with
+    a new seed; items removed mid-round are skipped. Call `save` to persist.
+    """
+
+    def __init__(self, path: Optional[str] = 'rotation.bin'):
+        self.path = path
+        self._slots: Dict[int, int] = {}
+        self._chats = array('q')
+        self._bags: Dict[str, _Bag] = {}
+        self.dirty = False
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _slot(self, chat_id: int) -> int:
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            slot = self._slots[chat_id] = len(self._chats)
+            self._chats.append(chat_id)
+        return slot
+
+    def _bag(self, domain: str) -> _Bag:
+        bag = self._bags.get(domain)
+        if bag is None:
+            bag = self._bags[domain] = _Bag()
+        return bag
+
+    def pick(self, domain: str, chat_id: int, n: int) -> Optional[int]:
+        """Next index into a list of `n` items for this group, or None for an empty list."""
+        if n <= 0:
+            return None
+        slot = self._slot(chat_id)
+        bag = self._bag(domain)
+        bag.grow(len(self._chats))
+        self.dirty = True
+
+        seed, cursor, size = bag.seeds[slot], bag.cursors[slot], bag.sizes[slot]
+        if size == 0:
+            # first round: a seed of its own for every group and domain
+            seed = _mix(chat_id & MASK32, _mix(chat_id >> 32 & MASK32, hash_domain(domain)))
+        while True:
+            # a new round once the list is exhausted, or when it shrank so much
+            # that skipping the removed positions would cost more than reshuffling
+            if cursor >= size or n * 2 < size:
+                seed, cursor, size = _mix(seed, 0x632BE59B), 0, n
+            index = permute(cursor, size, seed)
+            cursor += 1
+            if index < n:
+                break
+
+        bag.seeds[slot], bag.cursors[slot], bag.sizes[slot] = seed, cursor, size
+        return index
+
+    def forget(self, chat_id: int):
+        """Start the group over with fresh rounds in every domain."""
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            return
+        for bag in self._bags.values():
+            if slot < len(bag.sizes):
+                bag.seeds[slot] = bag.cursors[slot] = bag.sizes[slot] = 0
+        self.dirty = True
+
+    def save(self):
+        """Write all state as one binary file (temp file + rename)."""
+        if not self.path or not self.dirty:
+            return
+        self.dirty = False
+        slots = len(self._chats)
+        domains = sorted(self._bags)
+        header = json.dumps({'slots': slots, 'domains': domains}).encode('utf-8')
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC)
+                f.write(header + b'\n')
+                self._chats.tofile(f)
+                for domain in domains:
+                    bag = self._bags[domain]
+                    bag.grow(slots)
+                    bag.seeds.tofile(f)
+                    bag.cursors.tofile(f)
+                    bag.sizes.tofile(f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.dirty = True
+            logger.error("could not save content rotation to %s: %s", self.path, e)
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                if f.readline() != MAGIC:
+                    raise ValueError("not a rotation file")
+                header = json.loads(f.readline())
+                slots = header['slots']
+                chats = array('q')
+                chats.fromfile(f, slots)
+                bags = {}
+                for domain in header['domains']:
+                    bag = bags[domain] = _Bag()
+                    bag.seeds.fromfile(f, slots)
+                    bag.cursors.fromfile(f, slots)
+                    bag.sizes.fromfile(f, slots)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            logger.error("could not load content rotation from %s, starting fresh: %s", self.path, e)
+            return
+        self._chats = chats
+        self._slots = {chat_id: slot for slot, chat_id in enumerate(chats)}
+        self._bags = bags
+        logger.info("loaded content rotation for %d groups (%s)", slots, ', '.join(bags) or 'empty')
@@ -0,0 +1,189 @@
+"""Compiled, memory-mapped form of Azkar.txt.
+
+    python corpus_snapshot.py                     # Azkar.txt -> Azkar.snap
+    python corpus_snapshot.py texts.txt out.snap
+
+Layout (little-endian): a fixed header, the entries as UTF-8 blobs already
+wrapped in bold Markdown (`**text**`), then an index of one fixed-size
+record per entry (blob offset, blob length in bytes, text length in
+characters, flags). Reading entry k is one struct unpack and one slice of
+the mapping, so opening a snapshot costs the same for ten entries as for
+ten million and nothing but the pages touched is read from disk.
+"""
+import mmap
+import os
+import random
+import struct
+import sys
+from collections.abc import Sequence
+from typing import Iterable, Iterator, Optional, Tuple
+
+MAGIC = b'AZKS'
+FORMAT_VERSION = 1
+# magic, version, entry count, index offset, source size, source mtime_ns
+HEADER = struct.Struct('<4sHxxIQQQ')
+# blob offset, blob bytes, text characters, flags
+INDEX_ENTRY = struct.Struct('<QIIB3x')
+FLAG_FITS_MESSAGE = 1
+
+# Telegram's limit for one text message, counted in characters
+MAX_MESSAGE_CHARS = 4096
+SEPARATOR = '---'
+READ_CHUNK = 1 << 20
+
+
+def default_snapshot_path(source: str) -> str:
+    return f"{os.path.splitext(source)[0]}.snap"
+
+
+def iter_azkar(chunks: Iterable[str]) -> Iterator[str]:
+    """The entries of Azkar.txt (split on `---`, stripped, empties dropped) without loading it whole."""
+    carry = ''
+    for chunk in chunks:
+        pieces = (carry + chunk).split(SEPARATOR)
+        carry = pieces.pop()
+        for piece in pieces:
+            piece = piece.strip()
+            if piece:
+                yield piece
+    carry = carry.strip()
+    if carry:
+        yield carry
+
+
+def _read_chunks(f) -> Iterator[str]:
+    for chunk in iter(lambda: f.read(READ_CHUNK), ''):
+        yield chunk
+
+
+def compile_corpus(source: str, target: str = None) -> int:
+    """Write the snapshot of `source` (temp file + rename). Returns the number of entries."""
+    target = target or default_snapshot_path(source)
+    st = os.stat(source)
+    index = bytearray()
+    count = 0
+    tmp_path = f"{target}.tmp"
+    with open(source, 'r', encoding='utf-8') as src, open(tmp_path, 'wb') as out:
+        out.write(bytes(HEADER.size))
+        offset = HEADER.size
+        for text in iter_azkar(_read_chunks(src)):
+            bold = f"**{text}**"
+            blob = bold.encode('utf-8')
+            flags = FLAG_FITS_MESSAGE if len(bold) <= MAX_MESSAGE_CHARS else 0
+            index += INDEX_ENTRY.pack(offset, len(blob), len(text), flags)
+            out.write(blob)
+            offset += len(blob)
+            count += 1
+        out.write(index)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, offset, st.st_size, st.st_mtime_ns))
+    os.replace(tmp_path, target)
+    return count
+
+
+class MappedCorpus(Sequence):
+    """Read-only view of a compiled snapshot; indexing returns the plain entry text.
+
+    The file is memory-mapped, so entries are decoded one at a time on
+    access and the pages are shared by every process that opens it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self._count, self._index_offset, self.source_size, self.source_mtime_ns = \
+                HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a version {FORMAT_VERSION} corpus snapshot")
+            if self._index_offset + self._count * INDEX_ENTRY.size > len(self._mm):
+                raise ValueError(f"{path} is truncated")
+        except Exception:
+            self._mm.close()
+            raise
+
+    def __len__(self) -> int:
+        return self._count
+
+    def entry(self, index: int) -> Tuple[int, int, int, int]:
+        """(blob offset, blob bytes, text characters, flags) of entry `index`."""
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return INDEX_ENTRY.unpack_from(self._mm, self._index_offset + index * INDEX_ENTRY.size)
+
+    def bold(self, index: int) -> str:
+        """The entry pre-rendered as bold Markdown, ready to send."""
+        offset, size, _, _ = self.entry(index)
+        return self._mm[offset:offset + size].decode('utf-8')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        offset, size, _, _ = self.entry(index)
+        # the blob is `**text**`: skip the markers instead of storing the text twice
+        return self._mm[offset + 2:offset + size - 2].decode('utf-8')
+
+    def length(self, index: int) -> int:
+        return self.entry(index)[2]
+
+    def fits_message(self, index: int) -> bool:
+        return bool(self.entry(index)[3] & FLAG_FITS_MESSAGE)
+
+    def random_index(self, rng: random.Random = None, attempts: int = 8) -> Optional[int]:
+        """A uniformly random entry that fits in one message (None for an empty snapshot)."""
+        if not self._count:
+            return None
+        choice = (rng or random).randrange
+        index = choice(self._count)
+        for _ in range(attempts - 1):
+            if self.fits_message(index):
+                break
+            index = choice(self._count)
+        return index
+
+    def is_fresh(self, source: str) -> bool:
+        """Whether this snapshot was compiled from `source` as it is now.
+
+        The size must match, and the recorded mtime too unless the snapshot
+        file is newer than the source (deploys and image builds often reset
+        mtimes without changing content).
+        """
+        try:
+            st = os.stat(source)
+            snapshot_mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if st.st_size != self.source_size:
+            return False
+        return st.st_mtime_ns == self.source_mtime_ns or snapshot_mtime_ns >= st.st_mtime_ns
+
+    def close(self):
+        self._mm.close()
+
+
+def open_fresh(source: str, path: str = None) -> Optional[MappedCorpus]:
+    """The compiled snapshot of `source` if there is an up-to-date one, else None."""
+    path = path or default_snapshot_path(source)
+    try:
+        mapped = MappedCorpus(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not mapped.is_fresh(source):
+        mapped.close()
+        return None
+    return mapped
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'Azkar.txt'
+    target = sys.argv[2] if len(sys.argv) > 2 else default_snapshot_path(source)
+    count = compile_corpus(source, target)
+    # fail the build rather than ship an image or deployment that silently re-parses Azkar.txt
+    mapped = open_fresh(source, target)
+    if mapped is None or len(mapped) != count:
+        sys.exit(f"{target}: snapshot missing or stale after compiling")
+    mapped.close()
+    print(f"{target}: {count} entries")
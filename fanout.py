@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Iterable, Optional
+
+from object_store import ObjectStore, PreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+
+def state_key(job: str) -> str:
+    return f"fanout/{job}.json"
+
+
+def progress(store: ObjectStore, job: str) -> Optional[dict]:
+    """Summary of the stored broadcast of `job` for status pages; None if it never ran."""
+    found = store.get(state_key(job))
+    if found is None:
+        return None
+    state = json.loads(found[0].decode('utf-8'))
+    return {
+        'id': state['id'],
+        'sent': state['sent'],
+        'failed': state['failed'],
+        'cursor': state['cursor'],
+        'created': state['created'],
+        'deadline': state['deadline'],
+        'finished': state['finished'],
+        'running': not state['finished'] and state['lease'] > time.time(),
+    }
+
+
+class ChunkedFanout:
+    """A broadcast split across short, time-boxed invocations.
+
+    The broadcast state (payload, cursor, totals) lives in the object store
+    under `fanout/<job>.json`. Chats are visited in ascending id order and
+    the cursor is the last id finished, so groups added or removed between
+    invocations need no bookkeeping. Each invocation takes a lease on the
+    state with a conditional write, sends windows of `concurrency` chats at
+    a time until `time_budget` is spent, saves the cursor after every window
+    and leaves the rest for the next invocation.
+    """
+
+    def __init__(self, store: ObjectStore, job: str, time_budget: float = 8.0, concurrency: int = 20,
+                 lease_margin: float = 5.0):
+        self.store = store
+        self.job = job
+        self.key = state_key(job)
+        self.time_budget = time_budget
+        self.concurrency = concurrency
+        self.lease_margin = lease_margin
+
+    async def _load(self):
+        found = await self.store.aget(self.key)
+        if found is None:
+            return None, None
+        body, etag = found
+        return json.loads(body.decode('utf-8')), etag
+
+    async def _save(self, state: dict, etag: Optional[str]) -> str:
+        body = json.dumps(state, ensure_ascii=False).encode('utf-8')
+        return await self.store.aput(self.key, body, if_match=etag, if_none_match=etag is None)
+
+    async def run(self, members: Iterable[int], new_payload: Callable[[], dict],
+                  send: Callable[[int, dict], Awaitable[bool]], deadline_seconds: float = 300,
+                  start_new: bool = True) -> dict:
+        """Continue the current broadcast (or start one) for up to `time_budget` seconds.
+
+        `send(chat_id, payload)` returns whether the message went out. The
+        result reports this invocation's progress; `remaining` > 0 means the
+        caller should trigger another invocation.
+        """
+        started = time.time()
+        state, etag = await self._load()
+
+        if state and not state['finished'] and state['deadline'] < started:
+            logger.warning("fanout %s/%s expired with a cursor at %s", self.job, state['id'], state['cursor'])
+            state['finished'] = True
+        if state and not state['finished'] and state['lease'] > started:
+            return {'ok': True, 'job': self.job, 'busy': True}
+        if not state or state['finished']:
+            if not start_new:
+                return {'ok': True, 'job': self.job, 'sent': 0, 'remaining': 0, 'done': True}
+            state = {
+                'id': uuid.uuid4().hex,
+                'payload': new_payload(),
+                'cursor': None,
+                'sent': 0,
+                'failed': 0,
+                'created': started,
+                'deadline': started + deadline_seconds,
+                'lease': 0.0,
+                'finished': False,
+            }
+
+        state['lease'] = started + self.time_budget + self.lease_margin
+        try:
+            etag = await self._save(state, etag)
+        except PreconditionFailed:
+            # another invocation got there first
+            return {'ok': True, 'job': self.job, 'busy': True}
+
+        cursor = state['cursor']
+        pending = sorted(g for g in set(members) if cursor is None or g > cursor)
+        payload = state['payload']
+        sent = failed = 0
+        window_time = 0.0
+        i = 0
+
+        async def deliver(chat_id):
+            try:
+                return bool(await send(chat_id, payload))
+            except Exception as e:
+                logger.debug("fanout send to %s failed: %s", chat_id, e)
+                return False
+
+        taken_over = False
+        while i < len(pending):
+            elapsed = time.time() - started
+            if elapsed + window_time > self.time_budget:
+                break
+            window = pending[i:i + self.concurrency]
+            window_started = time.time()
+            results = await asyncio.gather(*(deliver(chat_id) for chat_id in window))
+            window_time = time.time() - window_started
+            i += len(window)
+
+            ok = sum(results)
+            sent += ok
+            failed += len(window) - ok
+            state['cursor'] = window[-1]
+            state['sent'] += ok
+            state['failed'] += len(window) - ok
+            try:
+                etag = await self._save(state, etag)
+            except PreconditionFailed:
+                logger.warning("fanout %s/%s taken over by another invocation", self.job, state['id'])
+                taken_over = True
+                break
+
+        remaining = len(pending) - i
+        if not taken_over:
+            # release the lease so the follow-up invocation can start right away
+            state['finished'] = remaining == 0
+            state['lease'] = 0.0
+            try:
+                await self._save(state, etag)
+            except PreconditionFailed:
+                pass
+
+        return {
+            'ok': True,
+            'job': self.job,
+            'broadcast': state['id'],
+            'sent': sent,
+            'failed': failed,
+            'remaining': remaining,
+            'total_sent': state['sent'],
+            'elapsed': round(time.time() - started, 3),
+            'done': remaining == 0,
+        }
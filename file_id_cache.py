@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from metrics import cache_counters
+
+logger = logging.getLogger(__name__)
+
+_HITS, _MISSES = cache_counters('file_id')
+
+DEFAULT_CACHE_FILE = 'file_ids.json'
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_file_id(message: dict, field: str) -> Optional[str]:
+    """Pull the file_id Telegram assigned to an uploaded file out of the sent message."""
+    # Telegram may store a file under another kind than requested (e.g. an mp3 sent as voice)
+    for kind in (field, 'voice', 'audio', 'document', 'photo'):
+        media = message.get(kind)
+        if isinstance(media, list):
+            # photos come back as a list of sizes, the last one being the original
+            media = media[-1] if media else None
+        if media and media.get('file_id'):
+            return media['file_id']
+    return None
+
+
+class FileIdCache:
+    """Persistent map of media file -> Telegram file_id, keyed by path and content hash.
+
+    File ids are only valid for the bot that uploaded them, so the cache is
+    namespaced by bot id and discarded when a different bot loads it.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_FILE, namespace: str = ''):
+        self.path = path
+        self.namespace = namespace
+        self._entries: Dict[str, dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.load()
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        return os.path.normpath(os.path.abspath(file_path))
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('namespace') == self.namespace:
+                    self._entries = data.get('files', {})
+        except Exception as e:
+            logger.error("could not load file_id cache %s: %s", self.path, e)
+            self._entries = {}
+
+    def save(self):
+        data = {'namespace': self.namespace, 'files': self._entries}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error("could not save file_id cache %s: %s", self.path, e)
+
+    def lookup(self, file_path: str) -> Optional[str]:
+        """Return the cached file_id if the file on disk still has the uploaded content."""
+        file_id = self._lookup(file_path)
+        (_HITS if file_id else _MISSES).inc()
+        return file_id
+
+    def _lookup(self, file_path: str) -> Optional[str]:
+        key = self._key(file_path)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            self.invalidate(file_path)
+            return None
+        if st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']:
+            return entry['file_id']
+
+        # touched on disk: only re-upload if the bytes actually changed
+        if st.st_size == entry['size'] and file_sha256(file_path) == entry['sha256']:
+            entry['mtime_ns'] = st.st_mtime_ns
+            self.save()
+            return entry['file_id']
+
+        self.invalidate(file_path)
+        return None
+
+    def store(self, file_path: str, file_id: str):
+        try:
+            st = os.stat(file_path)
+            self._entries[self._key(file_path)] = {
+                'file_id': file_id,
+                'sha256': file_sha256(file_path),
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+            }
+        except OSError as e:
+            logger.error("could not cache file_id for %s: %s", file_path, e)
+            return
+        self.save()
+
+    def invalidate(self, file_path: str):
+        if self._entries.pop(self._key(file_path), None) is not None:
+            self.save()
+
+    def lock(self, file_path: str) -> asyncio.Lock:
+        """Per-file lock so concurrent sends wait for a single first upload."""
+        key = self._key(file_path)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_group(value) -> Optional[int]:
+    text = str(value).strip()
+    return int(text) if text.lstrip('-').isdigit() else None
+
+
+class GroupRegistry:
+    """Set of active group ids persisted as a JSON snapshot plus an append-only change log.
+
+    Membership changes update memory immediately and are appended to
+    `<snapshot>.log` as `+id` / `-id` lines by a debounced background flush.
+    Once the log passes `compact_after` entries the snapshot is rewritten
+    through a temp file + rename and the log is truncated. All disk work runs
+    in order on a single worker thread, off the event loop.
+    """
+
+    def __init__(self, path: str = 'active_groups.json', flush_delay: float = 1.0, compact_after: int = 1000):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.flush_delay = flush_delay
+        self.compact_after = compact_after
+        self._groups: Set[int] = set()
+        self._pending: List[str] = []
+        self._log_entries = 0
+        self._flush_handle = None
+        self._signature = None
+        # a follower in a sharded deployment reads the files but never writes them
+        self.persist = True
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='group-registry')
+
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self._groups
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def __bool__(self) -> bool:
+        return bool(self._groups)
+
+    def copy(self) -> Set[int]:
+        return set(self._groups)
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.path, self.log_path):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload_if_changed(self) -> bool:
+        """Re-read the files if another process changed them (local changes not yet written are kept)."""
+        signature = self._file_signature()
+        if signature == self._signature or self._pending:
+            return False
+        self.load()
+        return True
+
+    def load(self) -> int:
+        signature = self._file_signature()
+        groups = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            raw = data.get('groups', [])
+            if all(type(g) is int for g in raw):
+                groups = set(raw)
+            else:
+                groups = {g for g in map(_parse_group, raw) if g is not None}
+
+        entries = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    chat_id = _parse_group(line[1:])
+                    if chat_id is None:
+                        # a torn last line from a crash mid-append
+                        continue
+                    if line[0] == '+':
+                        groups.add(chat_id)
+                    elif line[0] == '-':
+                        groups.discard(chat_id)
+                    entries += 1
+
+        self._groups = groups
+        self._pending.clear()
+        self._log_entries = entries
+        self._signature = signature
+        return len(groups)
+
+    def add(self, chat_id: int) -> bool:
+        if chat_id in self._groups:
+            return False
+        self._groups.add(chat_id)
+        self._record(f"+{chat_id}\n")
+        return True
+
+    def discard(self, chat_id: int) -> bool:
+        if chat_id not in self._groups:
+            return False
+        self._groups.discard(chat_id)
+        self._record(f"-{chat_id}\n")
+        return True
+
+    def update(self, chat_ids: Iterable[int]):
+        for chat_id in chat_ids:
+            self.add(chat_id)
+
+    def _record(self, line: str):
+        if not self.persist:
+            return
+        self._pending.append(line)
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, self._start_flush, loop)
+
+    def _start_flush(self, loop):
+        self._flush_handle = None
+        loop.create_task(self.flush())
+
+    def _take_batch(self):
+        lines, self._pending = self._pending, []
+        self._log_entries += len(lines)
+        snapshot = None
+        if self._log_entries >= self.compact_after:
+            # the copy already includes `lines`, so they need not reach the log
+            snapshot = sorted(self._groups)
+            self._log_entries = 0
+        return lines, snapshot
+
+    def _write_batch(self, lines: List[str], snapshot: Optional[List[int]]):
+        if snapshot is not None:
+            self._write_snapshot(snapshot)
+            with open(self.log_path, 'w', encoding='utf-8'):
+                pass
+            return
+        if lines:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _write_snapshot(self, groups: List[int]):
+        data = {'groups': groups, 'last_updated': datetime.now().astimezone().isoformat()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        if not self.persist or (not self._pending and self._log_entries < self.compact_after):
+            return
+        lines, snapshot = self._take_batch()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, lines, snapshot)
+        except Exception as e:
+            logger.error("could not persist group changes: %s", e)
+
+    def flush_sync(self, compact: bool = False):
+        """Write pending changes from the calling thread (startup/shutdown paths)."""
+        if not self.persist:
+            return
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if compact:
+            self._log_entries = self.compact_after
+        lines, snapshot = self._take_batch()
+        # wait for any queued background write so the file order is preserved
+        self._executor.submit(self._write_batch, lines, snapshot).result()
@@ -0,0 +1,132 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_current_sampler: ContextVar[Optional['ErrorSampler']] = ContextVar('error_sampler', default=None)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record as is; message and traceback formatting happen on the writer thread."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(path: str = 'bot.log', level: int = logging.INFO, max_bytes: int = 10 * 1024 * 1024,
+                  backups: int = 5) -> logging.handlers.QueueListener:
+    """Route all records through a queue to a background thread that writes stdout and a rotated file.
+
+    Loggers only enqueue the record; formatting and writing happen on the
+    listener thread, so a burst of records never blocks the event loop on
+    disk I/O. The file rotates at `max_bytes`, keeping `backups` old files.
+    """
+    formatter = logging.Formatter(FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if path:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener):
+    try:
+        listener.stop()
+    except AttributeError:
+        # already stopped by the application
+        pass
+
+
+class ErrorSampler:
+    """Collapses the per-chat errors of one broadcast into a few sample lines and a count per kind.
+
+    Used as a context manager around the broadcast; `log_sampled` calls made
+    anywhere inside it (including tasks it starts) are counted here, the
+    first `samples` of each kind are logged and the rest summarised on exit.
+    """
+
+    def __init__(self, scope: str, samples: int = 1, logger: logging.Logger = None):
+        self.scope = scope
+        self.samples = samples
+        self.logger = logger or logging.getLogger(__name__)
+        self.counts: Counter = Counter()
+        self._token = None
+
+    def record(self, logger: logging.Logger, level: int, kind: str, msg: str, *args):
+        self.counts[kind] += 1
+        if self.counts[kind] <= self.samples and logger.isEnabledFor(level):
+            logger.log(level, "%s [%s] " + msg, self.scope, kind, *args)
+
+    def summary(self):
+        for kind, count in self.counts.items():
+            if count > self.samples:
+                self.logger.warning("%s: %d × %s (%d shown)", self.scope, count, kind, self.samples)
+
+    def __enter__(self):
+        self._token = _current_sampler.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current_sampler.reset(self._token)
+        self.summary()
+
+
+class _KindLimiter:
+    """At most `per_minute` lines per kind outside a broadcast; the skipped count rides on the next line."""
+
+    def __init__(self, per_minute: int = 10):
+        self.per_minute = per_minute
+        self._windows: Dict[str, list] = {}
+
+    def allow(self, kind: str) -> int:
+        """-1 to drop the record, otherwise how many were dropped before it."""
+        now = time.monotonic()
+        window = self._windows.get(kind)
+        if window is None or now - window[0] >= 60:
+            window = self._windows[kind] = [now, 0, window[2] if window else 0]
+        if window[1] >= self.per_minute:
+            window[2] += 1
+            return -1
+        window[1] += 1
+        suppressed, window[2] = window[2], 0
+        return suppressed
+
+
+_limiter = _KindLimiter()
+
+
+def log_sampled(logger: logging.Logger, level: int, kind: str, msg: str, *args):
+    """Log a repetitive per-chat error: sampled inside a broadcast, rate-limited per kind elsewhere."""
+    sampler = _current_sampler.get()
+    if sampler is not None:
+        sampler.record(logger, level, kind, msg, *args)
+        return
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = _limiter.allow(kind)
+    if suppressed < 0:
+        return
+    if suppressed:
+        logger.log(level, msg + " (+%d similar suppressed)", *args, suppressed)
+    else:
+        logger.log(level, msg, *args)
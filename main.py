@@ -1,50 +1,185 @@
 import os
-import random
 import asyncio
 import logging
 from datetime import datetime, timedelta
 import pytz
-import json
 import aiohttp
+from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import signal
-import sys
-
-# إعداد نظام السجلات المحسن
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log', encoding='utf-8')
-    ]
+import time
+
+from broadcast import BroadcastEngine
+from file_id_cache import FileIdCache, extract_file_id
+from azkar_corpus import get_corpus
+from media_catalog import MediaCatalog
+from content_rotation import ContentRotation
+from chat_health import ChatHealth, CHAT_FAILURES, classify, OK, GONE, MIGRATED, FAILING
+from outbox import Outbox
+from group_registry import GroupRegistry
+from prayer_times import PrayerCalendar, CAIRO
+from cadence_scheduler import CadenceScheduler
+from rate_governor import RateGovernor
+from update_dispatcher import UpdateDispatcher
+from webhook_server import WebhookServer, default_secret
+from shard_coordinator import ShardCoordinator
+from metrics import REGISTRY, CONTENT_TYPE, TELEGRAM_LATENCY, TELEGRAM_ERRORS
+from log_pipeline import setup_logging, log_sampled
+import media_pipeline
+import media_ingest
+from send_payload import MediaTemplate, text_template, JSON_CONTENT_TYPE
+
+# إعداد نظام السجلات: الكتابة في خيط منفصل عبر طابور مع تدوير ملف السجل
+setup_logging(
+    os.getenv("LOG_FILE", "bot.log"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backups=int(os.getenv("LOG_BACKUPS", "5"))
 )
 logger = logging.getLogger(__name__)
 
+# رسائل التنبيه قبل كل صلاة ({minutes} حسب prayer_offset للمجموعة)
+PRAYER_MESSAGES = {
+    'Fajr': """🌅 **تنبيه صلاة الفجر** 🌅
+
+⏰ **{minutes} على الأذان**
+
+🕌 **لا تنس الوضوء والاستعداد للصلاة**""",
+
+    'Dhuhr': """☀️ **تنبيه صلاة الظهر** ☀️
+
+⏰ **{minutes} على الأذان**
+
+🕌 **توقف قليلاً واستعد للصلاة**""",
+
+    'Asr': """🌤️ **تنبيه صلاة العصر** 🌤️
+
+⏰ **{minutes} على الأذان**
+
+⚠️ **الصلاة الوسطى - لا تفوتها**""",
+
+    'Maghrib': """🌅 **تنبيه صلاة المغرب** 🌅
+
+⏰ **{minutes} على الأذان**
+
+🌇 **وقت استجابة الدعاء**""",
+
+    'Isha': """🌙 **تنبيه صلاة العشاء** 🌙
+
+⏰ **{minutes} على الأذان**
+
+🌟 **آخر صلاة في اليوم**"""
+}
+
+ARABIC_MINUTES = {1: 'دقيقة واحدة', 2: 'دقيقتان', 3: 'ثلاث دقائق', 4: 'أربع دقائق', 5: 'خمس دقائق',
+                  6: 'ست دقائق', 7: 'سبع دقائق', 8: 'ثماني دقائق', 9: 'تسع دقائق', 10: 'عشر دقائق'}
+
+
+def prayer_message(prayer, offset=5):
+    """نص التنبيه قبل الصلاة بعدد الدقائق الفعلي قبل الأذان"""
+    minutes = ARABIC_MINUTES.get(offset) or f"{offset} دقيقة"
+    return PRAYER_MESSAGES[prayer].format(minutes=minutes)
+
+
 class AzkarBot:
     def __init__(self):
         self.bot_token = os.getenv("BOT_TOKEN", "7732686950:AAGDC3iAlhPqlkGhakPYEqFwr_chK97DCgI")
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        # TELEGRAM_API_URL يسمح بتوجيه البوت إلى خادم Bot API محلي (مثل bench/fake_bot_api.py)
+        api_url = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip('/')
+        self.base_url = f"{api_url}/bot{self.bot_token}"
+        self.file_url = f"{api_url}/file/bot{self.bot_token}"
+        self.json_headers = {'Content-Type': JSON_CONTENT_TYPE}
+        self.send_timeout = aiohttp.ClientTimeout(total=float(os.getenv("SEND_TIMEOUT", "15")))
         self.admin_id = int(os.getenv("ADMIN_ID", "7089656746"))
 
         self.scheduler = AsyncIOScheduler(timezone=pytz.timezone('Africa/Cairo'))
         self.cairo_tz = pytz.timezone('Africa/Cairo')
-        self.active_groups = set()
         self.last_message_ids = {}
         self.content_turn = 0
-        self.offset = 0
         self.session = None
         self.is_running = True
 
         # ملفات التكوين
         self.groups_file = 'active_groups.json'
+        self.active_groups = GroupRegistry(self.groups_file)
         self.channel_link = "https://t.me/Telawat_Quran_0"
         self.admin_states = {}
 
+        # منظم معدل الإرسال (يتكيف مع retry_after من Telegram) ومحرك البث المتوازي
+        self.governor = RateGovernor(max_rate=float(os.getenv("BROADCAST_RATE", "25")))
+        self.broadcaster = BroadcastEngine(concurrency=int(os.getenv("BROADCAST_CONCURRENCY", "20")))
+
+        # معالجة التحديثات بالتوازي مع الحفاظ على ترتيب رسائل كل محادثة
+        self.dispatcher = UpdateDispatcher(
+            self.handle_update,
+            concurrency=int(os.getenv("UPDATE_CONCURRENCY", "16"))
+        )
+
+        # وضع webhook: يستقبل البوت التحديثات من Telegram مباشرة بدلاً من الاستطلاع
+        self.webhook_url = os.getenv("WEBHOOK_URL", "").rstrip('/')
+        self.webhook_server = None
+
+        # استكمال البث المنقطع: مهمة واحدة في كل وقت، والأجزاء التي استكمل لها آخر مرة (وضع التوزيع)
+        self.resume_task = None
+        self.resume_partitions = frozenset()
+
+        # ذاكرة file_id للملفات المرفوعة (رفع واحد لكل ملف)
+        self.file_ids = FileIdCache(
+            os.getenv("FILE_ID_CACHE_PATH", "file_ids.json"),
+            namespace=self.bot_token.split(':', 1)[0]
+        )
+
         # إنشاء المجلدات وتحميل البيانات
         self.ensure_directories()
         self.load_active_groups()
         self.create_default_content()
+        self.corpus = get_corpus('Azkar.txt')
+        self.media = MediaCatalog()
+
+        # التوزيع على عدة عمليات: كل عملية تملك جزءاً ثابتاً من المجموعات عبر عقود في قاعدة SQLite مشتركة
+        shard_db = os.getenv("SHARD_DB")
+        self.shards = None
+        worker_suffix = ''
+        if shard_db:
+            # حالة كل نسخة (البث الجاري، الترتيب، صحة المجموعات) محفوظة باسمها، فيجب أن يبقى الاسم نفسه بعد إعادة التشغيل
+            worker_id = os.getenv("SHARD_WORKER")
+            if not worker_id:
+                raise ValueError("SHARD_WORKER مطلوب مع SHARD_DB: اسم ثابت ومختلف لكل نسخة")
+            self.shards = ShardCoordinator(
+                shard_db,
+                partitions=int(os.getenv("SHARD_PARTITIONS", "64")),
+                worker_id=worker_id,
+                lease_seconds=float(os.getenv("SHARD_LEASE_SECONDS", "15"))
+            )
+            worker_suffix = f".{worker_id.replace(':', '_')}"
+
+        # البث الجاري لكل نسخة في ملفها الخاص حتى لا تستأنف نسخة بث غيرها أو تحذفه
+        self.outbox = Outbox(os.getenv("OUTBOX_PATH", "outbox.sqlite3") + worker_suffix)
+
+        # ترتيب عشوائي خاص بكل مجموعة لكل قائمة محتوى: لا يتكرر عنصر قبل أن ترى المجموعة القائمة كلها
+        self.rotation = ContentRotation(os.getenv("ROTATION_PATH", "rotation.bin") + worker_suffix)
+
+        # المجموعات التي ترفض الإرسال مؤقتاً تستبعد من البث مع مهلة تتضاعف عند كل فشل
+        self.health = ChatHealth(os.getenv("CHAT_HEALTH_PATH", "chat_health.json") + worker_suffix)
+
+        # مقاييس Prometheus (تعرض على /metrics)
+        self.metrics_server = None
+        REGISTRY.gauge_callback('azkar_active_groups', 'Active groups', lambda: len(self.active_groups))
+        REGISTRY.gauge_callback('azkar_updates_in_flight', 'Updates being handled', lambda: self.dispatcher.in_flight)
+        REGISTRY.gauge_callback('azkar_send_rate', 'Current send rate allowed by the governor', lambda: self.governor.current_rate)
+        REGISTRY.gauge_callback('azkar_chats_backed_off', 'Chats skipped by broadcasts after repeated failures', lambda: len(self.health))
+        REGISTRY.gauge_callback('azkar_scheduled_entries', 'Entries waiting on the cadence wheel', lambda: len(self.cadences.wheel))
+
+        # مواقيت الصلاة تحسب محلياً (الهيئة المصرية العامة للمساحة افتراضياً)
+        prayer_method = os.getenv("PRAYER_METHOD", "egypt")
+        self.prayer_calendar = PrayerCalendar(*CAIRO, method=prayer_method)
+        self.prayer_api_method = {'egypt': '5', 'gulf': '8', 'mwl': '3', 'makkah': '4'}[prayer_method]
+
+        # جدول المجموعات: فترة وتوقيت وإزاحات خاصة لكل مجموعة (group_settings.json)
+        self.cadences = CadenceScheduler(
+            lambda: self.active_groups,
+            self.dispatch_cadence,
+            settings_path=os.getenv("GROUP_SETTINGS_PATH", "group_settings.json")
+        )
 
     def ensure_directories(self):
         """إنشاء المجلدات المطلوبة مع معالجة الأخطاء"""
@@ -87,34 +222,41 @@ class AzkarBot:
             logger.error(f"خطأ في إنشاء المحتوى الافتراضي: {e}")
 
     def save_active_groups(self):
-        """حفظ المجموعات النشطة مع معالجة الأخطاء"""
+        """كتابة التغييرات المعلقة ودمج السجل في ملف المجموعات (عند الإيقاف)"""
         try:
-            groups_data = {
-                'groups': list(self.active_groups),
-                'last_updated': datetime.now(self.cairo_tz).isoformat()
-            }
-            with open(self.groups_file, 'w', encoding='utf-8') as f:
-                json.dump(groups_data, f, ensure_ascii=False, indent=2)
+            self.active_groups.flush_sync(compact=True)
             logger.info(f"تم حفظ {len(self.active_groups)} مجموعة نشطة")
         except Exception as e:
             logger.error(f"خطأ في حفظ المجموعات: {e}")
 
     def load_active_groups(self):
-        """تحميل المجموعات النشطة مع معالجة الأخطاء"""
+        """تحميل المجموعات النشطة (الملف الأساسي + سجل التغييرات) مع معالجة الأخطاء"""
         try:
-            if os.path.exists(self.groups_file):
-                with open(self.groups_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    saved_groups = data.get('groups', [])
-                    # التأكد من أن جميع العناصر أرقام صحيحة
-                    self.active_groups = set(int(group) for group in saved_groups if str(group).lstrip('-').isdigit())
-                    logger.info(f"تم تحميل {len(self.active_groups)} مجموعة نشطة")
+            if self.active_groups.load():
+                logger.info(f"تم تحميل {len(self.active_groups)} مجموعة نشطة")
             else:
-                self.active_groups = set()
                 logger.info("لا يوجد ملف مجموعات محفوظ")
         except Exception as e:
             logger.error(f"خطأ في تحميل المجموعات: {e}")
-            self.active_groups = set()
+
+    def on_shard_beat(self):
+        """بعد كل نبضة: القائد وحده يكتب ملف المجموعات، والبقية تعيد قراءته عند تغيره"""
+        # أجزاء جديدة قد تحوي مجموعات بقيت من بث منقطع لم تكن هذه النسخة تملكها وقتها
+        owned = self.shards.owned
+        gained = owned - self.resume_partitions
+        self.resume_partitions = owned
+        if gained:
+            self.start_resume()
+
+        if self.shards.leading():
+            self.active_groups.persist = True
+            for chat_id in self.shards.take_removed():
+                self.active_groups.discard(chat_id)
+        else:
+            if self.active_groups.persist:
+                self.active_groups.flush_sync()
+                self.active_groups.persist = False
+            self.active_groups.reload_if_changed()
 
     async def start_bot(self):
         """تشغيل البوت مع معالجة شاملة للأخطاء"""
@@ -128,7 +270,7 @@ class AzkarBot:
             # إنشاء جلسة HTTP مع إعدادات محسنة
             connector = aiohttp.TCPConnector(
                 limit=100,
-                limit_per_host=10,
+                limit_per_host=max(10, self.broadcaster.concurrency),
                 keepalive_timeout=30,
                 enable_cleanup_closed=True
             )
@@ -145,6 +287,19 @@ class AzkarBot:
                 logger.error("❌ توكن البوت غير صحيح")
                 return
 
+            # تجهيز الوسائط مرة واحدة (تصغير الصور وتحويل الصوتيات إلى OGG/Opus) في الخلفية
+            if os.getenv("MEDIA_PREPROCESS", "1") == "1" and media_pipeline.available():
+                asyncio.create_task(self.preprocess_media())
+
+            # في وضع التوزيع: النبضة الأولى قبل الاستكمال حتى يعرف البث أي المجموعات تملكها هذه النسخة
+            if self.shards:
+                await self.shards.heartbeat()
+                self.on_shard_beat()
+                asyncio.create_task(self.shards.run(lambda: self.is_running, self.on_shard_beat))
+
+            # استكمال أي بث انقطع قبل آخر إيقاف
+            self.start_resume()
+
             # بدء الجدولة
             await self.setup_scheduler()
 
@@ -154,7 +309,15 @@ class AzkarBot:
             logger.info(f"✅ البوت يعمل الآن مع {len(self.active_groups)} مجموعة نشطة")
 
             # بدء معالجة الرسائل
-            await self.process_updates()
+            await self.start_metrics_server()
+
+            if self.webhook_url and self.shards:
+                logger.warning("وضع التوزيع يستقبل التحديثات بالاستطلاع عبر القائد؛ تم تجاهل WEBHOOK_URL")
+
+            if self.webhook_url and not self.shards:
+                await self.run_webhook()
+            else:
+                await self.process_updates()
 
         except Exception as e:
             logger.error(f"❌ خطأ في تشغيل البوت: {e}")
@@ -190,18 +353,6 @@ class AzkarBot:
             # بدء الجدولة
             self.scheduler.start()
 
-            # أذكار عشوائية كل 5 دقائق
-            self.scheduler.add_job(
-                self.send_random_content,
-                'interval',
-                minutes=5,
-                timezone=self.cairo_tz,
-                id='random_azkar',
-                replace_existing=True,
-                max_instances=1,
-                misfire_grace_time=60
-            )
-
             # إرسال المحتوى الأول بعد 30 ثانية
             self.scheduler.add_job(
                 self.send_random_content,
@@ -212,33 +363,10 @@ class AzkarBot:
                 replace_existing=True
             )
 
-            # أذكار الصباح - مواقيت متعددة
-            morning_times = [(5, 30), (7, 0), (8, 0)]
-            for i, (hour, minute) in enumerate(morning_times):
-                self.scheduler.add_job(
-                    self.send_morning_azkar,
-                    'cron',
-                    hour=hour,
-                    minute=minute,
-                    timezone=self.cairo_tz,
-                    id=f'morning_azkar_{i}',
-                    replace_existing=True,
-                    misfire_grace_time=300
-                )
-
-            # أذكار المساء - مواقيت متعددة
-            evening_times = [18, 19, 20]
-            for i, hour in enumerate(evening_times):
-                self.scheduler.add_job(
-                    self.send_evening_azkar,
-                    'cron',
-                    hour=hour,
-                    minute=0,
-                    timezone=self.cairo_tz,
-                    id=f'evening_azkar_{i}',
-                    replace_existing=True,
-                    misfire_grace_time=300
-                )
+            # الأذكار الدورية وأذكار الصباح والمساء والصلاة لكل مجموعة حسب إعداداتها
+            self.cadences.load_settings()
+            self.cadences.start()
+            asyncio.create_task(self.cadences.run(lambda: self.is_running))
 
             # جدولة يومية لمواقيت الصلاة
             self.scheduler.add_job(
@@ -261,17 +389,25 @@ class AzkarBot:
         """تنظيف الموارد"""
         try:
             self.is_running = False
+            self.broadcaster.stop()
+            if self.shards:
+                self.shards.release()
 
             if self.scheduler and self.scheduler.running:
                 self.scheduler.shutdown(wait=False)
                 logger.info("تم إيقاف الجدولة")
 
+            if self.metrics_server:
+                await self.metrics_server.cleanup()
+
             if self.session and not self.session.closed:
                 await self.session.close()
                 logger.info("تم إغلاق جلسة HTTP")
 
             # حفظ البيانات النهائي
             self.save_active_groups()
+            self.rotation.save()
+            self.health.save()
             logger.info("تم حفظ البيانات النهائي")
 
         except Exception as e:
@@ -284,13 +420,23 @@ class AzkarBot:
         base_delay = 1
 
         logger.info("🔄 بدء معالجة الرسائل...")
+        # getUpdates يرفض بـ 409 ما دام webhook مسجلاً (مثلاً بعد التحويل من وضع webhook)
+        await self.delete_webhook()
 
         while self.is_running:
+            # في وضع التوزيع يستقبل التحديثات القائد فقط (عمليتان تستطلعان تحصلان على 409)
+            if self.shards and not self.shards.leading():
+                await asyncio.sleep(1)
+                continue
+
             try:
+                # لا نطلب دفعة جديدة إذا امتلأت طوابير المعالجة
+                await self.dispatcher.wait_capacity()
+
                 url = f"{self.base_url}/getUpdates"
                 params = {
-                    'offset': self.offset,
-                    'limit': 50,
+                    'offset': self.dispatcher.offset,
+                    'limit': self.dispatcher.limit,
                     'timeout': 10,
                     'allowed_updates': ['message', 'callback_query']
                 }
@@ -300,13 +446,7 @@ class AzkarBot:
                         data = await response.json()
                         if data.get('ok'):
                             updates = data.get('result', [])
-
-                            for update in updates:
-                                if not self.is_running:
-                                    break
-                                await self.handle_update(update)
-                                self.offset = update['update_id'] + 1
-
+                            self.dispatcher.submit_batch(updates)
                             consecutive_errors = 0
 
                         else:
@@ -314,8 +454,14 @@ class AzkarBot:
                             consecutive_errors += 1
 
                     elif response.status == 409:
-                        # Conflict - another instance is running
-                        logger.warning("تعارض - هناك نسخة أخرى من البوت تعمل")
+                        data = await response.json(content_type=None)
+                        if 'webhook' in data.get('description', '').lower():
+                            # سجل webhook بعد بدء الاستطلاع (نسخة أخرى في وضع webhook)
+                            logger.warning("تعارض - webhook مسجل، سيتم حذفه")
+                            await self.delete_webhook()
+                        else:
+                            # Conflict - another instance is running
+                            logger.warning("تعارض - هناك نسخة أخرى من البوت تعمل")
                         await asyncio.sleep(10)
                         consecutive_errors += 1
 
@@ -331,7 +477,7 @@ class AzkarBot:
                 logger.error(f"خطأ في معالجة التحديثات: {e}")
                 consecutive_errors += 1
 
-            # إدارة الأخطاء المتتالية
+            # إدارة الأخطاء المتتالية؛ بدون أخطاء نعيد الطلب فوراً (الاستطلاع الطويل ينتظر بنفسه)
             if consecutive_errors > 0:
                 if consecutive_errors >= max_consecutive_errors:
                     delay = min(base_delay * (2 ** consecutive_errors), 60)
@@ -339,11 +485,100 @@ class AzkarBot:
                     await asyncio.sleep(delay)
                 else:
                     await asyncio.sleep(base_delay)
-            else:
-                await asyncio.sleep(1)
+
+        # إنهاء التحديثات الجارية وتأكيدها حتى لا تعاد بعد إعادة التشغيل
+        await self.dispatcher.drain()
+        await self.acknowledge_updates()
 
         logger.info("تم إيقاف معالجة الرسائل")
 
+    async def delete_webhook(self):
+        """إلغاء تسجيل webhook حتى يعمل getUpdates (التحديثات المعلقة تبقى لتستلم بالاستطلاع)"""
+        try:
+            async with self.session.post(f"{self.base_url}/deleteWebhook",
+                                         json={'drop_pending_updates': False}) as response:
+                result = await response.json(content_type=None)
+                if not result.get('ok'):
+                    logger.error(f"فشل حذف webhook: {result}")
+        except Exception as e:
+            logger.error(f"خطأ في حذف webhook: {e}")
+
+    async def run_webhook(self):
+        """استقبال التحديثات عبر webhook مدمج وتسجيله لدى Telegram"""
+        path = os.getenv("WEBHOOK_PATH", "/telegram")
+        secret = os.getenv("WEBHOOK_SECRET") or default_secret(self.bot_token)
+        self.webhook_server = WebhookServer(
+            self.dispatcher,
+            secret,
+            path=path,
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", "8080"))
+        )
+        await self.webhook_server.start()
+
+        data = {
+            'url': f"{self.webhook_url}{path}",
+            'secret_token': secret,
+            'allowed_updates': ['message', 'callback_query'],
+            'max_connections': int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        }
+        try:
+            async with self.session.post(f"{self.base_url}/setWebhook", json=data) as response:
+                result = await response.json()
+                if result.get('ok'):
+                    logger.info(f"✅ تم تسجيل webhook: {data['url']}")
+                else:
+                    logger.error(f"فشل تسجيل webhook: {result}")
+        except Exception as e:
+            logger.error(f"خطأ في تسجيل webhook: {e}")
+
+        try:
+            while self.is_running:
+                await asyncio.sleep(1)
+        finally:
+            await self.webhook_server.stop()
+            await self.dispatcher.drain()
+            logger.info("تم إيقاف خادم webhook")
+
+    async def preprocess_media(self):
+        """تجهيز الملفات الجديدة أو المعدلة في خيط منفصل ثم تحديث الفهرس"""
+        try:
+            results = await asyncio.to_thread(media_pipeline.process_all)
+            self.media.refresh(force=True)
+            logger.info(f"تم تجهيز الوسائط: {results}")
+        except Exception as e:
+            logger.error(f"خطأ في تجهيز الوسائط: {e}")
+
+    async def start_metrics_server(self):
+        """خادم /metrics على METRICS_PORT (في وضع webhook يعرض خادم webhook المسار نفسه)"""
+        port = os.getenv("METRICS_PORT")
+        if not port:
+            return
+        try:
+            app = web.Application()
+            app.router.add_get('/metrics', self.metrics_handler)
+            self.metrics_server = web.AppRunner(app, access_log=None)
+            await self.metrics_server.setup()
+            await web.TCPSite(self.metrics_server, os.getenv("METRICS_HOST", "0.0.0.0"), int(port)).start()
+            logger.info(f"📈 المقاييس متاحة على المنفذ {port}/metrics")
+        except Exception as e:
+            logger.error(f"خطأ في تشغيل خادم المقاييس: {e}")
+
+    async def metrics_handler(self, request):
+        """عرض المقاييس بصيغة Prometheus"""
+        return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    async def acknowledge_updates(self):
+        """تأكيد التحديثات المعالجة لدى Telegram"""
+        if not self.session or self.session.closed:
+            return
+        try:
+            params = {'offset': self.dispatcher.offset, 'limit': 1, 'timeout': 0}
+            async with self.session.get(f"{self.base_url}/getUpdates", params=params) as response:
+                await response.read()
+        except Exception as e:
+            logger.warning(f"تعذر تأكيد التحديثات: {e}")
+
     async def handle_update(self, update):
         """معالجة تحديث واحد مع معالجة شاملة للأخطاء"""
         try:
@@ -362,17 +597,25 @@ class AzkarBot:
             text = message.get('text', '')
             user_id = message.get('from', {}).get('id')
 
+            # ترقية مجموعة إلى supergroup: رسالة في القديمة (migrate_to_chat_id) وأخرى في الجديدة (migrate_from_chat_id)
+            if message.get('migrate_to_chat_id'):
+                self.migrate_group(chat_id, message['migrate_to_chat_id'])
+                return
+            if message.get('migrate_from_chat_id') and self.migrate_group(message['migrate_from_chat_id'], chat_id):
+                # مجموعة معروفة بمعرف جديد: لا حاجة لرسالة الترحيب
+                return
+
             # تسجيل المجموعات تلقائياً
             if chat.get('type') in ['group', 'supergroup']:
-                if chat_id not in self.active_groups:
-                    self.active_groups.add(chat_id)
-                    self.save_active_groups()
+                if self.active_groups.add(chat_id):
                     logger.info(f"مجموعة جديدة: {chat_id}")
                     await self.send_welcome_to_new_group(chat_id)
 
             # معالجة أوامر المطور
             if user_id == self.admin_id:
-                if user_id in self.admin_states:
+                # حالة المطور تخص المحادثة الخاصة التي بدأت منها، لا أي رسالة له في مجموعة
+                state = self.admin_states.get(user_id)
+                if state and chat.get('type') == 'private' and state.get('chat_id') == chat_id:
                     await self.handle_admin_state(message)
                     return
 
@@ -380,7 +623,8 @@ class AzkarBot:
                     await self.show_admin_panel(chat_id)
                     return
 
-                if message.get('photo') or message.get('voice') or message.get('audio') or message.get('document'):
+                # الملفات تضاف للمحتوى من المحادثة الخاصة فقط، لا مما يرسله المطور في المجموعات
+                if chat.get('type') == 'private' and media_ingest.message_media(message):
                     await self.handle_admin_media(message)
                     return
 
@@ -392,38 +636,39 @@ class AzkarBot:
             logger.error(f"خطأ في معالجة الرسالة: {e}")
 
     async def get_prayer_times(self):
-        """جلب مواقيت الصلاة مع إعادة المحاولة"""
-        max_retries = 3
-
-        for attempt in range(max_retries):
-            try:
-                today = datetime.now(self.cairo_tz).strftime('%d-%m-%Y')
-                url = f"https://api.aladhan.com/v1/timingsByCity/{today}"
-                params = {
-                    'city': 'cairo',
-                    'country': 'egypt',
-                    'method': '8'
-                }
-
-                async with self.session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get('code') == 200:
-                            timings = data['data']['timings']
-                            return {
-                                'Fajr': timings['Fajr'],
-                                'Dhuhr': timings['Dhuhr'],
-                                'Asr': timings['Asr'],
-                                'Maghrib': timings['Maghrib'],
-                                'Isha': timings['Isha']
-                            }
+        """حساب مواقيت الصلاة محلياً (بدون إنترنت) مع مقارنة اختيارية بـ aladhan"""
+        try:
+            today = datetime.now(self.cairo_tz).date()
+            timings = self.prayer_calendar.timings(today)
+        except Exception as e:
+            logger.error(f"خطأ في حساب مواقيت الصلاة: {e}")
+            return None
 
-            except Exception as e:
-                logger.error(f"خطأ في جلب مواقيت الصلاة (محاولة {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2 ** attempt)
+        if os.getenv("PRAYER_API_CHECK", "0") == "1":
+            asyncio.create_task(self.cross_check_prayer_times(today, timings))
+        return timings
 
-        return None
+    async def cross_check_prayer_times(self, day, timings):
+        """مقارنة المواقيت المحسوبة بـ api.aladhan.com وتسجيل أي فرق (للمراقبة فقط)"""
+        try:
+            url = f"https://api.aladhan.com/v1/timingsByCity/{day.strftime('%d-%m-%Y')}"
+            params = {
+                'city': 'cairo',
+                'country': 'egypt',
+                'method': self.prayer_api_method
+            }
+            async with self.session.get(url, params=params) as response:
+                if response.status != 200:
+                    return
+                data = await response.json()
+            remote = data['data']['timings']
+            for prayer, local_time in timings.items():
+                local_minutes = int(local_time[:2]) * 60 + int(local_time[3:5])
+                remote_minutes = int(remote[prayer][:2]) * 60 + int(remote[prayer][3:5])
+                if abs(local_minutes - remote_minutes) > 2:
+                    logger.warning(f"فرق في وقت {prayer}: محلي {local_time} / aladhan {remote[prayer]}")
+        except Exception as e:
+            logger.error(f"خطأ في مقارنة مواقيت الصلاة: {e}")
 
     async def schedule_prayer_notifications(self):
         """جدولة تنبيهات الصلاة المحسنة"""
@@ -433,48 +678,8 @@ class AzkarBot:
                 logger.error("فشل في الحصول على مواقيت الصلاة")
                 return
 
-            # إزالة المهام القديمة
-            current_jobs = self.scheduler.get_jobs()
-            for job in current_jobs:
-                if 'prayer' in job.id and 'daily' not in job.id:
-                    try:
-                        self.scheduler.remove_job(job.id)
-                    except:
-                        pass
-
-            prayer_messages = {
-                'Fajr': """🌅 **تنبيه صلاة الفجر** 🌅
-
-⏰ **خمس دقائق على الأذان**
-
-🕌 **لا تنس الوضوء والاستعداد للصلاة**""",
-
-                'Dhuhr': """☀️ **تنبيه صلاة الظهر** ☀️
-
-⏰ **خمس دقائق على الأذان**
-
-🕌 **توقف قليلاً واستعد للصلاة**""",
-
-                'Asr': """🌤️ **تنبيه صلاة العصر** 🌤️
-
-⏰ **خمس دقائق على الأذان**
-
-⚠️ **الصلاة الوسطى - لا تفوتها**""",
-
-                'Maghrib': """🌅 **تنبيه صلاة المغرب** 🌅
-
-⏰ **خمس دقائق على الأذان**
-
-🌇 **وقت استجابة الدعاء**""",
-
-                'Isha': """🌙 **تنبيه صلاة العشاء** 🌙
-
-⏰ **خمس دقائق على الأذان**
-
-🌟 **آخر صلاة في اليوم**"""
-            }
-
             current_time = datetime.now(self.cairo_tz)
+            adhans = {}
 
             for prayer, time_str in prayer_times.items():
                 try:
@@ -485,81 +690,38 @@ class AzkarBot:
                     if prayer_datetime <= current_time:
                         prayer_datetime += timedelta(days=1)
 
-                    # تنبيه قبل 5 دقائق
-                    notification_time = prayer_datetime - timedelta(minutes=5)
-
-                    if notification_time > current_time:
-                        self.scheduler.add_job(
-                            self.send_prayer_notification,
-                            'date',
-                            run_date=notification_time,
-                            args=[prayer_messages[prayer]],
-                            id=f"prayer_{prayer}_{current_time.strftime('%Y%m%d')}",
-                            replace_existing=True,
-                            misfire_grace_time=300
-                        )
-
-                        # صورة ما بعد الصلاة
-                        after_prayer_time = prayer_datetime + timedelta(minutes=20)
-                        self.scheduler.add_job(
-                            self.send_after_prayer_image,
-                            'date',
-                            run_date=after_prayer_time,
-                            id=f"after_prayer_{prayer}_{current_time.strftime('%Y%m%d')}",
-                            replace_existing=True,
-                            misfire_grace_time=300
-                        )
-
-                        logger.info(f"جُدولت صلاة {prayer} في {notification_time}")
+                    adhans[prayer] = prayer_datetime
+                    logger.info(f"جُدولت صلاة {prayer} في {prayer_datetime}")
 
                 except Exception as e:
                     logger.error(f"خطأ في جدولة صلاة {prayer}: {e}")
 
+            # التنبيه قبل الأذان وصورة ما بعد الصلاة حسب إعدادات كل مجموعة
+            self.cadences.schedule_prayers(adhans)
+
         except Exception as e:
             logger.error(f"خطأ في جدولة الصلوات: {e}")
 
     def load_azkar_texts(self):
-        """تحميل نصوص الأذكار مع معالجة الأخطاء"""
-        try:
-            if os.path.exists('Azkar.txt'):
-                with open('Azkar.txt', 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    azkar_list = [azkar.strip() for azkar in content.split('---') if azkar.strip()]
-                    return azkar_list if azkar_list else ["سبحان الله وبحمده"]
-            else:
-                return ["سبحان الله وبحمده", "لا إله إلا الله", "الله أكبر"]
-        except Exception as e:
-            logger.error(f"خطأ في تحميل الأذكار: {e}")
-            return ["سبحان الله وبحمده"]
-
-    def get_random_file(self, folder, extensions):
-        """الحصول على ملف عشوائي مع معالجة الأخطاء"""
+        """نصوص الأذكار من النسخة المحملة في الذاكرة (يعاد تحميلها عند تغير الملف فقط)"""
+        return self.corpus.texts
+
+    def get_random_file(self, folder, extensions, chat_id=None):
+        """ملف من فهرس الوسائط في الذاكرة: التالي في ترتيب المجموعة إن حددت، وإلا عشوائي"""
+        chooser = None
+        if chat_id is not None:
+            chooser = lambda n: self.rotation.pick(folder, chat_id, n)
         try:
-            if os.path.exists(folder):
-                files = [f for f in os.listdir(folder) if f.lower().endswith(extensions) and not f.endswith('.info')]
-                if files:
-                    selected_file = random.choice(files)
-                    file_path = os.path.join(folder, selected_file)
-
-                    # قراءة الوصف
-                    info_file = f"{file_path}.info"
-                    caption = None
-
-                    if os.path.exists(info_file):
-                        try:
-                            with open(info_file, 'r', encoding='utf-8') as f:
-                                info_data = json.load(f)
-                                user_caption = info_data.get('caption', '').strip()
-                                if user_caption:
-                                    caption = f"**{user_caption}**"
-                        except Exception as e:
-                            logger.error(f"خطأ في قراءة ملف المعلومات: {e}")
-
-                    return file_path, caption
+            return self.media.pick(folder, extensions, chooser)
         except Exception as e:
             logger.error(f"خطأ في قراءة المجلد {folder}: {e}")
         return None, None
 
+    def next_azkar_message(self, chat_id):
+        """الذكر التالي في ترتيب المجموعة (بدون تكرار حتى تنتهي القائمة) منسقاً بالخط العريض"""
+        snapshot = self.corpus.snapshot()
+        return snapshot.bold(self.rotation.pick('azkar', chat_id, len(snapshot.texts)))
+
     def create_inline_keyboard(self):
         """إنشاء لوحة المفاتيح"""
         return {
@@ -583,44 +745,113 @@ class AzkarBot:
             ]
         }
 
-    async def send_message(self, chat_id, text, reply_markup=None, retry_count=0):
-        """إرسال رسالة مع إعادة المحاولة"""
-        max_retries = 3
-
-        try:
-            url = f"{self.base_url}/sendMessage"
-            data = {
-                'chat_id': chat_id,
-                'text': text,
-                'parse_mode': 'Markdown',
-                'disable_web_page_preview': True
-            }
-            if reply_markup:
-                data['reply_markup'] = json.dumps(reply_markup)
-
-            async with self.session.post(url, data=data) as response:
-                if response.status == 200:
+    async def call_api(self, method, chat_id, data, max_retries=3):
+        """استدعاء Telegram عبر منظم المعدل: ينتظر دوره، ويحترم retry_after عند 429، ويعيد المحاولة عند أخطاء الشبكة
+
+        data إما قاموس، أو جسم JSON جاهز (bytes)، أو دالة تنشئ FormData جديدة لكل محاولة.
+        الطلبات الجاهزة لها مهلة SEND_TIMEOUT (أقصر من مهلة الجلسة التي تحتاجها عمليات الرفع).
+        يرجع (status, result) أو (None, None) إذا فشلت كل المحاولات.
+        """
+        url = f"{self.base_url}/{method}"
+        for attempt in range(max_retries + 1):
+            await self.governor.acquire(chat_id)
+            started = time.perf_counter()
+            try:
+                payload = data() if callable(data) else data
+                # bytes هي جسم JSON جاهز من PayloadTemplate
+                if isinstance(payload, bytes):
+                    request = self.session.post(url, data=payload, headers=self.json_headers, timeout=self.send_timeout)
+                else:
+                    request = self.session.post(url, data=payload)
+                async with request as response:
                     result = await response.json()
-                    if result.get('ok'):
-                        return result['result']['message_id']
-                elif response.status == 403:
-                    # البوت محظور في المجموعة
-                    if chat_id in self.active_groups:
-                        self.active_groups.remove(chat_id)
-                        self.save_active_groups()
-                        logger.info(f"تم إزالة المجموعة المحظورة: {chat_id}")
-                elif response.status == 429 and retry_count < max_retries:
-                    # Rate limit
+                    status = response.status
+            except Exception as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                TELEGRAM_LATENCY.labels(method, 'timeout' if timed_out else 'error').observe(time.perf_counter() - started)
+                if attempt < max_retries:
                     await asyncio.sleep(1)
-                    return await self.send_message(chat_id, text, reply_markup, retry_count + 1)
+                    continue
+                kind = 'timeout' if timed_out else 'network'
+                log_sampled(logger, logging.ERROR, kind, "خطأ في الاتصال (%s): %s", method, e or kind)
+                return None, None
+
+            TELEGRAM_LATENCY.labels(method, str(status)).observe(time.perf_counter() - started)
+            if status != 200:
+                TELEGRAM_ERRORS.labels(str(status)).inc()
+            if status == 429 and attempt < max_retries:
+                retry_after = result.get('parameters', {}).get('retry_after', 1)
+                self.governor.on_rate_limited(retry_after, chat_id)
+                continue
+            if status == 200:
+                self.governor.on_success()
+            return status, result
+        return None, None
 
-        except Exception as e:
-            if retry_count < max_retries:
-                await asyncio.sleep(1)
-                return await self.send_message(chat_id, text, reply_markup, retry_count + 1)
-            logger.error(f"خطأ في إرسال الرسالة: {e}")
+    async def send_message(self, chat_id, text, reply_markup=None):
+        """إرسال رسالة مع إعادة المحاولة"""
+        return await self.send_payload(text_template(text, reply_markup), chat_id)
+
+    async def send_payload(self, template, chat_id):
+        """إرسال طلب جاهز لمجموعة: يضاف chat_id فقط إلى الجسم المسلسل مسبقاً"""
+        status, result = await self.call_api(template.method, chat_id, template.body(chat_id))
+        message = self.handle_send_result(chat_id, status, result)
+        return message['message_id'] if message else None
+
+    def handle_send_result(self, chat_id, status, result):
+        """معالجة موحدة لنتيجة أي إرسال: ترجع الرسالة عند النجاح، وتصنف الفشل (chat_health.classify)
+
+        403 أو "chat not found": تحذف المجموعة. ترقية المجموعة (migrate_to_chat_id): يستبدل معرفها.
+        رفض مؤقت (صلاحيات وغيرها): تستبعد المجموعة من البث بمهلة تتضاعف. إعادة المحاولة عند 429
+        (حسب retry_after) وعند انقطاع الاتصال أو انتهاء المهلة تتم في call_api.
+        """
+        verdict, new_chat_id = classify(status, result)
+        if verdict == OK:
+            self.health.record_success(chat_id)
+            return result['result']
+
+        if verdict == GONE:
+            CHAT_FAILURES.labels(verdict).inc()
+            self.remove_group(chat_id, result.get('description', ''))
+        elif verdict == MIGRATED:
+            CHAT_FAILURES.labels(verdict).inc()
+            self.migrate_group(chat_id, new_chat_id)
+        elif verdict == FAILING:
+            CHAT_FAILURES.labels(verdict).inc()
+            if self.health.record_failure(chat_id):
+                self.remove_group(chat_id, f"تكرر الفشل: {result.get('description', '')}")
+            else:
+                log_sampled(logger, logging.WARNING, 'backoff', "تأجيل المجموعة %s بعد الفشل: %s",
+                            chat_id, result.get('description', ''))
         return None
 
+    def remove_group(self, chat_id, reason=''):
+        """حذف مجموعة لم يعد البوت يستطيع الإرسال إليها"""
+        self.health.forget(chat_id)
+        if self.active_groups.discard(chat_id):
+            log_sampled(logger, logging.INFO, 'forbidden', "تم إزالة المجموعة %s: %s", chat_id, reason)
+            if self.shards and not self.shards.leading():
+                self.shards.report_removed(chat_id)
+            elif self.cadences.cadence_of(chat_id) != self.cadences.default:
+                self.cadences.set_cadence(chat_id, None)
+
+    def migrate_group(self, old_chat_id, new_chat_id):
+        """نقل مجموعة رقيت إلى supergroup إلى معرفها الجديد مع إعداداتها (False إذا لم تكن القديمة مسجلة)"""
+        self.health.forget(old_chat_id)
+        if not self.active_groups.discard(old_chat_id):
+            return False
+        self.active_groups.add(new_chat_id)
+        logger.info(f"ترقية المجموعة {old_chat_id} إلى {new_chat_id}")
+        if self.shards and not self.shards.leading():
+            # القائد يسجل المعرف الجديد وينقل الإعدادات عند وصول رسالة الترقية في التحديثات
+            self.shards.report_removed(old_chat_id)
+            return True
+        cadence = self.cadences.cadence_of(old_chat_id)
+        if cadence != self.cadences.default:
+            self.cadences.set_cadence(old_chat_id, None, persist=False)
+            self.cadences.set_cadence(new_chat_id, cadence)
+        return True
+
     async def send_start_message(self, chat_id):
         """إرسال رسالة البداية"""
         start_text = """**🌿 مرحبًا بك في بوت الأذكار 🌿**
@@ -647,265 +878,213 @@ class AzkarBot:
         reply_markup = self.create_inline_keyboard()
         await self.send_message(chat_id, welcome_text, reply_markup)
 
-    async def send_random_content(self):
-        """إرسال محتوى عشوائي"""
-        if not self.active_groups:
-            return
+    def build_sender(self, payload):
+        """بناء دالة الإرسال لكل مجموعة من وصف البث المحفوظ في صندوق الصادر
 
-        content_sent = False
+        الأجزاء الثابتة (لوحة المفاتيح والوصف وطريقة التنسيق) تسلسل مرة واحدة لكل بث،
+        ولا يتغير لكل مجموعة إلا chat_id والملف المختار لها.
+        """
+        reply_markup = self.create_inline_keyboard()
+        kind = payload['kind']
 
-        for chat_id in self.active_groups.copy():
-            try:
-                reply_markup = self.create_inline_keyboard()
-
-                if self.content_turn == 0:
-                    # نص
-                    azkar_list = self.load_azkar_texts()
-                    azkar_text = random.choice(azkar_list)
-                    text = f"**{azkar_text}**"
-                    await self.send_message(chat_id, text, reply_markup)
-                    content_sent = True
-
-                elif self.content_turn == 1:
-                    # صورة
-                    image_path, caption = self.get_random_file('random', ('.png', '.jpg', '.jpeg'))
-                    if image_path:
-                        if caption:
-                            await self.send_photo(chat_id, image_path, caption, reply_markup)
-                        else:
-                            await self.send_photo_without_caption(chat_id, image_path, reply_markup)
-                        content_sent = True
-
-                elif self.content_turn == 2:
-                    # صوت
-                    voice_path, caption = self.get_random_file('voices', ('.ogg', '.mp3'))
-                    if voice_path:
-                        if caption:
-                            await self.send_voice(chat_id, voice_path, caption, reply_markup)
-                        else:
-                            await self.send_voice_without_caption(chat_id, voice_path, reply_markup)
-                        content_sent = True
-
-                elif self.content_turn == 3:
-                    # ملف صوتي
-                    audio_path, caption = self.get_random_file('audios', ('.mp3', '.mp4', '.wav'))
-                    if audio_path:
-                        if caption:
-                            await self.send_audio(chat_id, audio_path, caption, reply_markup)
-                        else:
-                            await self.send_audio_without_caption(chat_id, audio_path, reply_markup)
-                        content_sent = True
+        if kind == 'text':
+            template = text_template(payload['text'], reply_markup)
 
-                # نص بديل إذا لم يتم إرسال محتوى
-                if not content_sent:
-                    azkar_list = self.load_azkar_texts()
-                    azkar_text = random.choice(azkar_list)
-                    text = f"**{azkar_text}**"
-                    await self.send_message(chat_id, text, reply_markup)
+            async def send(chat_id):
+                return await self.send_payload(template, chat_id)
 
-            except Exception as e:
-                logger.error(f"خطأ في إرسال المحتوى للمجموعة {chat_id}: {e}")
+        elif kind == 'image':
+            folder = payload['folder']
+            photo = MediaTemplate('photo', payload['caption'], reply_markup)
+            fallback = text_template(payload['fallback'], reply_markup)
+            self.media.refresh(folder)
+
+            async def send(chat_id):
+                image_path, _ = self.get_random_file(folder, ('.png', '.jpg', '.jpeg'), chat_id)
+                if image_path:
+                    return await self.send_media(photo, chat_id, image_path)
+                return await self.send_payload(fallback, chat_id)
+
+        elif kind == 'random':
+            # صورة أو صوت أو ملف صوتي حسب الدور، ونص (أو نص بديل إذا لم يوجد ملف)
+            folder, media_kind, extensions = {
+                1: ('random', 'photo', ('.png', '.jpg', '.jpeg')),
+                2: ('voices', 'voice', ('.ogg', '.mp3')),
+                3: ('audios', 'audio', ('.mp3', '.mp4', '.wav')),
+            }.get(payload['turn'], (None, None, None))
+            media = MediaTemplate(media_kind, None, reply_markup) if folder else None
+            if folder:
+                self.media.refresh(folder)
+            text_templates = {}
+
+            async def send(chat_id):
+                if media:
+                    file_path, caption = self.get_random_file(folder, extensions, chat_id)
+                    if file_path:
+                        return await self.send_media(media, chat_id, file_path, caption)
+
+                azkar_message = self.next_azkar_message(chat_id)
+                template = text_templates.get(azkar_message)
+                if template is None:
+                    template = text_templates[azkar_message] = text_template(azkar_message, reply_markup)
+                return await self.send_payload(template, chat_id)
+
+        else:
+            raise ValueError(f"unknown broadcast kind: {kind}")
+
+        return send
+
+    async def run_broadcast(self, job_id, payload, deadline=None, chat_ids=None):
+        """تسجيل البث في صندوق الصادر ثم إرساله للمجموعات (كل المجموعات افتراضياً)"""
+        if chat_ids is None:
+            chat_ids = self.active_groups.copy()
+        if self.shards:
+            chat_ids = self.shards.filter(chat_ids)
+        chat_ids = self.health.filter(chat_ids)
+        if not chat_ids:
+            return None
+
+        send = self.build_sender(payload)
+        record = await self.outbox.create(job_id, payload, chat_ids, deadline)
+        try:
+            # بث جديد: لم يسلم شيء بعد فلا حاجة لقراءة القائمة من القاعدة
+            return await self.broadcaster.run(job_id, list(dict.fromkeys(chat_ids)), send, on_delivered=record.mark)
+        finally:
+            await record.flush()
+            self.rotation.save()
+            self.health.save()
+            if self.is_running:
+                await record.finish()
+
+    def start_resume(self):
+        """تشغيل استكمال البث إن لم يكن يعمل بالفعل"""
+        if self.resume_task is None or self.resume_task.done():
+            self.resume_task = asyncio.create_task(self.resume_broadcasts())
+
+    async def resume_broadcasts(self):
+        """استكمال البث الذي انقطع قبل إعادة التشغيل (وتجاهل ما انتهت مهلته)"""
+        try:
+            for record in await self.outbox.unfinished():
+                pending = await record.pending()
+                owned = self.shards.filter(pending) if self.shards else pending
+                # مجموعات في أجزاء لا تملكها هذه النسخة الآن تبقى في السجل حتى تعود إليها أو تنتهي مهلة البث
+                held_back = len(owned) < len(pending)
+                if not owned:
+                    continue
+                owned = self.health.filter(owned)
+                logger.info(f"استكمال البث {record.job} لعدد {len(owned)} مجموعة")
+                send = self.build_sender(record.payload)
+                try:
+                    await self.broadcaster.run(record.job, owned, send, on_delivered=record.mark)
+                finally:
+                    await record.flush()
+                    if self.is_running and not held_back:
+                        await record.finish()
+            await self.outbox.purge()
+        except Exception as e:
+            logger.error(f"خطأ في استكمال البث: {e}")
+
+    async def dispatch_cadence(self, kind, chat_ids, extra):
+        """تنفيذ دفعة من جدول المجموعات: كل المجموعات المستحقة في نفس الثانية في بث واحد"""
+        if kind == 'random':
+            await self.send_random_content(chat_ids)
+        elif kind == 'morning':
+            await self.send_morning_azkar(chat_ids)
+        elif kind == 'evening':
+            await self.send_evening_azkar(chat_ids)
+        elif kind == 'prayer':
+            prayer, adhan_timestamp, offset = extra
+            await self.send_prayer_notification(prayer_message(prayer, offset), adhan_timestamp, chat_ids)
+        elif kind == 'after_prayer':
+            await self.send_after_prayer_image(chat_ids)
+
+    async def send_random_content(self, chat_ids=None):
+        """إرسال محتوى عشوائي"""
+        turn = self.content_turn
+        deadline = time.time() + 300
+        await self.run_broadcast('random_azkar', {'kind': 'random', 'turn': turn}, deadline, chat_ids)
 
         # تحديث دورة المحتوى
         self.content_turn = (self.content_turn + 1) % 4
 
-    async def send_morning_azkar(self):
+    async def send_morning_azkar(self, chat_ids=None):
         """أذكار الصباح"""
-        if not self.active_groups:
-            return
-
-        for chat_id in self.active_groups.copy():
-            try:
-                image_path, _ = self.get_random_file('morning', ('.png', '.jpg', '.jpeg'))
-                reply_markup = self.create_inline_keyboard()
-
-                if image_path:
-                    caption = "🌅 **أذكار الصباح** 🌅"
-                    await self.send_photo(chat_id, image_path, caption, reply_markup)
-                else:
-                    text = "🌅 **لا تنس أذكار الصباح** 🌅"
-                    await self.send_message(chat_id, text, reply_markup)
-
-            except Exception as e:
-                logger.error(f"خطأ في أذكار الصباح: {e}")
-
-    async def send_evening_azkar(self):
+        await self.run_broadcast('morning_azkar', {
+            'kind': 'image',
+            'folder': 'morning',
+            'caption': "🌅 **أذكار الصباح** 🌅",
+            'fallback': "🌅 **لا تنس أذكار الصباح** 🌅"
+        }, time.time() + 3600, chat_ids)
+
+    async def send_evening_azkar(self, chat_ids=None):
         """أذكار المساء"""
-        if not self.active_groups:
-            return
-
-        for chat_id in self.active_groups.copy():
-            try:
-                image_path, _ = self.get_random_file('evening', ('.png', '.jpg', '.jpeg'))
-                reply_markup = self.create_inline_keyboard()
-
-                if image_path:
-                    caption = "🌇 **أذكار المساء** 🌇"
-                    await self.send_photo(chat_id, image_path, caption, reply_markup)
-                else:
-                    text = "🌇 **لا تنس أذكار المساء** 🌇"
-                    await self.send_message(chat_id, text, reply_markup)
-
-            except Exception as e:
-                logger.error(f"خطأ في أذكار المساء: {e}")
-
-    async def send_prayer_notification(self, message_text):
-        """إرسال تنبيه الصلاة"""
-        if not self.active_groups:
-            return
-
-        reply_markup = self.create_inline_keyboard()
-        for chat_id in self.active_groups.copy():
-            try:
-                await self.send_message(chat_id, message_text, reply_markup)
-            except Exception as e:
-                logger.error(f"خطأ في تنبيه الصلاة: {e}")
-
-    async def send_after_prayer_image(self):
+        await self.run_broadcast('evening_azkar', {
+            'kind': 'image',
+            'folder': 'evening',
+            'caption': "🌇 **أذكار المساء** 🌇",
+            'fallback': "🌇 **لا تنس أذكار المساء** 🌇"
+        }, time.time() + 3600, chat_ids)
+
+    async def send_prayer_notification(self, message_text, deadline=None, chat_ids=None):
+        """إرسال تنبيه الصلاة (لا فائدة منه بعد الأذان)"""
+        await self.run_broadcast('prayer_notification', {'kind': 'text', 'text': message_text}, deadline, chat_ids)
+
+    async def send_after_prayer_image(self, chat_ids=None):
         """صورة ما بعد الصلاة"""
-        if not self.active_groups:
-            return
-
-        for chat_id in self.active_groups.copy():
-            try:
-                image_path, _ = self.get_random_file('prayers', ('.png', '.jpg', '.jpeg'))
-                reply_markup = self.create_inline_keyboard()
-
-                if image_path:
-                    caption = "🕌 **أذكار ما بعد الصلاة** 🕌"
-                    await self.send_photo(chat_id, image_path, caption, reply_markup)
-                else:
-                    text = "🕌 **لا تنس أذكار ما بعد الصلاة** 🕌"
-                    await self.send_message(chat_id, text, reply_markup)
-
-            except Exception as e:
-                logger.error(f"خطأ في صورة ما بعد الصلاة: {e}")
+        await self.run_broadcast('after_prayer', {
+            'kind': 'image',
+            'folder': 'prayers',
+            'caption': "🕌 **أذكار ما بعد الصلاة** 🕌",
+            'fallback': "🕌 **لا تنس أذكار ما بعد الصلاة** 🕌"
+        }, time.time() + 3600, chat_ids)
 
     # باقي الدوال المساعدة للإرسال والإدارة
-    async def send_photo(self, chat_id, photo_path, caption, reply_markup=None):
-        """إرسال صورة"""
-        try:
-            url = f"{self.base_url}/sendPhoto"
-            data = aiohttp.FormData()
-            data.add_field('chat_id', str(chat_id))
-            data.add_field('caption', caption)
-            data.add_field('parse_mode', 'Markdown')
-            if reply_markup:
-                data.add_field('reply_markup', json.dumps(reply_markup))
-
-            with open(photo_path, 'rb') as photo_file:
-                data.add_field('photo', photo_file)
-                async with self.session.post(url, data=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            return result['result']['message_id']
-        except Exception as e:
-            logger.error(f"خطأ في إرسال الصورة: {e}")
-        return None
+    async def upload_media(self, template, chat_id, file_path, caption=None):
+        """رفع الملف نفسه وإرجاع الرسالة المرسلة"""
+        fields = template.form_fields(chat_id, caption)
+        with open(file_path, 'rb') as media_file:
+            content = media_file.read()
 
-    async def send_photo_without_caption(self, chat_id, photo_path, reply_markup=None):
-        """إرسال صورة بدون وصف"""
-        try:
-            url = f"{self.base_url}/sendPhoto"
+        def build_form():
             data = aiohttp.FormData()
-            data.add_field('chat_id', str(chat_id))
-            if reply_markup:
-                data.add_field('reply_markup', json.dumps(reply_markup))
+            for name, value in fields.items():
+                data.add_field(name, value)
+            data.add_field(template.field, content, filename=os.path.basename(file_path))
+            return data
 
-            with open(photo_path, 'rb') as photo_file:
-                data.add_field('photo', photo_file)
-                async with self.session.post(url, data=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            return result['result']['message_id']
-        except Exception as e:
-            logger.error(f"خطأ في إرسال الصورة: {e}")
-        return None
+        status, result = await self.call_api(template.method, chat_id, build_form)
+        return self.handle_send_result(chat_id, status, result)
 
-    async def send_voice(self, chat_id, voice_path, caption, reply_markup=None):
-        """إرسال رسالة صوتية"""
-        try:
-            url = f"{self.base_url}/sendVoice"
-            data = aiohttp.FormData()
-            data.add_field('chat_id', str(chat_id))
-            data.add_field('caption', caption)
-            data.add_field('parse_mode', 'Markdown')
-            if reply_markup:
-                data.add_field('reply_markup', json.dumps(reply_markup))
-
-            with open(voice_path, 'rb') as voice_file:
-                data.add_field('voice', voice_file)
-                async with self.session.post(url, data=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            return result['result']['message_id']
-        except Exception as e:
-            logger.error(f"خطأ في إرسال الصوت: {e}")
-        return None
-
-    async def send_voice_without_caption(self, chat_id, voice_path, reply_markup=None):
-        """إرسال صوت بدون وصف"""
-        try:
-            url = f"{self.base_url}/sendVoice"
-            data = aiohttp.FormData()
-            data.add_field('chat_id', str(chat_id))
-            if reply_markup:
-                data.add_field('reply_markup', json.dumps(reply_markup))
-
-            with open(voice_path, 'rb') as voice_file:
-                data.add_field('voice', voice_file)
-                async with self.session.post(url, data=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            return result['result']['message_id']
-        except Exception as e:
-            logger.error(f"خطأ في إرسال الصوت: {e}")
-        return None
-
-    async def send_audio(self, chat_id, audio_path, caption, reply_markup=None):
-        """إرسال ملف صوتي"""
-        try:
-            url = f"{self.base_url}/sendAudio"
-            data = aiohttp.FormData()
-            data.add_field('chat_id', str(chat_id))
-            data.add_field('caption', caption)
-            data.add_field('parse_mode', 'Markdown')
-            if reply_markup:
-                data.add_field('reply_markup', json.dumps(reply_markup))
-
-            with open(audio_path, 'rb') as audio_file:
-                data.add_field('audio', audio_file)
-                async with self.session.post(url, data=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            return result['result']['message_id']
-        except Exception as e:
-            logger.error(f"خطأ في إرسال الملف الصوتي: {e}")
-        return None
+    async def send_media(self, template, chat_id, file_path, caption=None):
+        """إرسال ملف وسائط (صورة أو صوت أو ملف صوتي) مع إعادة استخدام file_id بعد أول رفع
 
-    async def send_audio_without_caption(self, chat_id, audio_path, reply_markup=None):
-        """إرسال ملف صوتي بدون وصف"""
+        template هو MediaTemplate يبنى مرة لكل بث؛ caption يستبدل وصفه الافتراضي لهذا الملف.
+        """
         try:
-            url = f"{self.base_url}/sendAudio"
-            data = aiohttp.FormData()
-            data.add_field('chat_id', str(chat_id))
-            if reply_markup:
-                data.add_field('reply_markup', json.dumps(reply_markup))
-
-            with open(audio_path, 'rb') as audio_file:
-                data.add_field('audio', audio_file)
-                async with self.session.post(url, data=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('ok'):
-                            return result['result']['message_id']
+            file_id = self.file_ids.lookup(file_path)
+            if file_id is None:
+                async with self.file_ids.lock(file_path):
+                    file_id = self.file_ids.lookup(file_path)
+                    if file_id is None:
+                        # أول إرسال للملف: رفعه وحفظ المعرف
+                        message = await self.upload_media(template, chat_id, file_path, caption)
+                        if not message:
+                            return None
+                        new_file_id = extract_file_id(message, template.field)
+                        if new_file_id:
+                            self.file_ids.store(file_path, new_file_id)
+                        return message['message_id']
+
+            payload = template.for_file(file_id, caption)
+            status, result = await self.call_api(payload.method, chat_id, payload.body(chat_id))
+            message = self.handle_send_result(chat_id, status, result)
+            if message:
+                return message['message_id']
+            if status == 400 and 'file' in result.get('description', '').lower():
+                # المعرف لم يعد صالحاً: إعادة الرفع في الإرسال التالي
+                self.file_ids.invalidate(file_path)
         except Exception as e:
-            logger.error(f"خطأ في إرسال الملف الصوتي: {e}")
+            log_sampled(logger, logging.ERROR, 'media', "خطأ في إرسال الملف (%s): %s", template.method, e)
         return None
 
     # باقي دوال الإدارة (مبسطة للتوافق مع Replit)
@@ -917,9 +1096,15 @@ class AzkarBot:
 📊 إحصائيات سريعة"""
 
         keyboard = {
-            "inline_keyboard": [[
-                {"text": "📊 الإحصائيات", "callback_data": "admin_stats"}
-            ]]
+            "inline_keyboard": [
+                [{"text": "📊 الإحصائيات", "callback_data": "admin_stats"}],
+                [{"text": "➕ إضافة ذكر", "callback_data": "admin_add_text"}],
+                [
+                    {"text": "🌅 صورة صباح", "callback_data": "admin_media:morning"},
+                    {"text": "🌇 صورة مساء", "callback_data": "admin_media:evening"},
+                    {"text": "🕌 بعد الصلاة", "callback_data": "admin_media:prayers"}
+                ]
+            ]
         }
         await self.send_message(chat_id, text, keyboard)
 
@@ -936,31 +1121,139 @@ class AzkarBot:
             stats = await self.get_bot_stats()
             await self.send_message(chat_id, stats)
 
+        elif (data == "admin_add_text" or data.startswith("admin_media:")) \
+                and callback_query['message']['chat'].get('type') != 'private':
+            # المحتوى يضاف من المحادثة الخاصة فقط حتى لا تُستهلك رسالة في مجموعة
+            await self.send_message(chat_id, "🔒 إضافة المحتوى من المحادثة الخاصة مع البوت فقط")
+
+        elif data == "admin_add_text":
+            self.admin_states[user_id] = {'action': 'add_text', 'chat_id': chat_id}
+            await self.send_message(chat_id, "✍️ أرسل نص الذكر الجديد (أو /cancel للإلغاء)")
+
+        elif data.startswith("admin_media:"):
+            folder = data.split(':', 1)[1]
+            self.admin_states[user_id] = {'action': 'add_media', 'folder': folder, 'chat_id': chat_id}
+            await self.send_message(chat_id, f"🖼 أرسل الصورة التي ستضاف إلى {folder} (أو /cancel للإلغاء)")
+
     async def handle_admin_state(self, message):
-        """معالجة حالات المطور"""
-        pass
+        """معالجة حالات المطور: انتظار نص ذكر جديد أو ملف لمجلد محدد"""
+        user_id = message['from']['id']
+        chat_id = message['chat']['id']
+        state = self.admin_states.get(user_id) or {}
+        text = message.get('text', '')
+
+        if text == '/cancel':
+            self.admin_states.pop(user_id, None)
+            await self.send_message(chat_id, "تم الإلغاء")
+            return
+
+        if state.get('action') == 'add_text':
+            if not text.strip():
+                await self.send_message(chat_id, "✍️ أرسل نص الذكر (أو /cancel للإلغاء)")
+                return
+            self.admin_states.pop(user_id, None)
+            try:
+                await asyncio.to_thread(self.append_azkar_text, text.strip())
+                # النسخة في الذاكرة تتجدد فوراً دون انتظار فحص الملف الدوري
+                self.corpus.refresh(force=True)
+                await self.send_message(chat_id, f"✅ أضيف الذكر (العدد الآن {self.corpus.count})")
+            except Exception as e:
+                logger.error(f"خطأ في إضافة الذكر: {e}")
+                await self.send_message(chat_id, "❌ تعذر حفظ الذكر")
 
-    async def handle_admin_media(self, message):
-        """معالجة ملفات المطور"""
-        pass
+        elif state.get('action') == 'add_media':
+            if media_ingest.message_media(message) is None:
+                await self.send_message(chat_id, "🖼 أرسل ملفاً (أو /cancel للإلغاء)")
+                return
+            self.admin_states.pop(user_id, None)
+            await self.handle_admin_media(message, state.get('folder'))
+
+        else:
+            self.admin_states.pop(user_id, None)
+
+    def append_azkar_text(self, text):
+        """إضافة ذكر في آخر Azkar.txt"""
+        with open(self.corpus.path, 'a+', encoding='utf-8') as f:
+            f.seek(0, os.SEEK_END)
+            f.write(f"\n---\n{text}" if f.tell() else text)
+
+    async def handle_admin_media(self, message, folder=None):
+        """حفظ ملف أرسله المطور في مجلد المحتوى المناسب وإضافته للبث فوراً
+
+        يُحمّل الملف من getFile على أجزاء (بدون تحميله كاملاً في الذاكرة) ويحفظ باسم بصمة محتواه،
+        فلا يتكرر الملف إذا أرسل مرتين. يكتب ملف .info بالوصف، ويجهز الملف (media_pipeline)،
+        ثم يضاف إلى فهرس الوسائط مباشرة دون إعادة فحص المجلد.
+        """
+        chat_id = message['chat']['id']
+        kind, media = media_ingest.message_media(message)
+        try:
+            if media.get('file_size', 0) > media_ingest.MAX_DOWNLOAD_BYTES:
+                await self.send_message(chat_id, "❌ الملف أكبر من 20 ميجابايت (حد getFile)")
+                return
+
+            status, result = await self.call_api('getFile', chat_id, {'file_id': media['file_id']})
+            if status != 200 or not result.get('ok'):
+                await self.send_message(chat_id, "❌ تعذر الحصول على الملف من Telegram")
+                return
+            telegram_path = result['result']['file_path']
+
+            extension = media_ingest.media_extension(kind, media, telegram_path)
+            folder = media_ingest.target_folder(kind, extension, folder)
+            if folder is None:
+                await self.send_message(chat_id, f"❌ نوع الملف {extension or '?'} غير مدعوم")
+                return
+
+            media_folder = self.media.folder(folder)
+            was_current = media_folder.is_current()
+            name, created = await media_ingest.download(
+                self.session, f"{self.file_url}/{telegram_path}", folder, extension
+            )
+            path = os.path.join(folder, name)
+            caption = message.get('caption', '').strip()
+            if not created and not caption:
+                await self.send_message(chat_id, f"ℹ️ الملف موجود مسبقاً في {folder}")
+                return
+
+            await asyncio.to_thread(
+                media_ingest.write_info, path, caption, file_unique_id=media.get('file_unique_id')
+            )
+            if created and media_pipeline.available():
+                await asyncio.to_thread(media_pipeline.process_file, path, media_pipeline.FOLDER_KINDS[folder])
+            media_folder.ingest(name, was_current)
+
+            # الملف نفسه موجود على خوادم Telegram: لا حاجة لرفعه عند أول بث إذا أرسل كما هو
+            sent_path, _ = media_folder.entry(name)
+            if created and sent_path == path and kind == {'voices': 'voice', 'audios': 'audio'}.get(folder, 'photo'):
+                self.file_ids.store(path, media['file_id'])
+
+            action = "أضيف" if created else "حُدّث وصف"
+            await self.send_message(chat_id, f"✅ {action} الملف في {folder} (عدد الملفات {len(media_folder)})")
+
+        except media_ingest.IngestError as e:
+            await self.send_message(chat_id, f"❌ {e}")
+        except Exception as e:
+            logger.error(f"خطأ في حفظ ملف المطور: {e}")
+            await self.send_message(chat_id, "❌ تعذر حفظ الملف")
 
     async def get_bot_stats(self):
         """إحصائيات البوت"""
         groups_count = len(self.active_groups)
-        texts_count = len(self.load_azkar_texts())
+        snapshot = self.corpus.snapshot()
 
         return f"""📊 **إحصائيات البوت:**
 
 👥 **المجموعات:** {groups_count}
-📝 **النصوص:** {texts_count}
+🩺 **مؤجلة بعد فشل متكرر:** {self.health.stats()['backed_off']}
+📝 **النصوص:** {len(snapshot.texts)} (الإصدار {snapshot.version})
+⚡ **معدل الإرسال:** {self.governor.current_rate:.1f} رسالة/ث
 ⏰ **الوقت:** {datetime.now(self.cairo_tz).strftime('%H:%M')}"""
 
 # تشغيل البوت
 async def main():
     """الدالة الرئيسية"""
     # Guard: do not start polling by default when running in serverless environments (Vercel)
-    if os.environ.get('POLLING', '0') != '1':
-        logger.info("Polling is disabled because POLLING!=1. To enable polling set POLLING=1 and run the script.")
+    if os.environ.get('POLLING', '0') != '1' and not os.environ.get('WEBHOOK_URL'):
+        logger.info("Polling is disabled because POLLING!=1. To enable polling set POLLING=1, or set WEBHOOK_URL to receive updates through the embedded webhook server.")
         return
 
     bot = AzkarBot()
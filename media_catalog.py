@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import cache_counters
+
+logger = logging.getLogger(__name__)
+
+_HITS, _MISSES = cache_counters('media')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+MEDIA_FOLDERS = {
+    'random': IMAGE_EXTENSIONS,
+    'morning': IMAGE_EXTENSIONS,
+    'evening': IMAGE_EXTENSIONS,
+    'prayers': IMAGE_EXTENSIONS,
+    'voices': ('.ogg', '.mp3'),
+    'audios': ('.mp3', '.mp4', '.wav'),
+}
+
+
+def load_info(info_path: str) -> dict:
+    """The `.info` sidecar of a media file ({} if there is none)."""
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        return info if isinstance(info, dict) else {}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error("could not read %s: %s", info_path, e)
+    return {}
+
+
+def caption_from_info(info: dict) -> Optional[str]:
+    """Caption from a sidecar, already wrapped in bold Markdown."""
+    user_caption = str(info.get('caption', '')).strip()
+    return f"**{user_caption}**" if user_caption else None
+
+
+def read_caption(info_path: str) -> Optional[str]:
+    return caption_from_info(load_info(info_path))
+
+
+def processed_path(source: str, info: dict) -> Optional[str]:
+    """The preprocessed copy recorded in the sidecar, if it still matches the source file."""
+    processed = info.get('processed')
+    if not processed or not processed.get('path'):
+        return None
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    if st.st_size != processed.get('source_size') or st.st_mtime_ns != processed.get('source_mtime_ns'):
+        return None
+    path = os.path.join(os.path.dirname(source), processed['path'])
+    return path if os.path.exists(path) else None
+
+
+# (mtime, size) of a file; a missing one compares equal only to another missing one
+_MISSING = (0, -1)
+
+
+def _signature(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return _MISSING
+    return st.st_mtime_ns, st.st_size
+
+
+class MediaEntry:
+    """`source` is the file in the folder; `path` is what gets sent (its preprocessed copy when there is one)."""
+    __slots__ = ('source', 'path', 'caption', 'signature', 'info_signature')
+
+    def __init__(self, source: str, path: str, caption: Optional[str], signature: Tuple[int, int],
+                 info_signature: Tuple[int, int]):
+        self.source = source
+        self.path = path
+        self.caption = caption
+        self.signature = signature
+        self.info_signature = info_signature
+
+
+class MediaFolder:
+    """In-memory index of one content folder.
+
+    Entries live in a list for O(1) random picks and a name -> position map
+    for O(1) add/remove (removal swaps the last entry into the hole).
+
+    Adding or removing a file moves the directory mtime, which refresh()
+    checks first. Replacing a file in place or editing its `.info` does
+    not, so the files themselves are re-stat'ed at least every
+    `rescan_interval` seconds.
+    """
+
+    def __init__(self, path: str, extensions: Tuple[str, ...], rescan_interval: float = 300.0):
+        self.path = path
+        self.extensions = extensions
+        self.rescan_interval = rescan_interval
+        self._scanned_at = float('-inf')
+        self._entries: List[MediaEntry] = []
+        self._positions: Dict[str, int] = {}
+        self._dir_mtime_ns: Optional[int] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _accepts(self, name: str) -> bool:
+        return name.lower().endswith(self.extensions) and not name.endswith('.info')
+
+    def add(self, name: str, caption: Optional[str] = None, read_info: bool = True):
+        """Index (or re-index) a single file without rescanning the folder."""
+        path = os.path.join(self.path, name)
+        info_path = f"{path}.info"
+        send_path = path
+        if read_info:
+            info = load_info(info_path)
+            caption = caption_from_info(info)
+            send_path = processed_path(path, info) or path
+        entry = MediaEntry(path, send_path, caption, _signature(path), _signature(info_path))
+        position = self._positions.get(name)
+        if position is None:
+            self._positions[name] = len(self._entries)
+            self._entries.append(entry)
+        else:
+            self._entries[position] = entry
+
+    def remove(self, name: str):
+        position = self._positions.pop(name, None)
+        if position is None:
+            return
+        last = self._entries.pop()
+        if position < len(self._entries):
+            self._entries[position] = last
+            self._positions[os.path.basename(last.source)] = position
+
+    def is_current(self) -> bool:
+        """Whether the index reflects the directory as it is on disk right now."""
+        try:
+            return os.stat(self.path).st_mtime_ns == self._dir_mtime_ns
+        except OSError:
+            return False
+
+    def ingest(self, name: str, was_current: bool):
+        """Index a file this process just wrote, without rescanning the folder.
+
+        `was_current` is `is_current()` from before the write: only then is
+        the new directory mtime known to come from this write alone, and
+        recorded so the next refresh stays a no-op.
+        """
+        self.add(name)
+        if was_current:
+            try:
+                self._dir_mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError:
+                pass
+
+    def refresh(self, force: bool = False) -> bool:
+        """Apply on-disk changes incrementally; a no-op unless the directory mtime moved or a rescan is due."""
+        try:
+            dir_mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            if self._entries:
+                self._entries.clear()
+                self._positions.clear()
+            self._dir_mtime_ns = None
+            return False
+        now = time.monotonic()
+        if not force and dir_mtime_ns == self._dir_mtime_ns and now - self._scanned_at < self.rescan_interval:
+            _HITS.inc()
+            return False
+        _MISSES.inc()
+        self._dir_mtime_ns = dir_mtime_ns
+        self._scanned_at = now
+
+        names = {}
+        info_signatures = {}
+        with os.scandir(self.path) as it:
+            for dirent in it:
+                if dirent.name.endswith('.info'):
+                    st = dirent.stat()
+                    info_signatures[dirent.name[:-5]] = (st.st_mtime_ns, st.st_size)
+                elif self._accepts(dirent.name) and dirent.is_file():
+                    st = dirent.stat()
+                    names[dirent.name] = (st.st_mtime_ns, st.st_size)
+
+        for name in [n for n in self._positions if n not in names]:
+            self.remove(name)
+        for name, signature in names.items():
+            position = self._positions.get(name)
+            if position is None:
+                self.add(name)
+                continue
+            entry = self._entries[position]
+            if entry.signature != signature or entry.info_signature != info_signatures.get(name, _MISSING):
+                self.add(name)
+        return True
+
+    def entry(self, name: str) -> Tuple[Optional[str], Optional[str]]:
+        """(path to send, caption) of an indexed file."""
+        position = self._positions.get(name)
+        if position is None:
+            return None, None
+        entry = self._entries[position]
+        return entry.path, entry.caption
+
+    def pick(self, chooser: Callable[[int], int] = None) -> Tuple[Optional[str], Optional[str]]:
+        """A random entry, or the one at `chooser(len(entries))` (e.g. a group's no-repeat rotation)."""
+        entries = self._entries
+        if not entries:
+            return None, None
+        entry = entries[chooser(len(entries))] if chooser else random.choice(entries)
+        return entry.path, entry.caption
+
+
+class MediaCatalog:
+    """Indexes for all content folders under `root`, refreshed at most every `refresh_interval` seconds."""
+
+    def __init__(self, root: str = '', folders: Dict[str, Tuple[str, ...]] = None, refresh_interval: float = 30.0):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self._folders: Dict[str, MediaFolder] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        for name, extensions in (folders or MEDIA_FOLDERS).items():
+            self.folder(name, extensions)
+
+    def folder(self, name: str, extensions: Tuple[str, ...] = None) -> MediaFolder:
+        media_folder = self._folders.get(name)
+        if media_folder is None:
+            media_folder = MediaFolder(os.path.join(self.root, name), extensions or MEDIA_FOLDERS.get(name, ()))
+            self._folders[name] = media_folder
+            media_folder.refresh(force=True)
+            self._refreshed_at[name] = time.monotonic()
+        return media_folder
+
+    def refresh(self, name: str = None, force: bool = False):
+        """Pick up added/removed/changed files. Call once per broadcast, not per send."""
+        now = time.monotonic()
+        for folder_name in ([name] if name else list(self._folders)):
+            if not force and now - self._refreshed_at.get(folder_name, float('-inf')) < self.refresh_interval:
+                continue
+            self._refreshed_at[folder_name] = now
+            try:
+                self.folder(folder_name).refresh(force=force)
+            except Exception as e:
+                logger.error("could not refresh media folder %s: %s", folder_name, e)
+
+    def pick(self, name: str, extensions: Tuple[str, ...] = None,
+             chooser: Callable[[int], int] = None) -> Tuple[Optional[str], Optional[str]]:
+        return self.folder(name, extensions).pick(chooser)
+
+    def counts(self) -> Dict[str, int]:
+        return {name: len(media_folder) for name, media_folder in self._folders.items()}
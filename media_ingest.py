@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+from media_catalog import MEDIA_FOLDERS
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# the Bot API's getFile only serves files up to 20 MB
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+NAME_DIGEST_CHARS = 32
+
+DEFAULT_FOLDERS = {
+    'photo': 'random',
+    'voice': 'voices',
+    'audio': 'audios',
+}
+
+DEFAULT_EXTENSIONS = {
+    'photo': '.jpg',
+    'voice': '.ogg',
+    'audio': '.mp3',
+}
+
+
+class IngestError(Exception):
+    pass
+
+
+def message_media(message: dict) -> Optional[Tuple[str, dict]]:
+    """(kind, media object) of an incoming photo, voice, audio or document message."""
+    if message.get('photo'):
+        # sizes come smallest first; the last one is the original
+        return 'photo', message['photo'][-1]
+    for kind in ('voice', 'audio', 'document'):
+        if message.get(kind):
+            return kind, message[kind]
+    return None
+
+
+def media_extension(kind: str, media: dict, telegram_path: str = '') -> str:
+    for name in (media.get('file_name'), telegram_path):
+        ext = os.path.splitext(name or '')[1].lower()
+        if ext:
+            return '.jpg' if ext == '.jpeg' else ext
+    return DEFAULT_EXTENSIONS.get(kind, '')
+
+
+def target_folder(kind: str, extension: str, requested: str = None) -> Optional[str]:
+    """The content folder a file goes to: the requested one if it accepts the extension, else the default."""
+    if requested and extension in MEDIA_FOLDERS.get(requested, ()):
+        return requested
+    default = DEFAULT_FOLDERS.get(kind)
+    if default and extension in MEDIA_FOLDERS[default]:
+        return default
+    for folder in ('random', 'voices', 'audios'):
+        if extension in MEDIA_FOLDERS[folder]:
+            return folder
+    return None
+
+
+async def download(session, url: str, folder: str, extension: str,
+                   max_bytes: int = MAX_DOWNLOAD_BYTES) -> Tuple[str, bool]:
+    """Stream a file into `folder` under its content hash. Returns (file name, False if it was already there).
+
+    Chunks are hashed as they are written to a hidden temp file, so memory
+    stays flat whatever the size; the temp file is renamed once the hash is
+    known, or dropped when a file with the same content already exists.
+    """
+    tmp_path = os.path.join(folder, f".incoming-{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise IngestError(f"download failed with HTTP {response.status}")
+            with open(tmp_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise IngestError(f"file is larger than {max_bytes // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    f.write(chunk)
+
+        name = f"{digest.hexdigest()[:NAME_DIGEST_CHARS]}{extension}"
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return name, False
+        os.replace(tmp_path, path)
+        logger.info("stored %s (%d bytes)", path, size)
+        return name, True
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_info(path: str, caption: str = '', **fields):
+    """Create or update the `.info` sidecar of a stored file (temp file + rename)."""
+    info_path = f"{path}.info"
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        info = {}
+    if caption:
+        info['caption'] = caption
+    info.setdefault('added', datetime.now().isoformat(timespec='seconds'))
+    info.update(fields)
+    save_info(info_path, info)
+
+
+def save_info(info_path: str, info: dict):
+    """Replace a `.info` sidecar with `info` (temp file + rename)."""
+    tmp_path = f"{info_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, info_path)
@@ -0,0 +1,213 @@
+"""Normalise media once at ingest so broadcasts upload small, Telegram-ready files.
+
+    python media_pipeline.py            # every content folder
+    python media_pipeline.py voices     # one folder
+
+Images are scaled to fit 1280px (Telegram's photo size) and re-encoded as
+JPEG; voices become mono OGG/Opus; WAV/MP4 audio becomes MP3. Results go
+to a `.tg/` folder inside the media folder, and the file's `.info` sidecar
+records the copy with the source size/mtime it was made from plus the
+probed duration and dimensions. MediaCatalog sends the copy while it
+still matches the source. Uses ffmpeg/ffprobe and, when installed,
+Pillow for images; files are left as they are if the tools are missing.
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from typing import Dict, Optional
+
+from media_catalog import MEDIA_FOLDERS, load_info, processed_path
+from media_ingest import save_info
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except Exception:
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_DIR = '.tg'
+MAX_PHOTO_SIDE = 1280
+JPEG_QUALITY = 85
+
+FOLDER_KINDS = {
+    'random': 'image',
+    'morning': 'image',
+    'evening': 'image',
+    'prayers': 'image',
+    'voices': 'voice',
+    'audios': 'audio',
+}
+
+FFMPEG = shutil.which('ffmpeg')
+FFPROBE = shutil.which('ffprobe')
+
+
+def probe(path: str) -> dict:
+    """Duration (seconds), dimensions and codec of the first stream, via ffprobe."""
+    if not FFPROBE:
+        return {}
+    try:
+        out = subprocess.run(
+            [FFPROBE, '-v', 'error', '-show_entries', 'format=duration:stream=codec_name,width,height',
+             '-of', 'json', path],
+            capture_output=True, timeout=60, check=True
+        ).stdout
+        data = json.loads(out)
+    except Exception as e:
+        logger.warning("ffprobe failed for %s: %s", path, e)
+        return {}
+
+    meta = {}
+    stream = (data.get('streams') or [{}])[0]
+    if stream.get('codec_name'):
+        meta['codec'] = stream['codec_name']
+    if stream.get('width') and stream.get('height'):
+        meta['width'], meta['height'] = stream['width'], stream['height']
+    duration = data.get('format', {}).get('duration')
+    if duration and duration != 'N/A':
+        meta['duration'] = max(1, round(float(duration)))
+    return meta
+
+
+def _ffmpeg(args, output: str) -> bool:
+    tmp_path = f"{output}.tmp{os.path.splitext(output)[1]}"
+    try:
+        subprocess.run([FFMPEG, '-y', '-v', 'error', *args, tmp_path], capture_output=True, timeout=600, check=True)
+        os.replace(tmp_path, output)
+        return True
+    except Exception as e:
+        logger.warning("ffmpeg failed for %s: %s", output, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+
+
+def _convert_image(source: str, output: str) -> bool:
+    if HAS_PIL:
+        try:
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image).convert('RGB')
+                image.thumbnail((MAX_PHOTO_SIDE, MAX_PHOTO_SIDE))
+                tmp_path = f"{output}.tmp.jpg"
+                image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, output)
+            return True
+        except Exception as e:
+            logger.warning("could not re-encode %s with Pillow: %s", source, e)
+    if FFMPEG:
+        scale = (f"scale='min({MAX_PHOTO_SIDE},iw)':'min({MAX_PHOTO_SIDE},ih)'"
+                 ":force_original_aspect_ratio=decrease")
+        return _ffmpeg(['-i', source, '-vf', scale, '-q:v', '3'], output)
+    return False
+
+
+def _convert_voice(source: str, output: str) -> bool:
+    return bool(FFMPEG) and _ffmpeg(
+        ['-i', source, '-vn', '-ac', '1', '-ar', '48000', '-c:a', 'libopus', '-b:a', '32k',
+         '-application', 'voip'], output
+    )
+
+
+def _convert_audio(source: str, output: str) -> bool:
+    return bool(FFMPEG) and _ffmpeg(['-i', source, '-vn', '-c:a', 'libmp3lame', '-b:a', '128k'], output)
+
+
+def process_file(source: str, kind: str, force: bool = False) -> Optional[dict]:
+    """Preprocess one file and record the result in its sidecar. Returns the `processed` record."""
+    if not available():
+        return None
+    info_path = f"{source}.info"
+    info = load_info(info_path)
+    if not force and processed_path(source, info):
+        return info['processed']
+
+    name = os.path.basename(source)
+    stem, ext = os.path.splitext(name)
+    ext = ext.lower()
+    out_dir = os.path.join(os.path.dirname(source), PROCESSED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    meta = probe(source)
+    output = None
+    if kind == 'image':
+        output = os.path.join(out_dir, f"{stem}.jpg")
+        if not _convert_image(source, output):
+            output = None
+    elif kind == 'voice':
+        # already Opus in OGG: Telegram plays it as is
+        if not (ext == '.ogg' and meta.get('codec') == 'opus'):
+            output = os.path.join(out_dir, f"{stem}.ogg")
+            if not _convert_voice(source, output):
+                output = None
+    elif kind == 'audio':
+        if ext != '.mp3':
+            output = os.path.join(out_dir, f"{stem}.mp3")
+            if not _convert_audio(source, output):
+                output = None
+
+    # a re-encode that did not make the file smaller is not worth sending
+    if output and kind != 'voice' and os.path.getsize(output) >= os.path.getsize(source):
+        os.remove(output)
+        output = None
+
+    st = os.stat(source)
+    sent = output or source
+    record = {
+        'path': os.path.relpath(output, os.path.dirname(source)) if output else name,
+        'source_size': st.st_size,
+        'source_mtime_ns': st.st_mtime_ns,
+        'size': os.path.getsize(sent),
+        **(probe(output) if output else meta),
+    }
+    info['processed'] = record
+    save_info(info_path, info)
+    logger.info("preprocessed %s: %d -> %d bytes", source, st.st_size, record['size'])
+    return record
+
+
+def process_folder(path: str, kind: str, extensions=None, force: bool = False) -> Dict[str, int]:
+    """Preprocess every media file in a folder that has not been (or has changed since it was)."""
+    counts = {'processed': 0, 'failed': 0}
+    extensions = extensions or MEDIA_FOLDERS.get(os.path.basename(path), ())
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return counts
+    for name in names:
+        if not name.lower().endswith(extensions):
+            continue
+        try:
+            process_file(os.path.join(path, name), kind, force=force)
+            counts['processed'] += 1
+        except Exception as e:
+            logger.error("could not preprocess %s: %s", name, e)
+            counts['failed'] += 1
+    return counts
+
+
+def process_all(root: str = '', folders=None, force: bool = False) -> Dict[str, Dict[str, int]]:
+    return {
+        folder: process_folder(os.path.join(root, folder), FOLDER_KINDS[folder], force=force)
+        for folder in (folders or FOLDER_KINDS)
+    }
+
+
+def available() -> bool:
+    return bool(FFMPEG or HAS_PIL)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+    if not available():
+        logger.warning("neither ffmpeg nor Pillow is installed; nothing to do")
+        sys.exit(1)
+    args = [a for a in sys.argv[1:] if a != '--force']
+    for folder, counts in process_all(folders=args or None, force='--force' in sys.argv).items():
+        print(f"{folder}: {counts['processed']} processed, {counts['failed']} failed")
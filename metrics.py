@@ -0,0 +1,238 @@
+"""In-process metrics with Prometheus text exposition (stdlib only, cheap to import)."""
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Tuple
+
+# seconds; covers a fast Telegram call up to a slow upload
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Histogram:
+    """Fixed buckets; observe() is one bisect and three additions."""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Family:
+    """A metric name with its labelled children. Children are cached, so `labels()` is a dict lookup."""
+
+    def __init__(self, name: str, help_text: str, kind: str, labelnames: Tuple[str, ...], factory: Callable):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self._unlabelled = None if labelnames else self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    # the unlabelled shortcuts used by metrics without labels
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def set(self, value: float):
+        self._unlabelled.set(value)
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def children(self):
+        return list(self._children.items())
+
+
+class CallbackGauge:
+    """A gauge read from a function when metrics are collected (queue sizes, current rate...)."""
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], float]):
+        self.name = name
+        self.help = help_text
+        self.kind = 'gauge'
+        self.labelnames = ()
+        self.fn = fn
+
+    def children(self):
+        try:
+            return [((), _Value(float(self.fn())))]
+        except Exception:
+            return []
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self, value: float):
+        self.value = value
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_number(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def _register(self, name: str, help_text: str, kind: str, labelnames, factory):
+        with self._lock:
+            existing = self._metrics.get(name)
+            if existing is not None:
+                # importing the same instrumentation twice returns the same metric
+                return existing
+            family = Family(name, help_text, kind, tuple(labelnames), factory)
+            self._metrics[name] = family
+            return family
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Family:
+        return self._register(name, help_text, 'counter', labelnames, Counter)
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Family:
+        return self._register(name, help_text, 'gauge', labelnames, Gauge)
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Family:
+        bounds = tuple(sorted(buckets))
+        return self._register(name, help_text, 'histogram', labelnames, lambda: Histogram(bounds))
+
+    def gauge_callback(self, name: str, help_text: str, fn: Callable[[], float]):
+        """Register (or replace) a gauge computed at collection time."""
+        with self._lock:
+            self._metrics[name] = CallbackGauge(name, help_text, fn)
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, child in metric.children():
+                if metric.kind == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(child.bounds + (math.inf,), child.counts):
+                        cumulative += count
+                        le = 'le="%s"' % _format_number(bound)
+                        lines.append(f"{metric.name}_bucket{_format_labels(metric.labelnames, values, le)} {cumulative}")
+                    labels = _format_labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}_sum{labels} {_format_number(child.sum)}")
+                    lines.append(f"{metric.name}_count{labels} {child.count}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, values)} {_format_number(child.value)}")
+        return '\n'.join(lines) + '\n'
+
+    def as_dict(self) -> Dict[str, list]:
+        """A JSON-friendly summary (histograms as count/sum/avg)."""
+        summary = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            rows = []
+            for values, child in metric.children():
+                labels = dict(zip(metric.labelnames, values))
+                if metric.kind == 'histogram':
+                    avg = child.sum / child.count if child.count else 0.0
+                    rows.append({**labels, 'count': child.count, 'sum': round(child.sum, 6), 'avg': round(avg, 6)})
+                else:
+                    rows.append({**labels, 'value': child.value})
+            summary[metric.name] = rows
+        return summary
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# shared by every module that serves content from a cache
+CACHE_REQUESTS = REGISTRY.counter(
+    'azkar_cache_requests_total', 'Cache lookups by cache and result (hit/miss)', ('cache', 'result')
+)
+TELEGRAM_LATENCY = REGISTRY.histogram(
+    'azkar_telegram_request_seconds', 'Telegram Bot API request latency', ('method', 'status')
+)
+TELEGRAM_ERRORS = REGISTRY.counter(
+    'azkar_telegram_errors_total', 'Telegram responses that were not ok, by error code', ('code',)
+)
+
+
+def cache_counters(cache: str) -> Tuple[Counter, Counter]:
+    """(hit, miss) counters for one cache, resolved once so the hot path only calls .inc()."""
+    return CACHE_REQUESTS.labels(cache, 'hit'), CACHE_REQUESTS.labels(cache, 'miss')
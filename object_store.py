@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from metrics import REGISTRY
+
+STORE_LATENCY = REGISTRY.histogram(
+    'azkar_object_store_seconds', 'Object store call latency by operation and result', ('op', 'result')
+)
+# calls are timed on executor threads
+_latency_lock = threading.Lock()
+
+# boto3/botocore take a noticeable share of a cold start, so they are only
+# imported when an S3ObjectStore is actually created
+HAS_BOTO = importlib.util.find_spec('boto3') is not None
+
+
+class PreconditionFailed(Exception):
+    """A conditional put lost the race: the object is no longer at the expected version."""
+
+
+class ObjectStore(ABC):
+    """Key/value blob store with ETag-style versions.
+
+    Subclasses implement the blocking `_get`/`_put`; `get`/`put` record
+    their latency in STORE_LATENCY and `aget`/`aput` run them on a bounded
+    thread pool so async handlers never block the event loop on storage I/O.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='object-store')
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        ...
+
+    @abstractmethod
+    def _put(self, key: str, body: bytes, if_match: Optional[str], if_none_match: bool) -> str:
+        ...
+
+    def _timed(self, op: str, fn, *args):
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            value = fn(*args)
+            result = 'ok'
+            return value
+        except PreconditionFailed:
+            result = 'conflict'
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with _latency_lock:
+                STORE_LATENCY.labels(op, result).observe(elapsed)
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """(body, etag), or None if the key does not exist."""
+        return self._timed('get', self._get, key)
+
+    def put(self, key: str, body: bytes, if_match: str = None, if_none_match: bool = False) -> str:
+        """Store body and return its etag. Raises PreconditionFailed if the condition does not hold."""
+        return self._timed('put', self._put, key, body, if_match, if_none_match)
+
+    async def aget(self, key: str) -> Optional[Tuple[bytes, str]]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.get, key)
+
+    async def aput(self, key: str, body: bytes, if_match: str = None, if_none_match: bool = False) -> str:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.put, key, body, if_match, if_none_match
+        )
+
+
+class S3ObjectStore(ObjectStore):
+    """One long-lived boto3 client (thread-safe, pooled connections) shared by all calls."""
+
+    def __init__(self, bucket: str, endpoint_url: str = None, max_workers: int = 8):
+        import boto3
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+
+        super().__init__(max_workers=max_workers)
+        self.bucket = bucket
+        self._client_error = ClientError
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            config=Config(
+                max_pool_connections=max_workers,
+                connect_timeout=3,
+                read_timeout=10,
+                retries={'max_attempts': 3, 'mode': 'standard'},
+            ),
+        )
+
+    @staticmethod
+    def _error_code(e) -> str:
+        return e.response.get('Error', {}).get('Code', '')
+
+    def _get(self, key):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self._client_error as e:
+            if self._error_code(e) in ('NoSuchKey', '404'):
+                return None
+            raise
+        return obj['Body'].read(), obj['ETag']
+
+    def _put(self, key, body, if_match, if_none_match):
+        condition = {}
+        if if_match:
+            condition['IfMatch'] = if_match
+        elif if_none_match:
+            condition['IfNoneMatch'] = '*'
+        try:
+            resp = self.client.put_object(Bucket=self.bucket, Key=key, Body=body, **condition)
+        except self._client_error as e:
+            if self._error_code(e) in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                raise PreconditionFailed(key) from e
+            raise
+        return resp['ETag']
+
+
+class FileObjectStore(ObjectStore):
+    """Filesystem stand-in for S3 with the same conditional-write semantics (etag = md5 of the body)."""
+
+    def __init__(self, root: str, max_workers: int = 4):
+        super().__init__(max_workers=max_workers)
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    @staticmethod
+    def _etag(body: bytes) -> str:
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        return body, self._etag(body)
+
+    def _put(self, key, body, if_match, if_none_match):
+        import fcntl
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # thread lock for this process, flock for other processes sharing the directory
+        with self._lock, open(f"{path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if if_match or if_none_match:
+                current = self._get(key)
+                if if_none_match and current is not None:
+                    raise PreconditionFailed(key)
+                if if_match and (current is None or current[1] != if_match):
+                    raise PreconditionFailed(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        return self._etag(body)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    deadline REAL,
+    finished INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    broadcast_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (broadcast_id, chat_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS deliveries_cursor ON deliveries (broadcast_id, done, seq);
+"""
+
+
+class OutboxBroadcast:
+    """One recorded broadcast and its per-chat delivery cursor.
+
+    Marks are buffered and written in batches; anything not yet flushed when
+    the process dies is simply sent again on resume (at-least-once).
+    """
+
+    def __init__(self, outbox: 'Outbox', broadcast_id: int, job: str, payload: dict, deadline: Optional[float]):
+        self.outbox = outbox
+        self.id = broadcast_id
+        self.job = job
+        self.payload = payload
+        self.deadline = deadline
+        self._marked: List[tuple] = []
+        self._flushed_at = time.monotonic()
+
+    def expired(self, now: float = None) -> bool:
+        return self.deadline is not None and (now or time.time()) > self.deadline
+
+    async def pending(self) -> List[int]:
+        """Chats not delivered yet, in original broadcast order."""
+        return await self.outbox._run(self._pending)
+
+    def _pending(self) -> List[int]:
+        rows = self.outbox.db.execute(
+            "SELECT chat_id FROM deliveries WHERE broadcast_id = ? AND done = 0 ORDER BY seq",
+            (self.id,)
+        )
+        return [row[0] for row in rows]
+
+    def mark(self, chat_id: int):
+        """Record one delivery; full batches are written in the background."""
+        self._marked.append((self.id, chat_id))
+        if (len(self._marked) >= self.outbox.flush_every
+                or time.monotonic() - self._flushed_at >= self.outbox.flush_interval):
+            self._flushed_at = time.monotonic()
+            marked, self._marked = self._marked, []
+            self.outbox._submit(self._write_marks, marked)
+
+    def _write_marks(self, marked: List[tuple]):
+        with self.outbox.db:
+            self.outbox.db.executemany(
+                "UPDATE deliveries SET done = 1 WHERE broadcast_id = ? AND chat_id = ?", marked
+            )
+
+    async def flush(self):
+        """Write the buffered marks; returns once every earlier batch is on disk too."""
+        self._flushed_at = time.monotonic()
+        marked, self._marked = self._marked, []
+        await self.outbox._run(self._write_marks, marked)
+
+    async def finish(self):
+        self._marked.clear()
+        await self.outbox._run(self._finish)
+
+    def _finish(self):
+        with self.outbox.db:
+            self.outbox.db.execute("DELETE FROM deliveries WHERE broadcast_id = ?", (self.id,))
+            self.outbox.db.execute("UPDATE broadcasts SET finished = 1 WHERE id = ?", (self.id,))
+
+
+class Outbox:
+    """SQLite-backed log of broadcasts so an interrupted one can resume after a restart.
+
+    All database work runs on one background thread, so a broadcast to
+    100k chats never stalls the event loop on inserts or commits, and
+    writes land in the order they were issued.
+    """
+
+    def __init__(self, path: str = 'outbox.sqlite3', flush_every: int = 1000, flush_interval: float = 2.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # only the executor thread touches the connection after this point
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _submit(self, fn, *args):
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(_log_failure)
+
+    async def create(self, job: str, payload: dict, chat_ids, deadline: float = None) -> OutboxBroadcast:
+        chat_ids = [int(chat_id) for chat_id in chat_ids]
+        broadcast_id = await self._run(self._create, job, payload, chat_ids, deadline)
+        return OutboxBroadcast(self, broadcast_id, job, payload, deadline)
+
+    def _create(self, job: str, payload: dict, chat_ids: List[int], deadline: Optional[float]) -> int:
+        payload_json = json.dumps(payload, ensure_ascii=False)
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO broadcasts (job, payload, created_at, deadline) VALUES (?, ?, ?, ?)",
+                (job, payload_json, time.time(), deadline)
+            )
+            broadcast_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT OR IGNORE INTO deliveries (broadcast_id, chat_id, seq) VALUES (?, ?, ?)",
+                ((broadcast_id, chat_id, seq) for seq, chat_id in enumerate(chat_ids))
+            )
+        return broadcast_id
+
+    async def unfinished(self, job: str = None) -> List[OutboxBroadcast]:
+        """Interrupted broadcasts still worth resuming; ones past their deadline are dropped."""
+        return await self._run(self._unfinished, job)
+
+    def _unfinished(self, job: Optional[str]) -> List[OutboxBroadcast]:
+        query = "SELECT id, job, payload, deadline FROM broadcasts WHERE finished = 0"
+        params = ()
+        if job is not None:
+            query += " AND job = ?"
+            params = (job,)
+
+        resumable = []
+        now = time.time()
+        for broadcast_id, job_name, payload, deadline in self.db.execute(query + " ORDER BY id", params).fetchall():
+            broadcast = OutboxBroadcast(self, broadcast_id, job_name, json.loads(payload), deadline)
+            if broadcast.expired(now):
+                logger.info("outbox: dropping expired broadcast %s (%s)", broadcast_id, job_name)
+                broadcast._finish()
+            else:
+                resumable.append(broadcast)
+        return resumable
+
+    async def purge(self, older_than: float = 86400):
+        await self._run(self._purge, older_than)
+
+    def _purge(self, older_than: float):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM broadcasts WHERE finished = 1 AND created_at < ?", (time.time() - older_than,)
+            )
+
+    def close(self):
+        # let queued writes finish before the connection goes away
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("outbox: could not record deliveries: %s", future.exception())
@@ -0,0 +1,148 @@
+"""Offline prayer-time calculation (same astronomy as praytimes.org / api.aladhan.com)."""
+import math
+from array import array
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+PRAYERS = ('Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha')
+
+# twilight angles in degrees, or a fixed delay after maghrib in minutes
+METHODS = {
+    # Egyptian General Authority of Survey (aladhan method 5)
+    'egypt': {'fajr': 19.5, 'isha': 17.5},
+    # Gulf Region (aladhan method 8, what the bot used to request)
+    'gulf': {'fajr': 19.5, 'isha_minutes': 90},
+    # Muslim World League (aladhan method 3)
+    'mwl': {'fajr': 18.0, 'isha': 17.0},
+    # Umm al-Qura (aladhan method 4)
+    'makkah': {'fajr': 18.5, 'isha_minutes': 90},
+}
+
+CAIRO = (30.0444, 31.2357, 'Africa/Cairo')
+
+_SUNRISE_ANGLE = 0.833
+
+
+def _sin(d): return math.sin(math.radians(d))
+def _cos(d): return math.cos(math.radians(d))
+def _tan(d): return math.tan(math.radians(d))
+def _asin(x): return math.degrees(math.asin(x))
+def _acos(x): return math.degrees(math.acos(x))
+def _atan2(y, x): return math.degrees(math.atan2(y, x))
+def _acot(x): return math.degrees(math.atan(1 / x))
+
+
+def _fix(a, b):
+    a = a - b * math.floor(a / b)
+    return a + b if a < 0 else a
+
+
+def _julian(d: date) -> float:
+    year, month = d.year, d.month
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = year // 100
+    b = 2 - a + a // 4
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + d.day + b - 1524.5
+
+
+def _sun_position(jd: float):
+    """(declination, equation of time in hours) for a Julian date."""
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360)
+    q = _fix(280.459 + 0.98564736 * d, 360)
+    l = _fix(q + 1.915 * _sin(g) + 0.020 * _sin(2 * g), 360)
+    e = 23.439 - 0.00000036 * d
+    ra = _atan2(_cos(e) * _sin(l), _cos(l)) / 15
+    eqt = q / 15 - _fix(ra, 24)
+    return _asin(_sin(e) * _sin(l)), eqt
+
+
+class PrayerCalendar:
+    """Prayer times for one location, computed locally and cached a whole year at a time.
+
+    The year table stores minutes after local midnight per prayer in a flat
+    `array('H')`, so lookups are an index calculation plus formatting.
+    """
+
+    def __init__(self, latitude: float, longitude: float, timezone: str, method: str = 'egypt', asr_factor: int = 1):
+        if method not in METHODS:
+            raise ValueError(f"unknown calculation method: {method}")
+        self.latitude = latitude
+        self.longitude = longitude
+        self.tz = ZoneInfo(timezone)
+        self.method = METHODS[method]
+        self.asr_factor = asr_factor
+        self._years: Dict[int, array] = {}
+
+    # -- astronomy ---------------------------------------------------------
+
+    def _mid_day(self, jd: float, t: float) -> float:
+        return _fix(12 - _sun_position(jd + t)[1], 24)
+
+    def _sun_angle_time(self, jd: float, angle: float, t: float, before_noon: bool = False) -> float:
+        decl = _sun_position(jd + t)[0]
+        noon = self._mid_day(jd, t)
+        cos_h = (-_sin(angle) - _sin(decl) * _sin(self.latitude)) / (_cos(decl) * _cos(self.latitude))
+        # polar day/night: clamp instead of failing
+        h = _acos(max(-1.0, min(1.0, cos_h))) / 15
+        return noon - h if before_noon else noon + h
+
+    def _asr_time(self, jd: float, t: float) -> float:
+        decl = _sun_position(jd + t)[0]
+        angle = -_acot(self.asr_factor + _tan(abs(self.latitude - decl)))
+        return self._sun_angle_time(jd, angle, t)
+
+    def _day_minutes(self, day: date):
+        """Minutes after local midnight for each of PRAYERS on `day`."""
+        jd = _julian(day) - self.longitude / (15 * 24)
+        offset = datetime.combine(day, time(12), self.tz).utcoffset().total_seconds() / 3600
+
+        # first guesses (in hours) refined by one iteration, like praytimes.org
+        guess = {'fajr': 5, 'dhuhr': 12, 'asr': 13, 'sunset': 18, 'isha': 18}
+        t = {k: v / 24 for k, v in guess.items()}
+        times = {
+            'fajr': self._sun_angle_time(jd, self.method['fajr'], t['fajr'], before_noon=True),
+            'dhuhr': self._mid_day(jd, t['dhuhr']),
+            'asr': self._asr_time(jd, t['asr']),
+            'sunset': self._sun_angle_time(jd, _SUNRISE_ANGLE, t['sunset']),
+        }
+        if 'isha' in self.method:
+            times['isha'] = self._sun_angle_time(jd, self.method['isha'], t['isha'])
+
+        shift = offset - self.longitude / 15
+        hours = {k: v + shift for k, v in times.items()}
+        if 'isha_minutes' in self.method:
+            hours['isha'] = hours['sunset'] + self.method['isha_minutes'] / 60
+
+        # round to the nearest minute
+        return tuple(
+            int(_fix(hours[k] + 0.5 / 60, 24) * 60)
+            for k in ('fajr', 'dhuhr', 'asr', 'sunset', 'isha')
+        )
+
+    # -- lookup ------------------------------------------------------------
+
+    def year(self, year: int) -> array:
+        """Compute (once) and return the flat minutes table for `year`."""
+        table = self._years.get(year)
+        if table is None:
+            start = date(year, 1, 1)
+            days = (date(year + 1, 1, 1) - start).days
+            table = array('H')
+            for i in range(days):
+                table.extend(self._day_minutes(start + timedelta(days=i)))
+            self._years[year] = table
+        return table
+
+    def minutes(self, day: date) -> tuple:
+        table = self.year(day.year)
+        i = (day.toordinal() - date(day.year, 1, 1).toordinal()) * len(PRAYERS)
+        return tuple(table[i:i + len(PRAYERS)])
+
+    def timings(self, day: Optional[date] = None) -> Dict[str, str]:
+        """{'Fajr': 'HH:MM', ...} in local time, the same shape api.aladhan.com returns."""
+        day = day or datetime.now(self.tz).date()
+        return {name: f"{m // 60:02d}:{m % 60:02d}" for name, m in zip(PRAYERS, self.minutes(day))}
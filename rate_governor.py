@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Tuple
+
+from log_pipeline import log_sampled
+
+logger = logging.getLogger(__name__)
+
+
+class RateGovernor:
+    """Global + per-chat token buckets steered by Telegram's 429 feedback.
+
+    The global rate starts at `max_rate` (Telegram allows ~30 msg/s per
+    bot; 0 means no global cap). Every 429 halves it (down to `min_rate`) and pauses all sends for
+    the `retry_after` Telegram asked for; each `probe_every` consecutive
+    successes then add `increase` msg/s back until `max_rate` again (AIMD).
+    Group chats also get their own bucket so no group receives more than
+    ~20 messages a minute.
+    """
+
+    def __init__(self, max_rate: float = 30.0, min_rate: float = 1.0, increase: float = 1.0,
+                 decrease: float = 0.5, probe_every: int = 50,
+                 chat_per_minute: int = 20, chat_burst: int = 5):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.probe_every = probe_every
+        self.rate = max_rate
+        self.chat_rate = max(chat_per_minute - chat_burst, 1) / 60.0
+        self.chat_burst = chat_burst
+
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._successes = 0
+        self._chats: Dict[int, Tuple[float, float]] = {}
+        self.rate_limited = 0
+
+    @property
+    def current_rate(self) -> float:
+        return self.rate
+
+    def _reserve_chat(self, chat_id: int, now: float) -> float:
+        """Take one token from the chat's bucket; returns how long to wait for it."""
+        tokens, updated = self._chats.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - updated) * self.chat_rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / self.chat_rate
+        self._chats[chat_id] = (tokens - 1, now)
+        if len(self._chats) > 50000:
+            self._prune(now)
+        return wait
+
+    def _prune(self, now: float):
+        # a bucket left alone long enough is full again and can be forgotten
+        idle = self.chat_burst / self.chat_rate
+        self._chats = {c: v for c, v in self._chats.items() if now - v[1] < idle}
+
+    async def acquire(self, chat_id: int = None):
+        if chat_id is not None and chat_id < 0:
+            wait = self._reserve_chat(chat_id, time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        now = time.monotonic()
+        slot = max(now, self._next_slot, self._paused_until)
+        self._next_slot = slot + (1.0 / self.rate if self.rate > 0 else 0.0)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        # a 429 that arrived while we slept pushes everyone back
+        paused = self._paused_until - time.monotonic()
+        if paused > 0:
+            await asyncio.sleep(paused)
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.probe_every and self.rate < self.max_rate:
+            self._successes = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, retry_after: float = 1.0, chat_id: int = None):
+        self.rate_limited += 1
+        self._successes = 0
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + retry_after)
+        self._next_slot = max(self._next_slot, self._paused_until)
+        log_sampled(logger, logging.WARNING, 'rate_limited',
+                    "rate limited (chat %s): pausing %.1fs, rate now %.1f msg/s", chat_id, retry_after, self.rate)
+
+    def stats(self) -> dict:
+        return {
+            'rate': round(self.rate, 2),
+            'max_rate': self.max_rate,
+            'rate_limited': self.rate_limited,
+            'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 2),
+        }
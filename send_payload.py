@@ -0,0 +1,87 @@
+import json
+from typing import Dict, Optional, Tuple
+
+JSON_CONTENT_TYPE = 'application/json'
+
+# method and file field of each media kind
+MEDIA_METHODS = {
+    'photo': ('sendPhoto', 'photo'),
+    'voice': ('sendVoice', 'voice'),
+    'audio': ('sendAudio', 'audio'),
+}
+
+
+def _encode(fields: dict) -> bytes:
+    return json.dumps(fields, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class PayloadTemplate:
+    """A Bot API request body serialized once, with only `chat_id` left to fill in.
+
+    The JSON after `chat_id` is encoded at construction; `body(chat_id)` is a
+    single bytes format, so sending the same request to many chats costs no
+    dict building or JSON encoding per recipient.
+    """
+
+    __slots__ = ('method', 'fields', '_tail')
+
+    def __init__(self, method: str, fields: dict):
+        self.method = method
+        self.fields = fields
+        encoded = _encode(fields)
+        self._tail = b',' + encoded[1:] if fields else b'}'
+
+    def body(self, chat_id: int) -> bytes:
+        return b'{"chat_id":%d%s' % (chat_id, self._tail)
+
+
+def text_template(text: str, reply_markup: dict = None) -> PayloadTemplate:
+    fields = {'text': text, 'parse_mode': 'Markdown', 'disable_web_page_preview': True}
+    if reply_markup:
+        fields['reply_markup'] = reply_markup
+    return PayloadTemplate('sendMessage', fields)
+
+
+class MediaTemplate:
+    """The constant part of a media broadcast: method, keyboard, parse mode and default caption.
+
+    The file can differ per chat, so a PayloadTemplate is kept per
+    (file_id, caption) the first time it is needed; a broadcast touches a
+    handful of files, so that is a handful of encodes per tick. `form_fields`
+    are the same fields as strings for the multipart upload of a new file.
+    """
+
+    __slots__ = ('kind', 'method', 'field', 'caption', 'reply_markup', '_by_file', '_markup_json')
+
+    def __init__(self, kind: str, caption: str = None, reply_markup: dict = None):
+        self.kind = kind
+        self.method, self.field = MEDIA_METHODS[kind]
+        self.caption = caption
+        self.reply_markup = reply_markup
+        self._markup_json = json.dumps(reply_markup, ensure_ascii=False) if reply_markup else None
+        self._by_file: Dict[Tuple[str, Optional[str]], PayloadTemplate] = {}
+
+    def _fields(self, caption: Optional[str]) -> dict:
+        fields = {}
+        if caption:
+            fields['caption'] = caption
+            fields['parse_mode'] = 'Markdown'
+        return fields
+
+    def for_file(self, file_id: str, caption: str = None) -> PayloadTemplate:
+        caption = caption or self.caption
+        key = (file_id, caption)
+        template = self._by_file.get(key)
+        if template is None:
+            fields = self._fields(caption)
+            fields[self.field] = file_id
+            if self.reply_markup:
+                fields['reply_markup'] = self.reply_markup
+            template = self._by_file[key] = PayloadTemplate(self.method, fields)
+        return template
+
+    def form_fields(self, chat_id: int, caption: str = None) -> Dict[str, str]:
+        fields = {'chat_id': str(chat_id), **self._fields(caption or self.caption)}
+        if self._markup_json:
+            fields['reply_markup'] = self._markup_json
+        return fields
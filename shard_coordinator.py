@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import FrozenSet, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS partitions (
+    partition INTEGER PRIMARY KEY,
+    owner TEXT,
+    expires REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leader (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS removed_groups (
+    chat_id INTEGER PRIMARY KEY
+);
+"""
+
+
+def partition_of(chat_id: int, partitions: int) -> int:
+    """Deterministic partition of a chat, the same in every process and on every machine."""
+    return zlib.crc32(str(chat_id).encode()) % partitions
+
+
+class ShardCoordinator:
+    """Splits the groups between worker processes with leases in a shared SQLite file.
+
+    Groups are hashed into `partitions` partitions. Every heartbeat a worker
+    renews its leases, gives back partitions above its fair share (partitions
+    / live workers) and claims free or expired ones up to it, so a new worker
+    is handed partitions within a heartbeat or two and a dead worker's
+    partitions move once its leases expire. A worker only broadcasts to
+    partitions whose lease it holds, so no group is sent to twice.
+
+    One worker additionally holds the leader lease and is the only one that
+    talks to getUpdates (two pollers would get 409 Conflict). Followers do
+    not persist the group registry; removals they notice are queued here
+    for the leader to apply.
+
+    The shared file can be locked by another worker for seconds, so all
+    database work runs on one background thread. Reported removals are
+    buffered and written with the next heartbeat, in its transaction.
+    """
+
+    def __init__(self, path: str = 'shards.sqlite3', partitions: int = 64, worker_id: str = None,
+                 lease_seconds: float = 15.0):
+        self.path = path
+        self.partitions = partitions
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.owned: FrozenSet[int] = frozenset()
+        self.is_leader = False
+        self._valid_until = 0.0
+        self._reported: List[int] = []
+        self._taken: List[int] = []
+        # only the executor thread touches the connection after this point
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+        self.db.executemany(
+            "INSERT OR IGNORE INTO partitions (partition) VALUES (?)",
+            ((p,) for p in range(partitions))
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shard-coordinator')
+
+    async def heartbeat(self) -> FrozenSet[int]:
+        """Renew, shed and claim partitions; returns the partitions now owned."""
+        reported, self._reported = self._reported, []
+        try:
+            mine, self.is_leader, expires, taken = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._heartbeat, reported
+            )
+        except Exception:
+            # written with the next heartbeat instead
+            self._reported = reported + self._reported
+            raise
+        self._taken += taken
+
+        owned = frozenset(mine)
+        if owned != self.owned:
+            logger.info("worker %s owns %d/%d partitions (leader=%s)",
+                        self.worker_id, len(owned), self.partitions, self.is_leader)
+        self.owned = owned
+        self._valid_until = expires
+        return owned
+
+    def _heartbeat(self, reported: List[int]) -> Tuple[List[int], bool, float, List[int]]:
+        now = time.time()
+        expires = now + self.lease_seconds
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO workers (worker, heartbeat) VALUES (?, ?)", (self.worker_id, now))
+            db.execute("DELETE FROM workers WHERE heartbeat < ?", (now - self.lease_seconds,))
+            live = db.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+            share = math.ceil(self.partitions / max(live, 1))
+
+            mine = [row[0] for row in db.execute(
+                "SELECT partition FROM partitions WHERE owner = ? AND expires >= ? ORDER BY partition",
+                (self.worker_id, now)
+            )]
+            if len(mine) > share:
+                # hand the surplus back; other workers pick it up on their next heartbeat
+                surplus = mine[share:]
+                db.executemany("UPDATE partitions SET owner = NULL, expires = 0 WHERE partition = ?",
+                               ((p,) for p in surplus))
+                mine = mine[:share]
+            elif len(mine) < share:
+                free = [row[0] for row in db.execute(
+                    "SELECT partition FROM partitions WHERE owner IS NULL OR expires < ? ORDER BY partition LIMIT ?",
+                    (now, share - len(mine))
+                )]
+                mine += free
+
+            db.executemany("UPDATE partitions SET owner = ?, expires = ? WHERE partition = ?",
+                           ((self.worker_id, expires, p) for p in mine))
+
+            leader = db.execute("SELECT owner, expires FROM leader WHERE name = 'poller'").fetchone()
+            is_leader = leader is None or leader[0] == self.worker_id or leader[1] < now
+            if is_leader:
+                db.execute("INSERT OR REPLACE INTO leader (name, owner, expires) VALUES ('poller', ?, ?)",
+                           (self.worker_id, expires))
+
+            db.executemany("INSERT OR IGNORE INTO removed_groups (chat_id) VALUES (?)", ((c,) for c in reported))
+            taken = []
+            if is_leader:
+                taken = [row[0] for row in db.execute("SELECT chat_id FROM removed_groups")]
+                db.execute("DELETE FROM removed_groups")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return mine, is_leader, expires, taken
+
+    def _current(self) -> FrozenSet[int]:
+        # leases we failed to renew are no longer ours to act on
+        return self.owned if time.time() < self._valid_until else frozenset()
+
+    def owns(self, chat_id: int) -> bool:
+        return partition_of(chat_id, self.partitions) in self._current()
+
+    def filter(self, chat_ids: Iterable[int]) -> List[int]:
+        owned = self._current()
+        partitions = self.partitions
+        return [c for c in chat_ids if partition_of(c, partitions) in owned]
+
+    def leading(self) -> bool:
+        return self.is_leader and time.time() < self._valid_until
+
+    def report_removed(self, chat_id: int):
+        """Queue a removal for the leader; it is written with the next heartbeat."""
+        self._reported.append(chat_id)
+
+    def take_removed(self) -> List[int]:
+        """Removals reported by followers, collected by the last heartbeats (the leader applies them)."""
+        taken, self._taken = self._taken, []
+        return taken
+
+    def _release(self, reported: List[int]):
+        db = self.db
+        db.executemany("INSERT OR IGNORE INTO removed_groups (chat_id) VALUES (?)", ((c,) for c in reported))
+        db.execute("UPDATE partitions SET owner = NULL, expires = 0 WHERE owner = ?", (self.worker_id,))
+        db.execute("DELETE FROM leader WHERE owner = ?", (self.worker_id,))
+        db.execute("DELETE FROM workers WHERE worker = ?", (self.worker_id,))
+
+    def release(self):
+        """Give up everything at shutdown so the other workers take over immediately."""
+        reported, self._reported = self._reported, []
+        try:
+            # after any heartbeat still queued on the executor
+            self._executor.submit(self._release, reported).result()
+        except Exception as e:
+            logger.error("could not release shard leases: %s", e)
+        self._executor.shutdown(wait=False)
+        self.owned = frozenset()
+        self.is_leader = False
+
+    async def run(self, is_running=lambda: True, on_beat=None):
+        interval = self.lease_seconds / 3
+        while is_running():
+            try:
+                await self.heartbeat()
+                if on_beat is not None:
+                    on_beat()
+            except Exception as e:
+                logger.error("shard heartbeat failed: %s", e)
+            await asyncio.sleep(interval)
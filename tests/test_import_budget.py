@@ -0,0 +1,26 @@
+"""Cold-start budgets of the serverless entry points (see bench/import_budget.py).
+
+Set IMPORT_BUDGET_SCALE on slow machines to multiply every budget.
+"""
+import importlib.util
+import os
+
+import pytest
+
+from bench.import_budget import BUDGETS, measure
+
+SCALE = float(os.getenv('IMPORT_BUDGET_SCALE', '1'))
+
+
+@pytest.mark.parametrize('path', sorted(BUDGETS))
+def test_entry_point_within_budget(path):
+    if path == 'api/webhook.py' and importlib.util.find_spec('fastapi') is None:
+        pytest.skip('fastapi is not installed')
+    budget, forbidden = BUDGETS[path]
+
+    result = measure(path)
+
+    assert 'error' not in result, result.get('error')
+    loaded = sorted(set(result['modules']) & set(forbidden))
+    assert not loaded, f"{path} imports {', '.join(loaded)} at load time"
+    assert result['ms'] <= budget * SCALE, f"{path} took {result['ms']:.1f} ms (budget {budget * SCALE:.0f} ms)"
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+UPDATE_LATENCY = REGISTRY.histogram('azkar_update_handle_seconds', 'Time spent handling one update')
+
+
+def update_chat_key(update: dict) -> Optional[int]:
+    """The chat an update belongs to; updates of one chat are handled in order."""
+    if 'message' in update:
+        return update['message'].get('chat', {}).get('id')
+    if 'callback_query' in update:
+        query = update['callback_query']
+        chat_id = query.get('message', {}).get('chat', {}).get('id')
+        return chat_id if chat_id is not None else query.get('from', {}).get('id')
+    return None
+
+
+class UpdateDispatcher:
+    """Runs update handlers concurrently while keeping per-chat order.
+
+    The getUpdates offset only moves past an update once it and every
+    earlier one have finished, so a crash never acknowledges unhandled
+    updates. Updates re-delivered while still in flight are skipped.
+    `limit` grows while batches come back full and shrinks when idle.
+
+    Pushed (webhook) updates arrive over concurrent connections in no
+    particular order, so they bypass the offset and are deduplicated
+    against the last `recent_size` update ids instead.
+    """
+
+    def __init__(self, handler, concurrency: int = 16, min_limit: int = 10, max_limit: int = 100,
+                 max_in_flight: int = 500, recent_size: int = 4096):
+        self.handler = handler
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min_limit
+        self.max_in_flight = max_in_flight
+        self.recent_size = recent_size
+        self._recent: 'OrderedDict[int, None]' = OrderedDict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tails: Dict[Optional[int], asyncio.Task] = {}
+        self._pending: Set[int] = set()
+        self._done: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._offset = 0
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+
+        self.handled = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def offset(self) -> int:
+        """Offset to pass to getUpdates: one past the last update that is committed along with all before it."""
+        return self._offset
+
+    @offset.setter
+    def offset(self, value: int):
+        self._offset = value
+
+    def _commit(self):
+        # Telegram hands out updates in id order, so everything below the
+        # lowest unfinished id has been handled
+        if self._pending:
+            committed = min(self._pending)
+        elif self._done:
+            committed = max(self._done) + 1
+        else:
+            return
+        if committed > self._offset:
+            self._offset = committed
+            self._done = {u for u in self._done if u >= committed}
+
+    def submit_batch(self, updates: list):
+        fresh = 0
+        for update in updates:
+            update_id = update['update_id']
+            if update_id < self._offset or update_id in self._pending or update_id in self._done:
+                continue
+            fresh += 1
+            self._submit(update)
+
+        if len(updates) >= self.limit:
+            self.limit = min(self.max_limit, self.limit * 2)
+        elif not updates:
+            self.limit = max(self.min_limit, self.limit // 2)
+        return fresh
+
+    def submit_pushed(self, update: dict) -> bool:
+        """Handle one update delivered by webhook. Returns False for a redelivery."""
+        update_id = update['update_id']
+        if update_id in self._recent:
+            return False
+        self._recent[update_id] = None
+        if len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+        self._submit(update, pushed=True)
+        return True
+
+    def _submit(self, update: dict, pushed: bool = False):
+        update_id = update['update_id']
+        key = update_chat_key(update)
+        self._pending.add(update_id)
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(update, previous))
+        self._tails[key] = task
+        self._tasks.add(task)
+        if len(self._pending) >= self.max_in_flight:
+            self._capacity.clear()
+
+        def finished(t, key=key, update_id=update_id):
+            self._tasks.discard(t)
+            self._pending.discard(update_id)
+            if self._tails.get(key) is t:
+                del self._tails[key]
+            if not pushed:
+                self._done.add(update_id)
+                self._commit()
+            if len(self._pending) < self.max_in_flight:
+                self._capacity.set()
+
+        task.add_done_callback(finished)
+
+    async def _run(self, update: dict, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            try:
+                await asyncio.shield(previous)
+            except Exception:
+                pass
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                await self.handler(update)
+            except Exception as e:
+                logger.error("update %s failed: %s", update.get('update_id'), e)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.handled += 1
+                self.total_latency += elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+                UPDATE_LATENCY.observe(elapsed)
+                if elapsed > 5:
+                    logger.warning("update %s took %.2fs", update.get('update_id'), elapsed)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def wait_capacity(self):
+        await self._capacity.wait()
+
+    async def drain(self, timeout: float = 10.0):
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            'handled': self.handled,
+            'in_flight': len(self._pending),
+            'limit': self.limit,
+            'avg_ms': round(self.total_latency / self.handled * 1000, 2) if self.handled else 0.0,
+            'max_ms': round(self.max_latency * 1000, 2),
+        }
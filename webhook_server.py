@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import json
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from metrics import REGISTRY, CONTENT_TYPE
+from update_dispatcher import UpdateDispatcher
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def default_secret(bot_token: str) -> str:
+    """A stable secret derived from the bot token (Telegram allows 1-256 chars of A-Z, a-z, 0-9, _ and -)."""
+    return hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()[:48]
+
+
+class WebhookServer:
+    """Embedded aiohttp receiver for updates pushed by Telegram.
+
+    Each request is checked against the secret header, handed to the same
+    UpdateDispatcher the polling loop uses and acknowledged right away;
+    handlers keep running after the 200 is sent. When the dispatcher is
+    full the acknowledgement waits, which makes Telegram hold back (it
+    never has more than `max_connections` requests open).
+    """
+
+    def __init__(self, dispatcher: UpdateDispatcher, secret: str, path: str = '/telegram',
+                 host: str = '0.0.0.0', port: int = 8080):
+        self.dispatcher = dispatcher
+        self.secret = secret
+        self.path = path
+        self.host = host
+        self.port = port
+        self.received = 0
+        self.rejected = 0
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(client_max_size=1024 * 1024)
+        self.app.router.add_post(self.path, self.handle)
+        self.app.router.add_get('/healthz', self.health)
+        self.app.router.add_get('/metrics', self.metrics)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token, self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+
+        try:
+            update = json.loads(await request.read())
+            update['update_id']
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        await self.dispatcher.wait_capacity()
+        self.dispatcher.submit_pushed(update)
+        self.received += 1
+        return web.Response(status=200)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({'ok': True, 'received': self.received, **self.dispatcher.stats()})
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("webhook server listening on %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None